@@ -0,0 +1,119 @@
+import math
+import numpy as np
+from gravity import accelerations, potential_energy
+from integrators import BlockTimestep, make_integrator
+from simulation import SimulationSettings
+
+
+class BatchSimulation:
+
+    """
+    B independent copies of a small system advanced in lockstep
+
+    State is held as ( B, N, 2 ) position and velocity arrays and ( B, N ) masses,
+    so thousands of variants of the same system ( e.g. the spawn_planets preset
+    with a different extra planet each ) advance in one vectorized step instead
+    of one Simulation each.
+
+    The force kernel and integrators are the same code the single Simulation uses,
+    applied over the leading batch axis, so every scenario evolves bit for bit
+    the same as it would alone. Every scenario must have the same number of bodies.
+    Only the direct gravity solver and the fixed step integrators are supported,
+    and bodies never merge, so settings.collisions must be off.
+    """
+
+    def __init__(self, positions, velocities, masses, settings=None) -> None:
+        self.settings = settings if settings is not None else SimulationSettings()
+        self.positions = np.array(positions, dtype=np.float64)
+        self.velocities = np.array(velocities, dtype=np.float64)
+        self.masses = np.array(masses, dtype=np.float64)
+
+        if( self.positions.ndim != 3 or self.positions.shape[-1] != 2 ):
+            raise ValueError("positions must have shape ( B, N, 2 )")
+        if( self.velocities.shape != self.positions.shape or self.masses.shape != self.positions.shape[:2] ):
+            raise ValueError("velocities must have shape ( B, N, 2 ) and masses ( B, N )")
+
+        # Simulated time in seconds
+        self.time = 0.0
+        # Number of steps taken
+        self.steps = 0
+        self._integrator = None
+
+    @classmethod
+    def from_simulations(cls, simulations, settings=None):
+
+        # Stack the current state of several Simulations with the same number of bodies
+        counts = {len(simulation.store) for simulation in simulations}
+        if( len(counts) != 1 ):
+            raise ValueError("every simulation of a batch needs the same number of bodies")
+        return cls(
+            [simulation.store.position for simulation in simulations],
+            [simulation.store.velocity for simulation in simulations],
+            [simulation.store.mass for simulation in simulations],
+            settings if settings is not None else simulations[0].settings
+        )
+
+    @property
+    def size(self):
+        # Number of scenarios
+        return self.positions.shape[0]
+
+    @property
+    def integrator(self):
+
+        # Integrator selected in the settings, rebuilt when the selection changes
+        if( self.settings.integrator == BlockTimestep.name ):
+            raise ValueError("the block timestep integrator cannot run batched scenarios")
+        if( self._integrator is None or self._integrator.name != self.settings.integrator ):
+            self._integrator = make_integrator(self.settings.integrator, self.accelerations, self.settings)
+        return self._integrator
+
+    def accelerations(self, positions, masses):
+        if( self.settings.solver != "direct" ):
+            raise ValueError("batched scenarios only support the direct gravity solver")
+        return accelerations(positions, masses, self.settings.G)
+
+    def step(self, n=1):
+
+        # Advance every scenario by n timesteps
+        if( n <= 0 ):
+            return
+        if( self.settings.collisions ):
+            raise ValueError("batched scenarios cannot merge colliding bodies, switch settings.collisions off")
+
+        dt = self.settings.TIMESTEP
+        integrator = self.integrator
+        for _ in range(n):
+            integrator.step(self.positions, self.velocities, self.masses, dt)
+
+        self.time += n * dt
+        self.steps += n
+
+    def run_until(self, t):
+
+        # Step until simulated time reaches t seconds ( whole timesteps only )
+        remaining = t - self.time
+        if( remaining <= 0 ):
+            return
+        self.step(math.ceil(remaining / self.settings.TIMESTEP - 1e-9))
+
+    def total_energy(self):
+
+        # Kinetic plus potential energy of every scenario, ( B, ) array in joules
+        # ( same sums as Simulation.total_energy, so a scenario reports the same energy alone or batched )
+        energy = np.empty(self.size)
+        for b in range(self.size):
+            velocities = self.velocities[b]
+            kinetic = 0.5 * np.dot(self.masses[b], np.einsum('ij,ij->i', velocities, velocities))
+            energy[b] = kinetic + potential_energy(self.positions[b], self.masses[b], self.settings.G)
+        return energy
+
+    def write_to(self, index, simulation):
+
+        # Copy the state of scenario index into a Simulation with the same bodies
+        simulation.store.position[:] = self.positions[index]
+        simulation.store.velocity[:] = self.velocities[index]
+        simulation.store.mass[:] = self.masses[index]
+        simulation.time = self.time
+        simulation.steps = self.steps
+        simulation.update_distance_to_sun()
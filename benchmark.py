@@ -0,0 +1,444 @@
+import argparse
+import itertools
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from celestialobject import ObjectManager
+from kepler import time_warp
+from particles import belt
+from simulation import SUN_MASS, Simulation, SimulationSettings
+
+
+# Metrics compared against a baseline, +1 if higher is better, -1 if lower is better
+METRICS = {
+    'steps_per_second': 1,
+    'ns_per_pair': -1,
+    'peak_memory_bytes': -1,
+    'energy_drift': -1,
+    'angular_momentum_drift': -1,
+    'frame_ms': -1,
+    'tk_calls_per_frame': -1,
+}
+
+# Allowed relative change of a metric before it counts as a regression
+TOLERANCE = {
+    'steps_per_second': 0.15,
+    'ns_per_pair': 0.15,
+    'peak_memory_bytes': 0.10,
+    # Drifts depend on the last bits of the arithmetic, only flag real changes
+    'energy_drift': 1.0,
+    'angular_momentum_drift': 1.0,
+    'frame_ms': 0.20,
+    # Counted over the same frames every run, only noise from float rounding is allowed
+    'tk_calls_per_frame': 0.01,
+}
+
+# Frames whose canvas calls are counted, after a warm-up frame that creates every item
+CALL_FRAMES = 20
+
+# Energy is skipped above this many bodies, the O(N^2) potential would dominate the run
+ENERGY_MAX_BODIES = 20000
+
+
+def presets(settings):
+
+    # The sun and the planets of the spawn_planets button
+    simulation = Simulation(settings)
+    simulation.spawn_sun()
+    simulation.spawn_planets()
+    return simulation
+
+
+def disk(settings, count, seed=0):
+
+    # The sun and count light bodies on nearly circular orbits between 0.5 and 5 AU
+    simulation = Simulation(settings)
+    simulation.spawn_sun()
+    rng = np.random.default_rng(seed)
+    positions, velocities = belt(settings, count, 0.5, 5.0, SUN_MASS, 0.05, rng)
+    simulation.store.extend(
+        positions,
+        velocities,
+        rng.uniform(1e20, 1e23, count),
+        np.full(count, 0.5),
+        [f"Body {i}" for i in range(count)]
+    )
+    return simulation
+
+
+def encounter(settings):
+
+    # Two Jupiter mass planets on crossing orbits, they pass close by within a few months
+    simulation = Simulation(settings)
+    simulation.spawn_sun()
+    simulation.add_planet("A", 1.0, 0.5, 1.898e27, 20, start_angle_deg=0)
+    simulation.add_planet("B", 1.0, 0.5, 1.898e27, 20, start_angle_deg=40)
+    return simulation
+
+
+def sungrazer(settings):
+
+    # A comet diving to 0.03 AU of the sun next to the planets, needs tiny steps at perihelion
+    simulation = presets(settings)
+    simulation.add_planet("Comet", 3.0, 0.99, 1e14, 5, start_angle_deg=300, at_perihelion=False)
+    return simulation
+
+
+# name: ( builder taking settings, settings overrides, part of the quick suite, steps of the drift run )
+# Drifts are measured over a fixed number of steps so they do not depend on the speed of the machine
+SCENARIOS = {
+    'presets': (presets, {}, True, 2000),
+    'disk-10': (lambda settings: disk(settings, 10), {}, True, 2000),
+    'disk-100': (lambda settings: disk(settings, 100), {}, True, 200),
+    'disk-1000': (lambda settings: disk(settings, 1000), {}, True, 10),
+    'disk-10000': (lambda settings: disk(settings, 10000), {}, False, 2),
+    'disk-100000': (lambda settings: disk(settings, 100000), {'solver': "barnes_hut"}, False, 2),
+    # Collisions off, the close passes are what is measured
+    'encounter': (encounter, {'TIMESTEP': 3600 * 6, 'collisions': False}, True, 2000),
+    'sungrazer': (sungrazer, {'integrator': "block", 'collisions': False}, True, 500),
+}
+
+
+def warp_conservation(settings):
+
+    """
+    What a 100 year time warp of the presets does to the conserved quantities
+
+    Momentum change is relative to the momentum before the warp, the
+    barycenter is compared with where its old velocity takes it, in AU.
+    """
+
+    simulation = presets(settings)
+    mass = simulation.store.mass
+    momentum = np.dot(mass, simulation.store.velocity)
+    barycenter = np.dot(mass, simulation.store.position) / mass.sum()
+    time_warp(simulation, 100 * 365.25 * 3600 * 24)
+
+    expected = barycenter + momentum / mass.sum() * simulation.time
+    return {
+        'momentum_change': float(np.hypot(*(np.dot(mass, simulation.store.velocity) - momentum)) / np.hypot(*momentum)),
+        'barycenter_shift_au': float(np.hypot(*(np.dot(mass, simulation.store.position) / mass.sum() - expected)) / settings.AU),
+    }
+
+
+def sun_plunge(settings):
+
+    # An Earth mass body dropped from rest 2e9 m from the sun crosses it within the first day step, it has to merge on the way
+    settings.collisions = True
+    simulation = Simulation(settings)
+    simulation.spawn_sun()
+    simulation.store.extend(np.array([[2e9, 0.0]]), np.zeros((1, 2)), np.array([5.9742e24]), np.array([5.0]), ["Plunger"])
+    simulation.step(3)
+    return {
+        'bodies_left': len(simulation.store),
+        'fastest_m_per_s': float(np.hypot(*simulation.store.velocity.T).max()),
+    }
+
+
+# name: ( function taking settings and returning measured values, largest value allowed for each )
+CHECKS = {
+    'warp-conservation': (warp_conservation, {'momentum_change': 1e-9, 'barycenter_shift_au': 1e-9}),
+    'sun-plunge': (sun_plunge, {'bodies_left': 1, 'fastest_m_per_s': 1.0}),
+}
+
+
+def run_checks(names=None):
+
+    # Run correctness checks, every check in CHECKS by default. Returns the failures as ( check, quantity, value, limit )
+    failures = []
+    for name in names or CHECKS:
+        check, limits = CHECKS[name]
+        values = check(SimulationSettings())
+        for quantity, limit in limits.items():
+            print(f"{name} {quantity}: {values[quantity]:.3g} ( limit {limit:.3g} )", file=sys.stderr)
+            if( not values[quantity] <= limit ):
+                failures.append((name, quantity, values[quantity], limit))
+    return failures
+
+
+class HeadlessImage:
+
+    # Stand-in for tk.PhotoImage that only keeps the image data
+    def __init__(self, **options) -> None:
+        self.options = options
+
+    def configure(self, **options):
+        self.options.update(options)
+
+
+class HeadlessCanvas:
+
+    """
+    Stand-in for the tkinter canvas that counts calls instead of drawing
+
+    Lets the benchmark run ObjectManager and CanvasRenderer without a display.
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self._ids = itertools.count(1)
+
+    def _item(self, *args, **options):
+        self.calls += 1
+        return next(self._ids)
+
+    create_oval = create_line = create_text = create_image = _item
+
+    def _call(self, *args, **options):
+        self.calls += 1
+
+    coords = itemconfig = delete = tag_lower = tag_raise = _call
+
+    def bind(self, *args, **options):
+        pass
+
+    def after(self, *args):
+        pass
+
+
+class HeadlessVar:
+
+    # Stand-in for a tkinter variable
+    def __init__(self, value) -> None:
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+def scenario_settings(overrides):
+    # Fresh default settings with the overrides of a scenario
+    settings = SimulationSettings()
+    for key, value in overrides.items():
+        setattr(settings, key, value)
+    return settings
+
+
+def timed_steps(simulation, min_time):
+
+    # Step until min_time wall seconds have passed, returns ( steps, seconds )
+    steps = 0
+    batch = 1
+    start = time.perf_counter()
+    elapsed = 0.0
+    while( elapsed < min_time ):
+        simulation.step(batch)
+        steps += batch
+        elapsed = time.perf_counter() - start
+        # Grow batches so the clock is read rarely for fast scenarios
+        if( elapsed < min_time / 10 ):
+            batch *= 2
+    return steps, elapsed
+
+
+def drift(start, end):
+    # Relative change of a conserved quantity, absolute when it started at zero
+    return abs(end - start) / abs(start) if start else abs(end - start)
+
+
+def measure_physics(build, settings, min_time, drift_steps):
+
+    # Step rate, cost per pair, peak memory of a step and drift of the conserved quantities
+    simulation = build(settings)
+    n = len(simulation.store)
+
+    # Peak of the temporaries a single step allocates, measured apart from the timing
+    tracemalloc.start()
+    simulation.step(1)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    check_energy = n <= ENERGY_MAX_BODIES
+    energy = simulation.total_energy() if check_energy else None
+    angular_momentum = simulation.angular_momentum()
+    simulation.step(drift_steps)
+    energy_drift = drift(energy, simulation.total_energy()) if check_energy else None
+    angular_momentum_drift = drift(angular_momentum, simulation.angular_momentum())
+
+    steps, elapsed = timed_steps(simulation, min_time)
+
+    pairs = n * (n - 1) / 2
+    return {
+        'bodies': n,
+        'steps': steps,
+        'steps_per_second': steps / elapsed,
+        'ns_per_pair': elapsed / steps / pairs * 1e9 if pairs else None,
+        'peak_memory_bytes': peak,
+        'state_bytes': simulation.store.nbytes,
+        'energy_drift': energy_drift,
+        'angular_momentum_drift': angular_momentum_drift,
+        'drift_steps': drift_steps,
+    }
+
+
+def measure_render(build, settings, min_time):
+
+    """
+    Cost of drawing frames without a display
+
+    Runs the same per frame work as ObjectManager.update_objects, one physics
+    step, recording the orbit trails and a redraw with them, but only times
+    the drawing part. A first warm-up frame creates the canvas
+    items and is left out, canvas calls are counted over the next CALL_FRAMES
+    frames, so they do not depend on how fast the machine draws.
+    """
+
+    simulation = build(settings)
+    canvas = HeadlessCanvas()
+    config = {'draw_orbit': HeadlessVar(1), 'pause': 0}
+    manager = ObjectManager(canvas, config, settings, simulation=simulation)
+    manager.renderer.points.image_class = HeadlessImage
+
+    def frame():
+        # Step and draw one frame, returns the wall seconds spent drawing
+        simulation.step(1)
+        start = time.perf_counter()
+        manager.renderer.begin_frame()
+        manager.sync_views()
+        manager.record_trails()
+        manager.redraw()
+        manager.renderer.end_frame()
+        return time.perf_counter() - start
+
+    frame()
+    frames = 0
+    calls = 0
+    drawing = 0.0
+    while( drawing < min_time or frames < CALL_FRAMES ):
+        drawing += frame()
+        if( frames < CALL_FRAMES ):
+            calls += manager.renderer.frame_calls
+        frames += 1
+
+    return {
+        'frames': frames,
+        'frame_ms': drawing / frames * 1000,
+        'tk_calls_per_frame': calls / CALL_FRAMES,
+    }
+
+
+def run_benchmarks(names=None, quick=False, min_time=1.0, render=True):
+
+    """
+    Run benchmark scenarios
+
+    names: scenarios to run, every scenario in SCENARIOS by default
+    quick: skip the large scenarios
+    min_time: wall seconds spent measuring each metric
+
+    Returns a JSON serializable dict with the environment and a result per scenario
+    """
+
+    if( names is None ):
+        names = [name for name, (_, _, small, _) in SCENARIOS.items() if small or not quick]
+
+    results = {}
+    for name in names:
+        build, overrides, _, drift_steps = SCENARIOS[name]
+
+        result = measure_physics(build, scenario_settings(overrides), min_time, drift_steps)
+        result['solver'] = scenario_settings(overrides).solver
+        result['integrator'] = scenario_settings(overrides).integrator
+        if( render ):
+            result.update(measure_render(build, scenario_settings(overrides), min_time))
+        results[name] = result
+        print(f"{name}: {result['steps_per_second']:.1f} steps/s", file=sys.stderr)
+
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'min_time': min_time,
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, tolerance=None):
+
+    """
+    Regressions of current benchmark results against a baseline
+
+    tolerance: dict of metric to allowed relative change, TOLERANCE by default
+
+    Returns a list of dicts with the scenario, metric, baseline and current
+    value and the relative change, only for changes in the bad direction
+    """
+
+    tolerance = dict(TOLERANCE, **(tolerance or {}))
+    regressions = []
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name)
+        if( old is None ):
+            continue
+        for metric, sign in METRICS.items():
+            before, after = old.get(metric), result.get(metric)
+            if( before is None or after is None ):
+                continue
+            if( before == 0 ):
+                change = 0.0 if after == 0 else float('inf')
+            else:
+                change = (after - before) / abs(before)
+            # Positive when the metric got worse
+            if( -sign * change > tolerance[metric] ):
+                regressions.append({
+                    'scenario': name,
+                    'metric': metric,
+                    'baseline': before,
+                    'current': after,
+                    'change': change,
+                })
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark step throughput, render cost and energy drift")
+    parser.add_argument("scenarios", nargs="*", help=f"scenarios to run, any of {', '.join(SCENARIOS)}")
+    parser.add_argument("--quick", action="store_true", help="skip the scenarios with 10k bodies or more")
+    parser.add_argument("--min-time", type=float, default=1.0, help="wall seconds spent on each measurement")
+    parser.add_argument("--no-render", action="store_true", help="skip the headless render measurements")
+    parser.add_argument("--out", default=None, help="write results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="compare against results stored in this JSON file")
+    parser.add_argument("--check", action="store_true", help=f"run the correctness checks instead, any of {', '.join(CHECKS)}")
+    args = parser.parse_args()
+
+    if( args.check ):
+        unknown = [name for name in args.scenarios if name not in CHECKS]
+        if( unknown ):
+            parser.error(f"unknown checks: {', '.join(unknown)}")
+        failures = run_checks(args.scenarios or None)
+        for name, quantity, value, limit in failures:
+            print(f"FAILED {name} {quantity}: {value:.4g} over {limit:.4g}", file=sys.stderr)
+        sys.exit(1 if failures else 0)
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if( unknown ):
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    current = run_benchmarks(args.scenarios or None, args.quick, args.min_time, not args.no_render)
+
+    if( args.out ):
+        with open(args.out, 'w') as out_file:
+            json.dump(current, out_file, indent=2)
+    else:
+        print(json.dumps(current, indent=2))
+
+    if( args.baseline ):
+        with open(args.baseline) as baseline_file:
+            regressions = compare(current, json.load(baseline_file))
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression['scenario']} {regression['metric']}: "
+                f"{regression['baseline']:.4g} -> {regression['current']:.4g} ( {regression['change']:+.1%} )",
+                file=sys.stderr
+            )
+        if( regressions ):
+            sys.exit(1)
+        print("no regressions", file=sys.stderr)
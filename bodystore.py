@@ -0,0 +1,412 @@
+import numpy as np
+from vector import Vector2
+
+
+def default_tag(body_id):
+    # Tag of a body added without one
+    return f"body_{body_id}"
+
+
+class BodyStore:
+
+    """
+    Structure-of-arrays storage for the state of every body
+
+    Each property of a body lives in its own contiguous typed array, so force
+    kernels and integrators read and write the state of all bodies at once
+    without copying. Per body this is 16 ( position ) + 16 ( velocity ) + 8 ( mass )
+    + 8 ( distance to sun ) + 4 ( radius ) + 1 ( sun flag ) + 8 ( id ) = 61 bytes,
+    plus the tag and 8 bytes for the row of every id given out.
+
+    Arrays are over-allocated and doubled when full, only the first `count`
+    rows hold live bodies. Use the `position`, `velocity`, ... properties to get
+    views of the live rows.
+
+    Every body also gets a stable integer id, which unlike its row never
+    changes and is never reused. Removing a body moves the last body into its
+    row, so adding and removing a body are O(1), and remove_many removes any
+    number of bodies in one pass. Tags need not be unique, with_tag finds the
+    ids of every body with a tag. Bodies added with a tag of None are named
+    after their id ( see default_tag ) when their tag is read, so adding many
+    unnamed bodies builds no strings.
+    """
+
+    # Per body arrays, moved together when bodies are removed
+    FIELDS = ('_position', '_velocity', '_mass', '_radius', '_sun', '_distance_to_sun', '_id')
+
+    def __init__(self, capacity=16) -> None:
+        self.count = 0
+        self._position = np.zeros((capacity, 2), dtype=np.float64)
+        self._velocity = np.zeros((capacity, 2), dtype=np.float64)
+        self._mass = np.zeros(capacity, dtype=np.float64)
+        self._radius = np.zeros(capacity, dtype=np.float32)
+        self._sun = np.zeros(capacity, dtype=bool)
+        self._distance_to_sun = np.zeros(capacity, dtype=np.float64)
+        self._id = np.zeros(capacity, dtype=np.int64)
+        # Row of every id ever given out, -1 once the body is removed
+        self._row = np.full(capacity, -1, dtype=np.int64)
+        self.next_id = 0
+        self.tags = []
+        # Body handles by id, created on first access
+        self._handles = {}
+        # Tag to set of ids, built on the first lookup by tag and kept up to date from then on
+        self._tag_index = None
+        # Bumped whenever a body is added or removed
+        self.generation = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def capacity(self):
+        return len(self._mass)
+
+    @property
+    def position(self):
+        return self._position[:self.count]
+
+    @property
+    def velocity(self):
+        return self._velocity[:self.count]
+
+    @property
+    def mass(self):
+        return self._mass[:self.count]
+
+    @property
+    def radius(self):
+        return self._radius[:self.count]
+
+    @property
+    def sun(self):
+        return self._sun[:self.count]
+
+    @property
+    def distance_to_sun(self):
+        return self._distance_to_sun[:self.count]
+
+    @property
+    def ids(self):
+        return self._id[:self.count]
+
+    @property
+    def nbytes(self):
+        # Memory used by the live rows of the typed arrays
+        return sum(array.nbytes for array in (
+            self.position, self.velocity, self.mass, self.radius, self.sun, self.distance_to_sun, self.ids
+        ))
+
+    def _grow(self, capacity):
+
+        # Reallocate every array with a larger capacity, keeping live rows
+        for name in self.FIELDS:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def attach(self, arrays, count):
+
+        # Use arrays, a dict of FIELDS name to array e.g. in shared memory, as storage with count live rows
+        for name in self.FIELDS:
+            setattr(self, name, arrays[name])
+        self.count = count
+
+    def detach(self):
+        # Copy attached arrays into arrays of the store's own, so the memory behind them can go
+        self.attach({name: getattr(self, name).copy() for name in self.FIELDS}, self.count)
+
+    def reindex(self, tags, next_id):
+
+        # Rebuild the id lookups after the rows of attached arrays changed, tags are those of the new rows
+        self.tags = tags
+        self.next_id = next_id
+        self._row = np.full(max(16, next_id), -1, dtype=np.int64)
+        self._row[self.ids] = np.arange(self.count)
+        self._handles = {body_id: handle for body_id, handle in self._handles.items() if self._row[body_id] >= 0}
+        self._tag_index = None
+        self.generation += 1
+
+    def _new_ids(self, count, start, ids=None):
+
+        # Give ids to count bodies stored from row start on, new ones or the given ids of restored bodies
+        if( ids is None ):
+            ids = np.arange(self.next_id, self.next_id + count)
+        else:
+            ids = np.asarray(ids, dtype=np.int64)
+            if( len(ids) and (ids.min() < 0 or np.any(self._row[ids[ids < len(self._row)]] >= 0)) ):
+                raise ValueError("body ids must be unique")
+        next_id = max(self.next_id, int(ids.max()) + 1 if len(ids) else 0)
+        if( next_id > len(self._row) ):
+            row = np.full(max(16, len(self._row) * 2, 1 << (next_id - 1).bit_length()), -1, dtype=np.int64)
+            row[:len(self._row)] = self._row
+            self._row = row
+        self._id[start:start + count] = ids
+        self._row[ids] = np.arange(start, start + count)
+        self.next_id = next_id
+        return ids
+
+    def add(self, position, velocity, mass, radius, tag, sun=False):
+
+        # Append a body and return its index
+        if( self.count == self.capacity ):
+            self._grow(max(16, self.capacity * 2))
+
+        index = self.count
+        self._position[index] = (position.x, position.y)
+        self._velocity[index] = (velocity.x, velocity.y)
+        self._mass[index] = mass
+        self._radius[index] = radius
+        self._sun[index] = sun
+        self._distance_to_sun[index] = 0
+        body_id = int(self._new_ids(1, index)[0])
+        self.tags.append(tag)
+        if( self._tag_index is not None ):
+            self._tag_index.setdefault(default_tag(body_id) if tag is None else tag, set()).add(body_id)
+        self.count += 1
+        self.generation += 1
+        return index
+
+    def extend(self, positions, velocities, masses, radii, tags, sun=None, ids=None):
+
+        # Append many bodies at once from arrays, returns the index of the first one. tags may be None for unnamed bodies, ids restores saved ids
+        count = len(masses)
+        if( self.count + count > self.capacity ):
+            self._grow(max(16, self.capacity * 2, 1 << (self.count + count - 1).bit_length()))
+
+        start = self.count
+        end = start + count
+        self._position[start:end] = positions
+        self._velocity[start:end] = velocities
+        self._mass[start:end] = masses
+        self._radius[start:end] = radii
+        self._sun[start:end] = False if sun is None else sun
+        self._distance_to_sun[start:end] = 0
+        ids = self._new_ids(count, start, ids)
+        self.tags.extend([None] * count if tags is None else tags)
+        if( self._tag_index is not None ):
+            for tag, body_id in zip(self.tags[start:end], ids.tolist()):
+                self._tag_index.setdefault(default_tag(body_id) if tag is None else tag, set()).add(body_id)
+        self.count = end
+        self.generation += 1
+        return start
+
+    def _forget(self, ids, tags):
+
+        # Drop removed bodies from the id lookups
+        self._row[ids] = -1
+        for body_id in ids.tolist():
+            self._handles.pop(body_id, None)
+        if( self._tag_index is not None ):
+            for tag, body_id in zip(tags, ids.tolist()):
+                self._forget_tag(default_tag(body_id) if tag is None else tag, body_id)
+
+    def remove(self, index):
+
+        # Remove the body at index, O(1): the last body moves into its row
+        last = self.count - 1
+        removed_id = self._id[index:index + 1].copy()
+        removed_tag = self.tags[index]
+        if( index != last ):
+            for name in self.FIELDS:
+                array = getattr(self, name)
+                array[index] = array[last]
+            self._row[self._id[index]] = index
+            self.tags[index] = self.tags[last]
+        self.tags.pop()
+        self._forget(removed_id, [removed_tag])
+        self.count -= 1
+        self.generation += 1
+
+    def remove_many(self, indices):
+
+        """
+        Remove the bodies at indices in one pass, the others move down and keep their order
+
+        Returns the ids of the removed bodies
+        """
+
+        keep = np.ones(self.count, dtype=bool)
+        keep[indices] = False
+        kept = int(np.count_nonzero(keep))
+        removed = np.flatnonzero(~keep)
+        removed_ids = self._id[removed].copy()
+        removed_tags = [self.tags[index] for index in removed.tolist()]
+
+        for name in self.FIELDS:
+            array = getattr(self, name)
+            array[:kept] = array[:self.count][keep]
+        self._row[self._id[:kept]] = np.arange(kept)
+        self.tags = [tag for tag, alive in zip(self.tags, keep.tolist()) if alive]
+        self._forget(removed_ids, removed_tags)
+
+        self.count = kept
+        self.generation += 1
+        return removed_ids
+
+    def row(self, body_id):
+        # Row of the body with id, None if it was removed
+        row = int(self._row[body_id]) if 0 <= body_id < len(self._row) else -1
+        return None if row < 0 else row
+
+    def rows(self, ids):
+        # Rows of the bodies with ids, -1 where a body was removed
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = np.full(len(ids), -1, dtype=np.int64)
+        known = (ids >= 0) & (ids < len(self._row))
+        rows[known] = self._row[ids[known]]
+        return rows
+
+    def tag(self, index):
+        # Tag of the body at index
+        tag = self.tags[index]
+        return default_tag(int(self._id[index])) if tag is None else tag
+
+    def set_tag(self, index, tag):
+        # Rename the body at index
+        if( self._tag_index is not None ):
+            self._forget_tag(self.tag(index), int(self._id[index]))
+            self._tag_index.setdefault(tag, set()).add(int(self._id[index]))
+        self.tags[index] = tag
+
+    def _forget_tag(self, tag, body_id):
+        self._tag_index[tag].discard(body_id)
+        if( not self._tag_index[tag] ):
+            del self._tag_index[tag]
+
+    def with_tag(self, tag):
+
+        # Ids of every body with tag, in the order they were added
+        if( self._tag_index is None ):
+            self._tag_index = {}
+            for name, body_id in zip(self.tags, self.ids.tolist()):
+                self._tag_index.setdefault(default_tag(body_id) if name is None else name, set()).add(body_id)
+        return sorted(self._tag_index.get(tag, ()))
+
+    def handle(self, index):
+
+        # Body handle for the body at index, created on first use
+        body_id = int(self._id[index])
+        handle = self._handles.get(body_id)
+        if( handle is None ):
+            handle = Body(self, body_id)
+            self._handles[body_id] = handle
+        return handle
+
+
+class VectorView(Vector2):
+
+    """
+    Vector2 that reads and writes one row of a BodyStore array
+
+    Keeps code like planet.velocity.x or planet.real_position += offset working
+    against the array storage.
+    """
+
+    def __init__(self, body, field) -> None:
+        self.body = body
+        self.field = field
+
+    def _row(self):
+        return getattr(self.body.store, self.field)[self.body.index]
+
+    @property
+    def x(self):
+        return self._row()[0].item()
+
+    @x.setter
+    def x(self, value):
+        self._row()[0] = value
+
+    @property
+    def y(self):
+        return self._row()[1].item()
+
+    @y.setter
+    def y(self, value):
+        self._row()[1] = value
+
+
+# Property of a Body that reads and writes a scalar column of the store
+def _column(name, convert):
+    return property(
+        lambda self: convert(getattr(self.store, name)[self.index]),
+        lambda self, value: getattr(self.store, name).__setitem__(self.index, value)
+    )
+
+
+# Property of a Body that returns a Vector2 view of a vector column of the store
+def _vector_column(name):
+
+    def setter(self, value):
+        getattr(self.store, name)[self.index] = (value.x, value.y)
+
+    return property(lambda self: VectorView(self, name), setter)
+
+
+class Body:
+
+    """
+    Lightweight handle to one body of a BodyStore
+
+    Holds only the store and the body's id, every attribute reads and writes
+    the store arrays. The row index follows the body when others are removed,
+    and becomes None once this body has been removed.
+    """
+
+    __slots__ = ('store', 'id')
+
+    real_position = _vector_column('_position')
+    velocity = _vector_column('_velocity')
+    mass = _column('_mass', float)
+    base_radius = _column('_radius', float)
+    sun = _column('_sun', bool)
+    distance_to_sun = _column('_distance_to_sun', float)
+
+    def __init__(self, store, body_id) -> None:
+        self.store = store
+        self.id = body_id
+
+    @property
+    def index(self):
+        # Current row of the body in the store arrays, None once removed
+        row = self.store._row[self.id]
+        return None if row < 0 else int(row)
+
+    @property
+    def tag(self):
+        return self.store.tag(self.index)
+
+    @tag.setter
+    def tag(self, value):
+        self.store.set_tag(self.index, value)
+
+    def __repr__(self) -> str:
+        return f"{self.tag}"
+
+
+class BodyList:
+
+    # Read-only sequence of the Body handles of a store, handles are created as they are accessed
+
+    def __init__(self, store) -> None:
+        self.store = store
+
+    def __len__(self):
+        return self.store.count
+
+    def __getitem__(self, index):
+        if( isinstance(index, slice) ):
+            return [self.store.handle(i) for i in range(*index.indices(self.store.count))]
+        if( index < 0 ):
+            index += self.store.count
+        if( not 0 <= index < self.store.count ):
+            raise IndexError("body index out of range")
+        return self.store.handle(index)
+
+    def __iter__(self):
+        for index in range(self.store.count):
+            yield self.store.handle(index)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
@@ -1,11 +1,21 @@
-import math
+import threading
+import time
 import tkinter as tk
+import numpy as np
 from tkinter import Tk, Canvas, messagebox
+from bodystore import Body
+from checkpoint import load_checkpoint, snapshot, write_checkpoint
+from kepler import time_warp
+from gameloop import AdaptiveQuality, FrameScheduler
+from profiling import FrameProfiler, PerformanceHUD
+from renderer import CanvasRenderer, HEIGHT, WIDTH
+from scenario import load_scenario
+from trails import TrailBuffer, TrailSet
+from simulation import Simulation
+from vector import Vector2
+from worker import PhysicsClient
 
 
-# Canvas Dimensions
-WIDTH, HEIGHT = 900, 675
-
 # Convert mass and velocity entry expressions to float values
 def expression_convert(expression):
 
@@ -38,93 +48,63 @@ def expression_convert(expression):
     except:
         raise ValueError("Invalid Expression")
      
-# Custom Vector2 Class
-class Vector2:
-    def __init__(self, x, y) -> None:
-        self.x, self.y = x, y
-
-    def __eq__(self, other) -> bool:
-        return self.x == other.x and self.y == other.y
-
-    def __ne__(self,other) -> bool:
-        return not self.__eq__(other)
-
-    def __add__(self, other):
-        return Vector2(self.x + other.x, self.y + other.y)
-
-    def __iadd__(self, other):
-        if isinstance(other, Vector2):
-            self.x += other.x
-            self.y += other.y
-            return self
-        if isinstance(other, (int, float)):
-            self.x += other
-            self.y += other
-            return self
-
-    def __sub__(self, other):
-        return Vector2(self.x - other.x, self.y - other.y)
-
-    def __mul__(self, other):
-        if isinstance(other, Vector2):
-            return Vector2(self.x * other.x, self.y * other.y)
-        if isinstance(other, (int, float)):
-            return Vector2(self.x * other, self.y * other)
-
-    def __truediv__(self, other):
-        if isinstance(other, Vector2):
-            return Vector2(self.x / other.x, self.y / other.y)
-        if isinstance(other, (int, float)):
-            return Vector2(self.x / other, self.y / other)
+# Property that reads and writes an attribute of the simulation body behind a CelestialObject
+def _body_attribute(name):
+    return property(
+        lambda self: getattr(self.body, name),
+        lambda self, value: setattr(self.body, name, value)
+    )
 
-    def __repr__(self) -> str:
-        return f"({self.x}, {self.y})"
 
-    def distance_to(self, other):
-        return math.sqrt((other.x - self.x) ** 2 + (other.y - self.y) ** 2)
+# Canvas view of a single body of the simulation
+class CelestialObject:
 
+    real_position = _body_attribute('real_position')
+    velocity = _body_attribute('velocity')
+    mass = _body_attribute('mass')
+    base_radius = _body_attribute('base_radius')
+    sun = _body_attribute('sun')
+    tag = _body_attribute('tag')
+    distance_to_sun = _body_attribute('distance_to_sun')
 
-class CelestialObject:
     def __init__(
                 self, 
-                origin: Vector2, 
+                body: Body,
                 canvas: Canvas, 
-                radius: int,
-                mass: int,
-                velocity: Vector2, 
-                tag: str,
                 object_manager
                 ) -> None:
 
-        self.real_position = Vector2(origin.x, origin.y)
-        self.center = Vector2(0, 0)
+        self.body = body
         self.canvas = canvas
-        self.base_radius = radius
-        self.radius = radius
-        self.mass = mass
-        self.velocity = velocity
-        self.orbit = []
+        settings = object_manager.settings
+        self.orbit = TrailBuffer(
+            settings.TRAIL_CAPACITY,
+            # Trail spacing is given in pixels at zoom 1.0, trails are stored in meters
+            settings.TRAIL_SPACING * settings.AU / settings.base_pixels_per_au,
+            settings.TRAIL_ANGLE
+        )
         self.orbit_line_id = None
         self.oval_id = None
-        self.sun = False
-        self.distance_to_sun = 0
+        # Rounded screen rectangle the oval was last drawn at
+        self.screen_rect = None
+        # Oval hidden because the planet is off screen or smaller than a pixel
+        self.hidden = False
         self.color = "white"
-        self.tag = tag
         self.object_manager = object_manager
-        self.orbital_length = 100000
-
-        self.update_radius()
-        self.update_screen_position()
+        # Position in the ViewRegistry holding this view
+        self.slot = None
 
-        self.canvas.tag_bind(self.tag, "<Enter>", self.on_enter)
-        self.canvas.tag_bind(self.tag, "<Button-1>", self.on_click)
-        self.canvas.tag_bind(self.tag, "<Button-3>", self.delete_planet_onClick)
+    # Remove the oval and orbit line from the canvas, the body and its trail are kept
+    def remove_from_canvas(self):
 
-    def update_screen_position(self):
-
-        # Scale center position relative to canvas center
-        self.center.x = self.real_position.x * self.object_manager.settings.SCALE + WIDTH / 2
-        self.center.y = self.real_position.y * self.object_manager.settings.SCALE + HEIGHT / 2
+        # Goes by item ids, the body may already be merged away
+        items = [item for item in (self.oval_id, self.orbit_line_id) if item is not None]
+        if( items ):
+            self.object_manager.renderer.delete(*items)
+        self.oval_id = None
+        self.orbit_line_id = None
+        self.screen_rect = None
+        self.hidden = False
 
     def __repr__(self) -> str:
         return f"{self.tag}"
@@ -139,158 +119,155 @@ class CelestialObject:
 
     def draw(self):
 
-        # If planet doesn't exist yet, create planet on canvas
-        if self.oval_id is None:
+        # Create or move planet on canvas
+        self.object_manager.renderer.draw_object(self)
 
-            x1 = self.center.x - self.radius
-            y1 = self.center.y - self.radius
-            x2 = self.center.x + self.radius
-            y2 = self.center.y + self.radius
-            if( self.sun ):
-                self.oval_id = self.canvas.create_oval(x1, y1, x2, y2, fill="yellow", outline=self.color, tags=(self.tag))
-            else:
-                self.oval_id = self.canvas.create_oval(x1, y1, x2, y2, fill="black", outline=self.color, tags=(self.tag))
+    def draw_orbit(self):
 
-        # If planet already exists, update coordinates of planet
-        else:
-            x1 = self.center.x - self.radius
-            y1 = self.center.y - self.radius
-            x2 = self.center.x + self.radius
-            y2 = self.center.y + self.radius
-            self.canvas.coords(self.oval_id, x1, y1, x2, y2)
+        # Project the trail onto the screen and draw it
+        self.object_manager.renderer.draw_orbits([self])
 
-    # Gravitational Attraction between 2 Celestial Objects
-    def attraction(self, other):
+    # Radius in pixels at the current zoom
+    @property
+    def radius(self):
+        return self.object_manager.settings.zoom * self.base_radius
 
-        # calculate distance between 2 objects
-        distance_x = other.real_position.x - self.real_position.x
-        distance_y = other.real_position.y - self.real_position.y
-        distance = self.real_position.distance_to(other.real_position)
+    def delete_planet_onClick(self, event):
+        
+        # Do not remove sun
+        if( self.sun ):
+            messagebox.showerror("Error", "Cannot remove sun")
+            return
 
-        # if other is sun, calculate distance to sun
-        if( other.sun ):
-            self.distance_to_sun = distance
+        # Recordings can not be changed
+        if( self.object_manager.replay is not None ):
+            messagebox.showerror("Error", "Cannot remove planets during a replay")
+            return
 
-        # Attraction force operations
-        # Gforce = G * ( Mass1 * Mass2 / distance^2 )
-        force = self.object_manager.settings.G * self.mass * other.mass / distance ** 2
+        # The physics worker removes the body, the view goes once its next frame comes in
+        if( self.object_manager.worker is not None ):
+            self.object_manager.remove_bodies([self.body.index])
+            return
 
-        # Angle between distance in y direction and x direction
-        theta = math.atan2(distance_y, distance_x)
-        force_x = math.cos(theta) * force
-        force_y = math.sin(theta) * force
+        # Remove visual elements on canvas
+        self.remove_from_canvas()
 
-        return force_x, force_y
+        # Remove planet from object manager celestial objects and from the simulation
+        self.object_manager.celestialObjects.remove(self)
+        self.object_manager.simulation.remove_body(self.body)
 
+        self.orbit.clear()
 
-    # Sum force of attraction between current object and all other celestial objects
-    # Calculate velocity and new position from force of attraction
-    def update_position(self, planets):
-        
-        # Total force by all other planets
-        total_force_x = total_force_y = 0
+        # If object manager has a selected planet, clear it from the info frame
+        if( hasattr(self.object_manager, 'selected_planet') and self.object_manager.selected_planet ):
+            if( self.object_manager.selected_planet is self ):
+                self.object_manager.clear_callback()
 
-        # Add up total force by all other planets
-        for planet in planets:
-            if self == planet:
-                continue
-            fx, fy = self.attraction(planet)
-            total_force_x += fx
-            total_force_y += fy
+class ViewRegistry:
 
-        # Calculate velocity from forces in x,y directions
-        # F = ma
-        # a = dv/dt
-        # F = m(dv/dt)
-        # dv = (F/m)dt
-        self.velocity += ( Vector2(total_force_x, total_force_y) / self.mass ) * self.object_manager.settings.TIMESTEP
+    """
+    The views of an ObjectManager, in a list for drawing and indexed by body id
 
-        # Increment position based on velocity and time
-        self.real_position += self.velocity * self.object_manager.settings.TIMESTEP
+    Views are found by the stable id of their body in O(1). Adding a view and
+    removing a single view are O(1) too, the last view takes the slot of a
+    removed one, and any number of views is removed in one pass by
+    remove_ids or remove_where.
 
+    Not every body has a view: views are made as bodies are first drawn as
+    ovals, missing finds the bodies still without one. The orbit trails of the
+    views are kept in a TrailSet in the same slots, to sample them all at once.
+    """
 
-        # Calculate position on screen based on real position
-        self.update_screen_position()
+    def __init__(self, views=()) -> None:
+        self.views = []
+        self._by_id = {}
+        # Body id of the view in every slot
+        self._ids = np.zeros(16, dtype=np.int64)
+        self.trails = TrailSet()
+        self.extend(views)
 
-        # Add point for orbit visualization if draw orbit is selected
-        if( self.object_manager.config['draw_orbit'].get() ):
-            self.orbit.append(Vector2(self.center.x, self.center.y))
+    def __len__(self):
+        return len(self.views)
 
-    def draw_orbit(self):
+    def __iter__(self):
+        return iter(self.views)
 
-        # Flatten list of orbit vector coordinates into simple list of coordinates
-        coords = [coord for v in self.orbit for coord in (v.x, v.y)]
+    def __getitem__(self, index):
+        return self.views[index]
 
-        if not coords or len(coords) < 4:
-            return
+    def __contains__(self, view):
+        return view.slot is not None and view.slot < len(self.views) and self.views[view.slot] is view
 
-        if self.orbit_line_id is None:
-            self.orbit_line_id = self.canvas.create_line(
-                *coords,
-                dash=(5,2),
-                smooth=True,
-                fill="white",
-                width=1,
-                splinesteps=5,
-                tags=f"{self.tag}_orbit"
-            )
-        else:
-            # Update existing orbit line
-            self.canvas.coords(self.orbit_line_id, *coords)
-
-        # Limit orbit points to prevent overlap
-        current_x = round(self.orbit[-1].x, 2)
-        initial_x = round(self.orbit[0].x, 2)
-        current_y = round(self.orbit[-1].y, 2)
-        initial_y = round(self.orbit[0].y, 2)
-        
-        # Check difference between current orbit coordinates and initial
-        if(len(self.orbit) > 50):
-            if( round(abs(current_x - initial_x) , 2) < 3 and round(abs(current_y - initial_y) , 2) < 3):
-                self.orbital_length = len(self.orbit)
-            self.orbit = self.orbit[-self.orbital_length:]
-            
+    def get(self, body_id):
+        # View of the body with id, None if there is none
+        return self._by_id.get(body_id)
 
-    # Calculate radius of objects based on zoom scale
-    def update_radius(self):
-        self.radius = self.object_manager.settings.zoom * self.base_radius
+    def append(self, view):
+        view.slot = len(self.views)
+        if( view.slot == len(self._ids) ):
+            self._ids = np.concatenate((self._ids, np.zeros(len(self._ids), dtype=np.int64)))
+        self._ids[view.slot] = view.body.id
+        self.views.append(view)
+        self._by_id[view.body.id] = view
+        self.trails.append(view.orbit)
 
-    def delete_planet_onClick(self, event):
-        
-        # Do not remove sun
-        if( self.sun ):
-            messagebox.showerror("Error", "Cannot remove sun")
-            return
+    def extend(self, views):
+        for view in views:
+            self.append(view)
 
-        # Remove visual elements on canvas
-        if( self.oval_id ):
-            self.canvas.delete(self.oval_id)
-        if( self.orbit_line_id ):
-            self.canvas.delete(self.oval_id)
-
-        # Delete tag references to planet
-        self.canvas.delete(f"{self.tag}")
-        self.canvas.delete(f"{self.tag}_orbit")
-
-        # Remove event bindings
-        self.canvas.tag_unbind(self.tag, "<Enter>")
-        self.canvas.tag_unbind(self.tag, "<Button-1>")
-        self.canvas.tag_unbind(self.tag, "<Button-3>")
-
-        # Remove planet from object manager celestial objects list
-        for i, planet in enumerate(self.object_manager.celestialObjects):
-            if planet.tag == self.tag:
-                self.object_manager.celestialObjects.pop(i)
-                break
+    def remove(self, view):
 
-        self.oval_id = None
-        self.orbit_line_id = None
-        self.orbit = []
+        # Remove one view, the last view moves into its slot
+        if( view not in self ):
+            return
+        last = self.views.pop()
+        if( last is not view ):
+            self.views[view.slot] = last
+            self._ids[view.slot] = self._ids[last.slot]
+            last.slot = view.slot
+        view.slot = None
+        self.trails.remove(view.orbit)
+        if( self._by_id.get(view.body.id) is view ):
+            del self._by_id[view.body.id]
+
+    def remove_where(self, predicate):
+
+        # Remove every view predicate is true for in one pass, returns the removed views
+        kept, removed, mask = [], [], []
+        for view in self.views:
+            alive = not predicate(view)
+            (kept if alive else removed).append(view)
+            mask.append(alive)
+        if( removed ):
+            count = len(self.views)
+            self._ids[:len(kept)] = self._ids[:count][mask]
+            self.trails.keep(mask)
+            self.views = kept
+            for slot, view in enumerate(kept):
+                view.slot = slot
+            for view in removed:
+                view.slot = None
+                if( self._by_id.get(view.body.id) is view ):
+                    del self._by_id[view.body.id]
+        return removed
+
+    def ids(self):
+        # Array of the body id of the view in every slot
+        return self._ids[:len(self.views)]
+
+    def remove_ids(self, ids):
+        # Remove the views of the bodies with the given ids, returns the removed views
+        ids = set(ids.tolist() if hasattr(ids, 'tolist') else ids)
+        return self.remove_where(lambda view: view.body.id in ids)
+
+    def missing(self, store):
+
+        # Rows of the bodies of store that have no view
+        has_view = np.zeros(max(store.next_id, 1), dtype=bool)
+        ids = self.ids()
+        has_view[ids[ids < len(has_view)]] = True
+        return np.flatnonzero(~has_view[store.ids])
 
-        # If object manager has a selected planet, clear it from the info frame
-        if( hasattr(self.object_manager, 'selected_planet') and self.object_manager.selected_planet ):
-            if( self.object_manager.selected_planet.tag == self.tag ):
-                self.object_manager.clear_callback()
 
 class ObjectManager:
     def __init__(
@@ -299,17 +276,51 @@ class ObjectManager:
                 config: dict, 
                 settings, 
                 update_callback=None,
-                clear_callback=None
+                clear_callback=None,
+                simulation: Simulation = None
                 ) -> None:
         self.canvas = canvas
-        self.celestialObjects = []
+        # Views of every body on screen
+        self.celestialObjects = ViewRegistry()
         self.config = config
         self.settings = settings
+        # Headless simulation core that owns the physical state of every body
+        self.simulation = simulation if simulation is not None else Simulation(settings)
+        # Decides how many physics steps run per rendered frame
+        self.scheduler = FrameScheduler(settings)
+        # Draws planets and orbit lines on the canvas
+        self.renderer = CanvasRenderer(canvas, settings)
+        # Times the phases of every frame, shown by the performance HUD
+        self.profiler = FrameProfiler(settings.PROFILE_WINDOW, settings.TRACE_EVENTS)
+        # Lowers rendering quality while frames take longer than the frame target
+        self.quality = AdaptiveQuality(settings, on_change=self.quality_changed)
+        self.hud = PerformanceHUD(
+            canvas, self.profiler, self.scheduler, settings.HUD_INTERVAL, x=WIDTH - 10, quality=self.quality
+        )
+        # Position of the sun in meters
+        self.sun_position = (0.0, 0.0)
         # Callback function for update_planet_info
         self.update_callback = update_callback
         # Callback function for clear_planet_info
         self.clear_callback = clear_callback
         self.selected_planet = None
+        # Replay of a recorded trajectory shown instead of the simulation, None when live
+        self.replay = None
+        # Views of the live simulation while a replay is shown
+        self.live_objects = None
+        # Called every replay frame, e.g. to move the scrub slider
+        self.replay_callback = None
+        # Called with the simulation's Diagnostics once per frame in which new samples were taken
+        self.diagnostics_callback = None
+        self._diagnostics_taken = 0
+        # Store generation the views were last matched against, see sync_views
+        self._generation = None
+        # Autosave checkpoints every settings.CHECKPOINT_INTERVAL seconds while enabled
+        self.autosave = False
+        self._last_checkpoint = time.perf_counter()
+        self._checkpoint_writer = None
+        # PhysicsClient while the physics runs in a worker process, see start_worker
+        self.worker = None
         self.empty_solar_system = self.canvas.create_text(
                 10, 665,                     
                 text="The universe is a vast, cold, and empty place...",  
@@ -320,17 +331,50 @@ class ObjectManager:
                 tags="no_planets",
                 state="normal"                                
             )
+        self.empty_message_shown = True
+
+        # One handler each for the whole canvas, the planet under the mouse is looked up in
+        # the renderer's pick index instead of binding events to every planet's canvas items
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<Button-3>", self.on_right_click)
+        self.canvas.bind("<Motion>", self.on_motion)
+        # Planet under the mouse, None over empty space
+        self.hovered = None
+
+    def planet_at(self, x, y):
+        # Topmost planet drawn at canvas point x, y, or None
+        return self.renderer.picker.find(x, y)
 
-        self.canvas.bind("<Button-1>", self.spawn_objectClick)
+    def on_click(self, event):
+
+        # Select the planet clicked on, or spawn a new one on empty space
+        planet = self.planet_at(event.x, event.y)
+        if( planet is not None ):
+            planet.on_click(event)
+        else:
+            self.spawn_objectClick(event)
+
+    def on_right_click(self, event):
+
+        # Delete the planet clicked on
+        planet = self.planet_at(event.x, event.y)
+        if( planet is not None ):
+            planet.delete_planet_onClick(event)
+
+    def on_motion(self, event):
+
+        # Tell a planet when the mouse moves onto it
+        planet = self.planet_at(event.x, event.y)
+        if( planet is not self.hovered ):
+            self.hovered = planet
+            if( planet is not None ):
+                planet.on_enter(event)
 
     # Spawn Celestial Object ( a Circle ) from click on canvas
     def spawn_objectClick(self, event):
 
-        # Check if an item on the canvas was clicked or the background itself
-        clicked_items = event.widget.find_withtag(tk.CURRENT)
-        
-        # Do not spawn anything if a planet was clicked
-        if clicked_items:
+        # Do not spawn anything while a recording is replayed
+        if self.replay is not None:
             return
         else:
             # Grab config info from config entries
@@ -380,18 +424,16 @@ class ObjectManager:
             real_y = (event.y - HEIGHT/2) / self.settings.SCALE
 
             # Create new celestial object
-            new_object = CelestialObject(
+            new_object = self.add_body(
                 Vector2(real_x, real_y), 
-                self.canvas,
-                float(radius),
-                mass,
                 Vector2(initial_velocity_x, initial_velocity_y),
-                tag,
-                self
+                mass,
+                float(radius),
+                tag
             )
-            self.celestialObjects.append(new_object)
 
-            new_object.draw()
+            if( new_object is not None ):
+                new_object.draw()
 
             # Clear config entries
             self.config['mass'].delete(0, tk.END)
@@ -400,125 +442,557 @@ class ObjectManager:
             self.config['radius'].delete(0, tk.END)
             self.config['tag'].delete(0, tk.END)
     
+    # Add a body to the simulation and create its view, None if the physics worker adds it
+    def add_body(self, position, velocity, mass, radius, tag, sun=False):
+
+        if( self.worker is not None ):
+            self.worker.send('add_body', (position.x, position.y), (velocity.x, velocity.y), mass, radius, tag, sun)
+            return None
+        return self.add_view(self.simulation.add_body(position, velocity, mass, radius, tag, sun))
+
+    # Create a Celestial Object on the canvas for a body of the simulation
+    def add_view(self, body):
+
+        new_object = CelestialObject(body, self.canvas, self)
+        self.celestialObjects.append(new_object)
+        return new_object
+
+    @property
+    def shown_store(self):
+        # Body store of the bodies on screen, the replay's while one is shown
+        return self.replay.simulation.store if self.replay is not None else self.simulation.store
+
+    def view(self, row):
+
+        # View of the body at row of the shown store, made if the body has none yet
+        store = self.shown_store
+        view = self.celestialObjects.get(int(store.ids[row]))
+        return view if view is not None else self.add_view(store.handle(row))
+
+    def load_scenario(self, path):
+
+        """
+        Add every body of a scenario file ( see scenario.read_scenario )
+
+        The bodies go into the simulation in one batch. No views are made for
+        them here, a body gets its view once it is drawn as an oval, bodies
+        smaller than a pixel or off screen are plotted from the store directly.
+        Returns None if the physics worker loads it, it reports when done.
+        """
+
+        if( self.worker is not None ):
+            self.worker.send('load_scenario', path)
+            return None
+        added = load_scenario(path, self.simulation)
+        self.redraw()
+        return added
+
     # Spawn Celestial Object ( a Circle ) with hardcoded values
     def spawn_object_hard(self, center, radius, mass, initial_v, tag):
 
-        new_object = CelestialObject(
-            center,
-            self.canvas,
-            radius,
-            mass,
-            initial_v,
-            tag,
-            self
-        )
-        self.celestialObjects.append(new_object)
+        return self.add_body(center, initial_v, mass, radius, tag)
 
 
     def spawn_sun(self):
-        
-        # mass of the sun
-        mass = 1.98892 * 10**30
-
-        new_object = CelestialObject(
-            Vector2(0, 0),
-            self.canvas,
-            10,
-            mass,
-            Vector2(0,0),
-            "Sun",
-            self
-        )
-        new_object.sun = True
-        new_object.distance_to_sun = 0
 
-        self.celestialObjects.append(new_object)
+        if( self.worker is not None ):
+            self.worker.send('spawn_sun')
+            return None
+        return self.add_view(self.simulation.spawn_sun())
 
     def reset_sun_position(self):
 
-        for planet in self.celestialObjects:
-
-            if( planet.sun ):
+        if( self.worker is not None ):
+            self.worker.send('reset_sun')
+            return
 
-                planet.real_position = Vector2(0,0)
-                planet.velocity = Vector2(0,0)
+        store = self.simulation.store
+        store.position[store.sun] = 0.0
+        store.velocity[store.sun] = 0.0
 
     def clear_planets(self):
 
+        if( self.replay is not None ):
+            messagebox.showerror("Error", "Cannot remove planets during a replay")
+            return
+
         result = messagebox.askyesno("Warning", "Are you sure you want to remove all planets?")
 
         if( result ):
 
-            # Make copy to avoid modification when iterating
-            planets_list = self.celestialObjects.copy()
+            # Every body but the sun, with its view and canvas items, in one pass
+            self.remove_bodies(~self.simulation.store.sun)
+            self.reset_sun_position()
 
-            for planet in planets_list:
+            # Asteroids go too
+            if( self.worker is not None ):
+                self.worker.send('clear_particles')
+            else:
+                self.simulation.particles.clear()
 
-                # skip sun
-                if( not planet.sun ):
-                    # delete canvas visual elements
-                    if( planet.oval_id ):
-                        self.canvas.delete(planet.oval_id)
-                    if( planet.orbit_line_id ):
-                        self.canvas.delete(planet.orbit_line_id)
+            # Clear selected planet from info frame
+            self.selected_planet = None
+            if( self.clear_callback ):
+                self.clear_callback()
+        
+        else:
+            return
 
-                    # delete canvas tags
-                    self.canvas.delete(planet.tag)
-                    self.canvas.delete(f"{planet.tag}_orbit")
+    def remove_bodies(self, selection):
 
-                    # remove event bindings
-                    self.canvas.tag_unbind(planet.tag, "<Enter>")
-                    self.canvas.tag_unbind(planet.tag, "<Button-1>")
-                    self.canvas.tag_unbind(planet.tag, "<Button-3>")
+        """
+        Remove bodies and their views in one pass
 
-                    # remove from celestialObjects list
-                    if( planet in self.celestialObjects ):
-                        self.celestialObjects.remove(planet)
-                else:
-                    self.reset_sun_position()
+        selection: boolean mask over the body store, or an array of store indices
 
-            # Clear selected planet from info frame
+        The canvas items of every removed view go in a single Tk call.
+        Returns the number of bodies removed
+        """
+
+        # The physics worker removes them, their views go once its next frame comes in
+        if( self.worker is not None ):
+            ids = self.simulation.store.ids[selection]
+            self.worker.send('remove', ids)
+            return len(ids)
+
+        ids = self.simulation.remove_bodies(selection)
+        removed = self.celestialObjects.remove_ids(ids)
+        self.remove_from_canvas(removed)
+        for planet in removed:
+            planet.orbit.clear()
+        if( self.selected_planet in removed ):
             self.selected_planet = None
             if( self.clear_callback ):
                 self.clear_callback()
-        
-        else:
+        return len(ids)
+
+    def remove_escaped(self):
+
+        # Remove the bodies that left the sun for good, see Simulation.escaped
+        removed = self.remove_bodies(self.simulation.escaped())
+        self.redraw()
+        return removed
+
+    def remove_from_canvas(self, planets):
+
+        # Take the ovals and orbit lines of planets off the canvas in one call, bodies and trails are kept
+        items = []
+        for planet in planets:
+            if( planet.oval_id is not None ):
+                items.append(planet.oval_id)
+            if( planet.orbit_line_id is not None ):
+                items.append(planet.orbit_line_id)
+            planet.oval_id = None
+            planet.orbit_line_id = None
+            planet.screen_rect = None
+            planet.hidden = False
+        if( items ):
+            self.renderer.delete(*items)
+
+    # Draw planets and orbit lines at their current positions, throttle lets the rendering quality skip trails this frame
+    def redraw(self, throttle=False):
+
+        # Grab draw orbit config variable
+        orbit_option = self.config['draw_orbit'].get()
+
+        # Draw every planet that moved on screen, bodies without a view go into the point layer
+        # with the test particles of the live simulation
+        with self.profiler.phase("draw"):
+            points = [self.show_new_bodies(self.shown_store)]
+            if( self.replay is None ):
+                points.append(self.simulation.particles.position)
+            self.renderer.draw_objects(self.celestialObjects, np.concatenate(points))
+
+        # Loop through planets and potentially draw orbit lines
+        orbits = []
+        hidden_orbits = []
+        for planet in self.celestialObjects:
+
+            # Draw orbits
+            if(not planet.sun and orbit_option):
+                orbits.append(planet)
+            # if orbit option deselected, remove orbit lines
+            if( not orbit_option and planet.orbit_line_id ):
+                hidden_orbits.append(planet.orbit_line_id)
+                planet.orbit_line_id = None
+                planet.orbit.clear()
+        # Every orbit line in one call
+        if( hidden_orbits ):
+            self.renderer.delete(*hidden_orbits)
+
+        # Trails are drawn with the points and smoothing of the current rendering quality
+        if( not throttle or self.quality.trails_due() ):
+            with self.profiler.phase("draw_orbit"):
+                self.renderer.draw_orbits(
+                    orbits, self.quality.trail_points(self.settings.MAX_TRAIL_POINTS), self.quality.smooth
+                )
+
+    def show_new_bodies(self, store):
+
+        # Make views for the bodies of store without one that are drawn as ovals now, returns the positions of the rest
+        rows = self.celestialObjects.missing(store)
+        if( not len(rows) ):
+            return np.zeros((0, 2))
+        ovals = self.renderer.drawn_as_oval(store.position[rows], store.radius[rows])
+        for row in rows[ovals].tolist():
+            self.add_view(store.handle(row))
+        return store.position[rows[~ovals]]
+
+    def record_trails(self):
+
+        """
+        Offer the current position of every planet to its orbit trail
+
+        One vectorized step over the TrailSet of the views, see TrailSet.offer.
+        Trails measure the angle swept around the sun, whose position is kept
+        in sun_position. Nothing is recorded while orbits are not drawn.
+        """
+
+        store = self.shown_store
+        suns = np.flatnonzero(store.sun)
+        self.sun_position = tuple(store.position[suns[0]].tolist()) if len(suns) else (0.0, 0.0)
+        if( not self.config['draw_orbit'].get() or not len(self.celestialObjects) ):
+            return
+
+        rows = store.rows(self.celestialObjects.ids())
+        active = rows >= 0
+        rows[~active] = 0
+        active &= ~store.sun[rows]
+        self.celestialObjects.trails.offer(store.position[rows], active, *self.sun_position)
+
+    def checkpoint(self):
+
+        # Snapshot of the live simulation, the selected planet and the orbit trails
+        if( self.replay is not None ):
+            # Planets on screen belong to the replay
+            return snapshot(self.simulation, None, {planet.body.index: planet.orbit for planet in self.live_objects})
+        return snapshot(
+            self.simulation,
+            self.selected_planet.body if self.selected_planet else None,
+            {planet.body.index: planet.orbit for planet in self.celestialObjects}
+        )
+
+    def save_state(self, path):
+
+        # Save a checkpoint right away, waits for a running autosave first
+        if( self._checkpoint_writer is not None ):
+            self._checkpoint_writer.join()
+        write_checkpoint(path, self.checkpoint())
+
+    def load_state(self, path):
+
+        """
+        Replace the simulation with a saved checkpoint
+
+        Views of every body are created in one batch, canvas items are only
+        made for planets once they are drawn on screen. A running physics
+        worker is restarted from the loaded state.
+        """
+
+        restart = self.worker is not None
+        self.stop_worker()
+        try:
+            self._load_state(path)
+        finally:
+            if( restart ):
+                self.start_worker()
+
+    def _load_state(self, path):
+
+        self.stop_replay()
+        self.remove_from_canvas(self.celestialObjects)
+        self.celestialObjects = ViewRegistry()
+        if( self.clear_callback ):
+            self.clear_callback()
+
+        selected, trails = load_checkpoint(path, self.simulation)
+
+        # Views are made as bodies are drawn, only the bodies with a saved trail need one now
+        for index, (points, revolution) in trails.items():
+            self.view(index).orbit.restore(points, revolution)
+
+        self.redraw()
+        if( selected is not None and self.update_callback ):
+            self.update_callback(self.view(selected))
+
+    def add_asteroid_belt(self):
+
+        # Scatter settings.ASTEROID_COUNT test particles between ASTEROID_INNER_AU and ASTEROID_OUTER_AU
+        belt = (self.settings.ASTEROID_COUNT, self.settings.ASTEROID_INNER_AU, self.settings.ASTEROID_OUTER_AU)
+        if( self.worker is not None ):
+            self.worker.send('add_asteroid_belt', *belt)
+            return
+        self.simulation.add_asteroid_belt(*belt)
+        self.redraw()
+
+    def time_warp(self, t):
+
+        # Jump the simulation to simulated time t, analytically where the orbits allow it, None if the physics worker does
+        if( self.worker is not None ):
+            self.worker.send('time_warp', t)
+            return None
+        result = time_warp(self.simulation, t)
+        self.warped()
+        return result
+
+    def warped(self):
+
+        # Trails would draw a straight line across the jump
+        for planet in self.celestialObjects:
+            planet.orbit.clear()
+        self.redraw()
+        if( self.selected_planet ):
+            self.update_callback(self.selected_planet)
+
+    def autosave_checkpoint(self):
+
+        # Write a checkpoint on a background thread every CHECKPOINT_INTERVAL seconds of wall time
+        now = time.perf_counter()
+        if( not self.autosave or now - self._last_checkpoint < self.settings.CHECKPOINT_INTERVAL ):
+            return
+        if( self._checkpoint_writer is not None and self._checkpoint_writer.is_alive() ):
+            return
+
+        self._last_checkpoint = now
+        # Copying the state is quick, only writing it happens off the GUI thread
+        data = self.checkpoint()
+        self._checkpoint_writer = threading.Thread(
+            target=write_checkpoint,
+            args=(self.settings.CHECKPOINT_PATH, data),
+            daemon=True
+        )
+        self._checkpoint_writer.start()
+
+    def start_replay(self, replay):
+
+        """
+        Show a recorded trajectory instead of the simulation
+
+        replay: recording.Replay, the live simulation is left untouched and
+                shown again by stop_replay
+        """
+
+        if( self.replay is not None ):
+            self.stop_replay()
+
+        # Take the live planets off the canvas, their bodies and trails are kept
+        self.live_objects = self.celestialObjects
+        self.remove_from_canvas(self.live_objects)
+        self.celestialObjects = ViewRegistry()
+        self.replay = replay
+
+        if( self.selected_planet and self.clear_callback ):
+            self.clear_callback()
+
+    def stop_replay(self):
+
+        # Remove the replayed planets and show the live simulation again
+        if( self.replay is None ):
+            return
+
+        self.remove_from_canvas(self.celestialObjects)
+        self.celestialObjects = self.live_objects
+        self.live_objects = None
+        self.replay = None
+
+        if( self.selected_planet and self.clear_callback ):
+            self.clear_callback()
+        self.redraw()
+
+    def sync_views(self):
+
+        # Drop the views of bodies merged away by a collision, bodies added by the physics worker get views once drawn
+        store = self.simulation.store
+        if( (store, store.generation) == self._generation ):
             return
+        self._generation = (store, store.generation)
+
+        views = self.celestialObjects
+        if( len(views) and views[0].body.store is store ):
+            ids = views.ids()
+            gone = ids[store.rows(ids) < 0]
+            if( len(gone) ):
+                removed = views.remove_ids(gone)
+                self.remove_from_canvas(removed)
+                if( self.selected_planet in removed ):
+                    self.selected_planet = None
+                    if( self.clear_callback ):
+                        self.clear_callback()
+
+        # Nothing is redrawn while paused, planets the worker added show up right away all the same
+        if( self.worker is not None and self.config['pause'] ):
+            self.redraw()
+
+    def update_replay(self):
+
+        # Show the next frame of the replay, no physics is run
+        if( self.replay.advance() ):
+            self.rebuild_replay_views()
+
+        with self.profiler.phase("trails"):
+            self.record_trails()
+
+        self.redraw(throttle=True)
+
+        if( self.selected_planet and self.quality.info_due() ):
+            with self.profiler.phase("update_planet_info"):
+                self.update_callback(self.selected_planet)
+        if( self.replay_callback ):
+            self.replay_callback(self.replay)
+
+    def rebuild_replay_views(self):
+
+        # Bodies were added or removed in the recording, replace the views, new ones are made as bodies are drawn
+        self.remove_from_canvas(self.celestialObjects)
+        self.celestialObjects = ViewRegistry()
+        if( self.selected_planet and self.clear_callback ):
+            self.clear_callback()
+
+    def seek_replay(self, index):
+
+        # Jump to frame index of the replay, trails would connect unrelated points so they restart
+        if( self.replay is None ):
+            return
+        if( self.replay.seek(index) ):
+            self.rebuild_replay_views()
+        for planet in self.celestialObjects:
+            planet.orbit.clear()
 
     def update_objects(self):
 
+        self.profiler.begin_frame()
+        # Every canvas call from here to finish_frame is counted with the frame
+        self.renderer.begin_frame()
+
+        # Replays only draw recorded frames
+        if( self.replay is not None ):
+            if( self.empty_message_shown ):
+                self.renderer.itemconfig(self.empty_solar_system, state="hidden")
+                self.empty_message_shown = False
+            self.scheduler.run_frame(self.simulation.step, paused=True)
+            self.update_replay()
+            self.finish_frame()
+            return
+
+        # The physics runs in the worker process, take the latest frame it published
+        if( self.worker is not None ):
+            with self.profiler.phase("physics"):
+                self.update_worker()
+
         # If not planets are on canvas, display edgy message at the bottom
-        if( len(self.celestialObjects) == 1):
+        if( len(self.simulation.store) == 1 and not len(self.simulation.particles) ):
 
-            self.canvas.itemconfig(self.empty_solar_system, state="normal")
+            if( not self.empty_message_shown ):
+                self.renderer.itemconfig(self.empty_solar_system, state="normal")
+                self.empty_message_shown = True
+            if( self.worker is None ):
+                self.scheduler.run_frame(self.simulation.step, paused=True)
 
         else:
             # Remove edgy message at the bottom
-            self.canvas.itemconfig(self.empty_solar_system, state="hidden")
+            if( self.empty_message_shown ):
+                self.renderer.itemconfig(self.empty_solar_system, state="hidden")
+                self.empty_message_shown = False
+
+            # Run the physics steps owed for this frame, nothing while paused
+            if( self.worker is None ):
+                with self.profiler.phase("physics"):
+                    self.scheduler.run_frame(self.simulation.step, paused=self.config['pause'])
+                self.sync_views()
 
             # Check for pause
             if( not self.config['pause'] ):
-                # Grab draw orbit config variable
-                orbit_option = self.config['draw_orbit'].get()
 
-                # Loop through planets and draw and update positions and potentially draw orbit lines
-                for planet in self.celestialObjects:
+                # Extend the orbit trails of every planet in one step
+                with self.profiler.phase("trails"):
+                    self.record_trails()
+
+                self.redraw(throttle=True)
 
-                    planet.draw()
-                    planet.update_position(self.celestialObjects)
-                    # Draw orbits
-                    if(planet.tag != "Sun" and orbit_option):
-                        planet.draw_orbit()
-                    # if orbit option deselected, remove orbit lines
-                    if( not orbit_option and planet.orbit_line_id ):
-                        self.canvas.delete(f"{planet.tag}_orbit")
-                        planet.orbit_line_id = None
-                        planet.orbit = []
+                with self.profiler.phase("autosave"):
+                    self.autosave_checkpoint()
 
 
             # Send selected planet info to update_planet_info
-            if( hasattr(self, 'selected_planet') and self.selected_planet ):
-                self.update_callback(self.selected_planet)
+            if( hasattr(self, 'selected_planet') and self.selected_planet and self.quality.info_due() ):
+                with self.profiler.phase("update_planet_info"):
+                    self.update_callback(self.selected_planet)
 
-        
-        self.canvas.after(self.settings.SPEED, self.update_objects)
+            # Refresh the diagnostics readout when new samples came in
+            diagnostics = self.simulation.diagnostics
+            if( diagnostics is not None and self.diagnostics_callback and diagnostics.taken != self._diagnostics_taken ):
+                self._diagnostics_taken = diagnostics.taken
+                with self.profiler.phase("diagnostics"):
+                    self.diagnostics_callback(diagnostics)
+
+        self.finish_frame()
+
+    def start_worker(self):
+
+        """
+        Run the physics in a worker process from now on, see worker.PhysicsClient
+
+        The simulation becomes a mirror of the worker's state, which the GUI
+        draws while the worker steps on another core. Changes to the bodies
+        are sent to the worker as commands and show up with its next frame.
+        """
+
+        if( self.worker is None ):
+            self.worker = PhysicsClient(self.simulation)
+
+    def stop_worker(self):
+
+        # Run the physics in this process again, from the last frame the worker published
+        if( self.worker is None ):
+            return
+        worker, self.worker = self.worker, None
+        worker.stop(self.simulation)
+        self.sync_views()
+
+    def update_worker(self):
+
+        # Take the latest frame of the worker, the scheduler only measures the frame rate
+        self.scheduler.run_frame(self.simulation.step, paused=True)
+        try:
+            self.scheduler.steps = self.worker.update(self.simulation, bool(self.config['pause']))
+        except RuntimeError as e:
+            print(e)
+            self.stop_worker()
+            messagebox.showerror("Error", "The physics worker stopped, the simulation continues without it")
+            return
+        self.scheduler.steps_per_second = self.worker.steps_per_second
+        self.sync_views()
+
+        # Commands the worker finished since the last frame
+        for kind, command, value in self.worker.take_results():
+            if( kind == 'error' ):
+                messagebox.showerror("Error", f"Could not {command.replace('_', ' ')}: {value}")
+            elif( command == 'time_warp' ):
+                self.warped()
+                year = 365.25 * 24 * 3600
+                print(f"Warped to year {self.simulation.time / year:.2f}, "
+                      f"{value['kepler_time'] / year:.2f} years analytically, {value['nbody_steps']} N-body steps")
+            elif( command == 'load_scenario' ):
+                print(f"Loaded {value} bodies")
+
+    def finish_frame(self):
+
+        # Close the profiled frame, adapt the rendering quality, refresh the HUD and schedule the next frame at the display rate
+        self.renderer.calls += self.hud.update()
+        self.renderer.end_frame()
+        physics_ms = self.profiler.phase_ms("physics")
+        frame_ms = self.profiler.end_frame(
+            steps=self.scheduler.steps, tk_calls=self.renderer.frame_calls, quality=self.quality.level
+        )
+        if( frame_ms is not None ):
+            # Quality only changes rendering, so it is judged on the frame without its physics
+            self.quality.end_frame(frame_ms - physics_ms)
+        self.canvas.after(self.scheduler.next_delay(), self.update_objects)
+
+    def quality_changed(self, old, level, reason):
+        # Show rendering quality changes in the trace
+        self.profiler.mark("quality", old=old, level=level, reason=reason)
+
+    def export_trace(self, path):
+        # Write the profiled frames as a Chrome trace event file
+        self.profiler.export_trace(path)
@@ -0,0 +1,135 @@
+import json
+import os
+import numpy as np
+from bodystore import BodyStore
+
+
+# Version of the checkpoint layout, bumped when fields change
+FORMAT_VERSION = 1
+
+# Settings the program running a simulation picks for itself, e.g. the window switches
+# collisions on while headless runs keep them off, restoring keeps the running program's value
+LOCAL_SETTINGS = ('collisions',)
+
+
+def snapshot(simulation, selected=None, trails=None):
+
+    """
+    Copy of everything a checkpoint holds, cheap enough to take every frame
+
+    simulation: Simulation to save
+    selected: body handle selected in the GUI, or None
+    trails: optional dict of body index to TrailBuffer
+
+    Returns a dict of numpy arrays for write_checkpoint, which can then run on another thread
+    """
+
+    store = simulation.store
+    data = {
+        'version': np.array(FORMAT_VERSION),
+        'position': store.position.copy(),
+        'velocity': store.velocity.copy(),
+        'mass': store.mass.copy(),
+        'radius': store.radius.copy(),
+        'sun': store.sun.copy(),
+        'id': store.ids.copy(),
+        'next_id': np.array(store.next_id),
+        # Tags are joined into one string, one array entry per tag would be slow to save
+        'tags': np.array(json.dumps(store.tags)),
+        'time': np.array(simulation.time),
+        'steps': np.array(simulation.steps),
+        'settings': np.array(json.dumps(vars(simulation.settings))),
+        'selected': np.array(-1 if selected is None or selected.index is None else selected.index),
+        'particle_position': simulation.particles.position.copy(),
+        'particle_velocity': simulation.particles.velocity.copy(),
+    }
+
+    if( trails ):
+        index = sorted(index for index, trail in trails.items() if len(trail))
+        points = [trails[i].thinned(trails[i].capacity) for i in index]
+        data['trail_index'] = np.array(index, dtype=np.int64)
+        data['trail_length'] = np.array([len(p) for p in points], dtype=np.int64)
+        data['trail_revolution'] = np.array([
+            -1 if trails[i].revolution is None else trails[i].revolution for i in index
+        ], dtype=np.int64)
+        data['trail_points'] = np.concatenate(points) if points else np.zeros((0, 2))
+
+    return data
+
+
+def write_checkpoint(path, data):
+
+    # Write a snapshot atomically, a crash mid-write leaves the previous checkpoint intact
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as checkpoint_file:
+        # Uncompressed, so saving is bound by memory bandwidth rather than the compressor
+        np.savez(checkpoint_file, **data)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temporary, path)
+
+
+def save_checkpoint(path, simulation, selected=None, trails=None):
+    write_checkpoint(path, snapshot(simulation, selected, trails))
+
+
+def load_checkpoint(path, simulation):
+
+    """
+    Restore a checkpoint into simulation, replacing its bodies, test particles, time and settings
+
+    Settings in LOCAL_SETTINGS keep the values simulation already has.
+
+    Bodies are copied into a new BodyStore in one go, no per body objects are made.
+
+    Returns ( selected, trails ): the index of the selected body or None, and a dict
+    of body index to ( points, revolution ) of the saved trails, empty if none were saved
+    """
+
+    with np.load(path) as data:
+        if( int(data['version']) > FORMAT_VERSION ):
+            raise ValueError(f"{path} was written by a newer version")
+        return restore(data, simulation)
+
+
+def restore(data, simulation):
+
+    # Restore a snapshot, a dict of arrays or an open checkpoint file, into simulation, see load_checkpoint
+    store = BodyStore(max(16, len(data['mass'])))
+    store.extend(
+        data['position'],
+        data['velocity'],
+        data['mass'],
+        data['radius'],
+        json.loads(str(data['tags'])),
+        data['sun'],
+        # Checkpoints from before bodies had ids get new ones
+        data['id'] if 'id' in data else None
+    )
+    if( 'next_id' in data ):
+        store.next_id = max(store.next_id, int(data['next_id']))
+
+    # Settings saved by a different version may have more or fewer fields
+    for name, value in json.loads(str(data['settings'])).items():
+        if( hasattr(simulation.settings, name) and name not in LOCAL_SETTINGS ):
+            setattr(simulation.settings, name, value)
+
+    simulation.store = store
+    simulation.particles.clear()
+    if( 'particle_position' in data ):
+        simulation.particles.add(data['particle_position'], data['particle_velocity'])
+    simulation.time = float(data['time'])
+    simulation.steps = int(data['steps'])
+    # Cached accelerations belong to the old state
+    simulation.integrator.reset()
+    simulation.update_distance_to_sun()
+
+    selected = int(data['selected'])
+    trails = {}
+    if( 'trail_index' in data ):
+        ends = np.cumsum(data['trail_length'])
+        points = data['trail_points']
+        for index, end, length, revolution in zip(data['trail_index'], ends, data['trail_length'], data['trail_revolution']):
+            trails[int(index)] = (points[end - length:end], None if revolution < 0 else int(revolution))
+
+    return (None if selected < 0 else selected), trails
@@ -0,0 +1,234 @@
+import math
+import numpy as np
+
+
+# Up to this many bodies every pair is tested directly, the hash costs more than it saves
+BRUTE_FORCE_BODIES = 64
+
+# Bodies more than this many times larger than the median body are tested against every
+# body instead of going into the hash, a single sun would otherwise make every cell huge
+LARGE_BODY_FACTOR = 8.0
+
+# Cells of the half neighbourhood ( dx, dy ) searched from each cell, the other half
+# is covered by the neighbouring cells searching back
+_NEIGHBOURS = ((0, 1), (1, -1), (1, 0), (1, 1))
+
+# Cache of upper triangle indices per body count of the brute force test
+_pairs_cache = {}
+
+# Result of a search without any collision
+_EMPTY = np.zeros(0, dtype=np.int64)
+
+
+def collision_radii(settings, mass):
+    # Physical radius in meters of spheres of the given masses in kg at settings.COLLISION_DENSITY
+    return np.cbrt(3 * np.asarray(mass, dtype=np.float64) / (4 * math.pi * settings.COLLISION_DENSITY))
+
+
+def _overlapping(positions, radii, i, j):
+    # Keep the candidate pairs whose circles overlap
+    separation = positions[j] - positions[i]
+    reach = radii[i] + radii[j]
+    hit = np.einsum('ij,ij->i', separation, separation) < reach * reach
+    return i[hit], j[hit]
+
+
+def _swept(positions, previous, radii, i, j):
+
+    # Keep the candidate pairs whose circles touched at some point of the step, both bodies moving in a straight line from previous to positions
+    start = previous[j] - previous[i]
+    motion = positions[j] - positions[i] - start
+    speed = np.einsum('ij,ij->i', motion, motion)
+    # Fraction of the step at which the pair came closest
+    with np.errstate(divide='ignore', invalid='ignore'):
+        closest = np.clip(-np.einsum('ij,ij->i', start, motion) / speed, 0.0, 1.0)
+    closest[speed == 0] = 0.0
+    separation = start + closest[:, None] * motion
+    reach = radii[i] + radii[j]
+    hit = np.einsum('ij,ij->i', separation, separation) < reach * reach
+    return i[hit], j[hit]
+
+
+def _brute_force(positions, radii):
+    # Overlapping pairs of a few bodies, and the smallest gap between two circles
+    n = len(positions)
+    if( n not in _pairs_cache ):
+        _pairs_cache[n] = np.triu_indices(n, 1)
+    i, j = _pairs_cache[n]
+    separation = positions[j] - positions[i]
+    gap = np.sqrt(np.einsum('ij,ij->i', separation, separation)) - (radii[i] + radii[j])
+    clearance = float(gap.min())
+    if( clearance >= 0 ):
+        return _EMPTY, _EMPTY, clearance
+    hit = gap < 0
+    return i[hit], j[hit], clearance
+
+
+def _runs(start, stop):
+    # Owner and member indices of the ranges start[k]:stop[k], all ranges concatenated
+    counts = np.maximum(stop - start, 0)
+    owner = np.repeat(np.arange(len(start)), counts)
+    run_start = np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, np.repeat(start, counts) + (np.arange(len(owner)) - run_start)
+
+
+def find_collisions(positions, radii):
+    # Every pair of bodies whose circles overlap, see search
+    i, j, _ = search(positions, radii)
+    return i, j
+
+
+def search(positions, radii, previous=None):
+
+    """
+    Every pair of bodies whose circles overlap
+
+    positions: ( N, 2 ) array of positions in meters
+    radii: ( N, ) array of collision radii in meters
+    previous: optional ( N, 2 ) array of the positions at the start of the step,
+              pairs whose circles touched anywhere along the straight paths
+              from there are found too, so a fast body can not pass through
+              another between two steps
+
+    Bodies are sorted into a uniform grid ( spatial hash ) with cells as wide as
+    the largest body is across, so touching bodies always sit in the same or in
+    neighbouring cells and only those pairs are tested. With bodies spread out
+    this is O(N log N), the cost of the sort. Bodies much larger than the rest
+    are tested against every body on their own, O(N) each.
+
+    Returns two ( P, ) arrays i, j of body indices with i < j, and the smallest
+    gap between two circles if every pair was tested, else 0
+    """
+
+    positions = np.asarray(positions, dtype=np.float64)
+    radii = np.asarray(radii, dtype=np.float64)
+    n = len(positions)
+
+    if( previous is not None ):
+        # The path of every body lies inside a circle around its middle, pairs of those circles are swept exactly
+        previous = np.asarray(previous, dtype=np.float64)
+        path = positions - previous
+        i, j, clearance = search(previous + path / 2, radii + np.hypot(path[:, 0], path[:, 1]) / 2)
+        i, j = _swept(positions, previous, radii, i, j)
+        return i, j, clearance
+
+    if( n < 2 ):
+        return _EMPTY, _EMPTY, np.inf
+
+    if( n <= BRUTE_FORCE_BODIES ):
+        return _brute_force(positions, radii)
+
+    found_i, found_j = [], []
+
+    # Large bodies against everything
+    large = radii > LARGE_BODY_FACTOR * np.median(radii)
+    for body in np.flatnonzero(large):
+        separation = positions - positions[body]
+        reach = radii + radii[body]
+        hit = np.einsum('ij,ij->i', separation, separation) < reach * reach
+        # Pairs of two large bodies are found once, from the lower index
+        hit &= ~large | (np.arange(n) > body)
+        hit[body] = False
+        other = np.flatnonzero(hit)
+        found_i.append(np.minimum(other, body))
+        found_j.append(np.maximum(other, body))
+
+    # Everything else through the hash
+    small = np.flatnonzero(~large)
+    cell = 2 * radii[small].max() if len(small) else 0.0
+    if( len(small) > 1 and cell > 0 ):
+        grid = np.floor(positions[small] / cell).astype(np.int64)
+        grid -= grid.min(axis=0)
+        # Column height with a spare row on both sides, so dy = +-1 never wraps into the next column
+        height = int(grid[:, 1].max()) + 3
+        keys = grid[:, 0] * height + grid[:, 1] + 1
+
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        end_of_own_cell = np.searchsorted(sorted_keys, sorted_keys, 'right')
+
+        # Same cell, each pair once
+        owner, member = _runs(np.arange(1, len(small) + 1), end_of_own_cell)
+        candidates = [(owner, member)]
+
+        for dx, dy in _NEIGHBOURS:
+            target = sorted_keys + (dx * height + dy)
+            start = np.searchsorted(sorted_keys, target, 'left')
+            stop = np.searchsorted(sorted_keys, target, 'right')
+            candidates.append(_runs(start, stop))
+
+        owner = np.concatenate([c[0] for c in candidates])
+        member = np.concatenate([c[1] for c in candidates])
+        i = small[order[owner]]
+        j = small[order[member]]
+        i, j = _overlapping(positions, radii, i, j)
+        found_i.append(np.minimum(i, j))
+        found_j.append(np.maximum(i, j))
+
+    if( not found_i ):
+        return _EMPTY, _EMPTY, 0.0
+    return np.concatenate(found_i), np.concatenate(found_j), 0.0
+
+
+class CollisionDetector:
+
+    """
+    Finds bodies that touched during a step, skipping the search while none can touch yet
+
+    After a search that tested every pair, no pair can touch before two bodies
+    have together moved as far as the smallest gap found. Until then only how
+    far every body moved since that search is checked, at both ends of the
+    step, O(N) and much cheaper than the search for the few bodies where every
+    pair is tested. Straight paths between two points that close to where a
+    body was searched stay that close too.
+    """
+
+    def __init__(self) -> None:
+        # Store, generation and collision density the last search ran on
+        self._store = None
+        self._generation = None
+        self._density = None
+        self._radii = None
+        self._positions = None
+        self._moved = None
+        self._clearance = 0.0
+
+    def find(self, store, settings, previous=None):
+
+        # Pairs ( i, j ), i < j, of the bodies of a BodyStore that touch, or touched on the way from previous ( see search )
+        positions = store.position
+        same = store is self._store and store.generation == self._generation and settings.COLLISION_DENSITY == self._density
+        if( same and self._clearance > 0 ):
+            # No body moved further than sqrt(2) times its largest coordinate change
+            moved = 0.0
+            for ends in (positions,) if previous is None else (positions, previous):
+                np.subtract(ends, self._positions, out=self._moved)
+                np.abs(self._moved, out=self._moved)
+                moved = max(moved, self._moved.max())
+            if( 2 * math.sqrt(2) * moved < self._clearance ):
+                return _EMPTY, _EMPTY
+
+        if( not same ):
+            self._radii = collision_radii(settings, store.mass)
+            self._store = store
+            self._generation = store.generation
+            self._density = settings.COLLISION_DENSITY
+        i, j, self._clearance = search(positions, self._radii, previous)
+        self._positions = positions.copy()
+        self._moved = np.empty_like(self._positions)
+        return i, j
+
+
+def merge_groups(n, i, j):
+
+    # Group label of every body, bodies linked by a chain of colliding pairs share the lowest index among them
+    labels = np.arange(n)
+    while( True ):
+        low = np.minimum(labels[i], labels[j])
+        before = labels.copy()
+        np.minimum.at(labels, i, low)
+        np.minimum.at(labels, j, low)
+        # Pointer jumping, every label follows its label to the root
+        labels = labels[labels]
+        if( np.array_equal(labels, before) ):
+            return labels
@@ -0,0 +1,160 @@
+import numpy as np
+from gravity import potential_energy
+
+
+# Quantities sampled by Diagnostics, in the order of the columns of its time series
+QUANTITIES = (
+    'time', 'kinetic', 'potential', 'energy', 'momentum_x', 'momentum_y',
+    'angular_momentum', 'energy_error', 'angular_momentum_error'
+)
+
+
+def relative_error(value, reference):
+    # Change of value relative to reference, absolute when the reference is zero
+    return abs(value - reference) / abs(reference) if reference else abs(value - reference)
+
+
+class Diagnostics:
+
+    """
+    Samples the conserved quantities of a Simulation every `interval` simulated seconds
+
+    Attach it as simulation.diagnostics. Total energy, linear momentum and
+    angular momentum are computed in a few numpy reductions over the body
+    store. The potential energy comes for free from the last force evaluation
+    of the step a sample falls on ( see Simulation.accelerations ) when the
+    direct solver and an integrator that ends its step with a force
+    evaluation are used, otherwise it costs one extra O(N^2) pass.
+
+    Relative energy and angular momentum errors are measured against the first
+    sample, which is taken again whenever bodies are added or removed. An
+    energy error above `threshold` raises an alert: it is appended to `alerts`
+    and on_alert is called. With an interval of 0 nothing is sampled and the
+    simulation runs as if no diagnostics were attached. Samples taken by the
+    Diagnostics of another process, e.g. a physics worker, are kept with append.
+
+    interval: simulated seconds between samples, 0 to switch sampling off
+    threshold: relative energy error that raises an alert
+    capacity: samples kept, the oldest are dropped first
+    on_sample, on_alert: optional callbacks taking the Diagnostics object
+    """
+
+    def __init__(self, interval, threshold=1e-4, capacity=10000, on_sample=None, on_alert=None) -> None:
+        self.interval = interval
+        self.threshold = threshold
+        self.on_sample = on_sample
+        self.on_alert = on_alert
+        # One row per sample, columns as in QUANTITIES, kept as a ring buffer
+        self._samples = np.zeros((capacity, len(QUANTITIES)), dtype=np.float64)
+        self.count = 0
+        self._next = 0
+        # Samples taken in total, including dropped ones
+        self.taken = 0
+        # Simulated time of the next sample
+        self.next_time = None
+        # ( energy, angular momentum ) the errors are measured against, and the store they belong to
+        self.reference = None
+        self._store = None
+        self._generation = None
+        # ( time, relative energy error ) of every alert raised
+        self.alerts = []
+        self.alerting = False
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def capacity(self):
+        return len(self._samples)
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def due(self, t):
+        # Whether a sample is owed at simulated time t
+        return self.enabled and (self.next_time is None or t >= self.next_time)
+
+    def record(self, simulation):
+        # Take a sample if one is due, called by Simulation.step
+        if( self.due(simulation.time) ):
+            self.sample(simulation)
+
+    def sample(self, simulation):
+
+        # Measure every quantity now, returns the sample as a dict
+        store = simulation.store
+        position, velocity, mass = store.position, store.velocity, store.mass
+
+        kinetic = 0.5 * float(np.dot(mass, np.einsum('ij,ij->i', velocity, velocity)))
+        potential = simulation.last_potential()
+        if( potential is None ):
+            potential = float(potential_energy(position, mass, simulation.settings.G))
+        energy = kinetic + potential
+        momentum = np.dot(mass, velocity)
+        angular_momentum = float(np.dot(mass, position[:, 0] * velocity[:, 1] - position[:, 1] * velocity[:, 0]))
+
+        # Adding or removing bodies changes the energy for real, start measuring again
+        if( self._store is not store or self._generation != store.generation ):
+            self._store = store
+            self._generation = store.generation
+            self.reference = (energy, angular_momentum)
+            self.alerting = False
+        error = relative_error(energy, self.reference[0])
+        angular_momentum_error = relative_error(angular_momentum, self.reference[1])
+
+        row = (
+            simulation.time, kinetic, potential, energy, float(momentum[0]), float(momentum[1]),
+            angular_momentum, error, angular_momentum_error
+        )
+        self.append(row)
+        return dict(zip(QUANTITIES, row))
+
+    def append(self, row):
+
+        # Keep a sample, a sequence in the order of QUANTITIES, and raise an alert if its energy error is too large
+        t, error = row[0], row[QUANTITIES.index('energy_error')]
+        self._samples[self._next] = row
+        self._next = (self._next + 1) % len(self._samples)
+        self.count = min(self.count + 1, len(self._samples))
+        self.taken += 1
+        self.next_time = t + self.interval
+
+        if( self.on_sample ):
+            self.on_sample(self)
+
+        # Alert once when the error crosses the threshold, again only after it dropped back below
+        if( error > self.threshold and not self.alerting ):
+            self.alerting = True
+            self.alerts.append((t, error))
+            if( self.on_alert ):
+                self.on_alert(self)
+        elif( error <= self.threshold ):
+            self.alerting = False
+
+    def samples(self):
+        # ( count, len(QUANTITIES) ) array of the kept samples, oldest first
+        if( self.count < len(self._samples) ):
+            return self._samples[:self.count]
+        return np.roll(self._samples, -self._next, axis=0)
+
+    def series(self, name):
+        # ( times, values ) of one quantity
+        samples = self.samples()
+        return samples[:, 0], samples[:, QUANTITIES.index(name)]
+
+    def latest(self):
+        # Last sample as a dict, None before the first sample
+        if( not self.count ):
+            return None
+        return dict(zip(QUANTITIES, self._samples[self._next - 1].tolist()))
+
+    def clear(self):
+        self.count = 0
+        self._next = 0
+        self.taken = 0
+        self.next_time = None
+        self.reference = None
+        self._store = None
+        self.alerts = []
+        self.alerting = False
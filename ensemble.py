@@ -0,0 +1,304 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+from batch import BatchSimulation
+from simulation import Simulation
+
+
+# Seconds in a year
+YEAR = 365.25 * 24 * 3600
+
+# Wall seconds between checks of the cancel event while waiting for a batch
+CANCEL_POLL = 0.1
+
+# Default settings of an ensemble member, any of them can be overridden per member
+MEMBER_DEFAULTS = {
+    # simulated years to run
+    'years': 10000,
+    # timestep in days
+    'timestep_days': 1,
+    'integrator': "leapfrog",
+    # also spawn the preset planets of our solar system
+    'include_presets': True,
+    # a tracked planet counts as escaped once it is this far from the sun and unbound
+    'escape_distance_au': 100,
+    # stop the member as soon as a tracked planet escapes
+    'stop_on_escape': True,
+    # steps between samples of sun distance and escape checks
+    'sample_steps': 10,
+}
+
+
+def make_grid(base_planet, **axes):
+
+    """
+    Ensemble members for every combination of the given parameter values
+
+    base_planet: keyword arguments of Simulation.add_planet for the planet being varied
+    axes: add_planet parameters or MEMBER_DEFAULTS settings mapped to lists of values,
+          e.g. eccentricity=[0, 0.2, 0.4], mass=[1e24, 1e26]
+
+    Returns a list of member dicts with a unique 'id'
+    """
+
+    names = list(axes)
+    members = []
+    for values in itertools.product(*(axes[name] for name in names)):
+        planet = dict(base_planet)
+        member = {}
+        for name, value in zip(names, values):
+            if( name in MEMBER_DEFAULTS ):
+                member[name] = value
+            else:
+                planet[name] = value
+        member['planets'] = [planet]
+        member['id'] = "-".join(f"{name}={value}" for name, value in zip(names, values)) or "base"
+        members.append(member)
+    return members
+
+
+def member_options(member):
+    # MEMBER_DEFAULTS overridden by the settings given in member
+    options = dict(MEMBER_DEFAULTS)
+    options.update({key: value for key, value in member.items() if key in MEMBER_DEFAULTS})
+    return options
+
+
+def build_member(member, options):
+
+    # Simulation set up for a member, with the sun and the planets it tracks
+    simulation = Simulation()
+    settings = simulation.settings
+    settings.TIMESTEP = options['timestep_days'] * 3600 * 24
+    settings.integrator = options['integrator']
+
+    sun = simulation.spawn_sun()
+    if( options['include_presets'] ):
+        presets = simulation.spawn_planets()
+    tracked = [simulation.add_planet(**planet) for planet in member.get('planets', ())]
+    if( not tracked and options['include_presets'] ):
+        tracked = presets
+    return simulation, sun, tracked
+
+
+def batch_key(member):
+    # Members with the same key can share a BatchSimulation
+    options = member_options(member)
+    return (tuple(sorted(options.items())), len(member.get('planets', ())))
+
+
+def run_member(member):
+
+    """
+    Run one ensemble member headlessly and summarize it
+
+    member: dict with an 'id', a list of 'planets' ( keyword arguments of
+            Simulation.add_planet ) and optionally any MEMBER_DEFAULTS setting
+
+    Returns a JSON serializable summary with the escape time, minimum and maximum
+    sun distance of every tracked planet and the relative energy drift
+    """
+
+    return run_batch([member])[0]
+
+
+def run_batch(members):
+
+    """
+    Run several ensemble members in one BatchSimulation and summarize each
+
+    members: member dicts that all have the same batch_key, every member
+             evolves exactly as it would in run_member
+
+    Returns one summary per member, in order
+    """
+
+    options = member_options(members[0])
+    if( any(batch_key(member) != batch_key(members[0]) for member in members) ):
+        raise ValueError("members of a batch need the same settings and number of planets")
+
+    built = [build_member(member, options) for member in members]
+    simulation, sun, tracked = built[0]
+    settings = simulation.settings
+    tracked_index = np.array([body.index for body in tracked], dtype=np.int64)
+    tags = [[body.tag for body in planets] for _, _, planets in built]
+
+    start = time.perf_counter()
+    batch = BatchSimulation.from_simulations([simulation for simulation, _, _ in built])
+    initial_energy = batch.total_energy()
+    size = batch.size
+
+    min_distance = np.full((size, len(tracked)), np.inf)
+    max_distance = np.zeros((size, len(tracked)))
+    escaped_at = [{} for _ in range(size)]
+    # Members still running, finished ones keep their state from when they stopped
+    running = np.ones(size, dtype=bool)
+    final_energy = np.zeros(size)
+    final_steps = np.zeros(size, dtype=np.int64)
+
+    escape_distance = options['escape_distance_au'] * settings.AU
+    sun_mu = settings.G * batch.masses[:, sun.index]
+    total_steps = int(round(options['years'] * YEAR / settings.TIMESTEP))
+
+    while( batch.steps < total_steps and running.any() ):
+
+        batch.step(min(options['sample_steps'], total_steps - batch.steps))
+
+        offset = batch.positions[:, tracked_index] - batch.positions[:, sun.index, None]
+        distance = np.hypot(offset[..., 0], offset[..., 1])
+        np.minimum(min_distance, distance, out=min_distance, where=running[:, None])
+        np.maximum(max_distance, distance, out=max_distance, where=running[:, None])
+
+        # Escaped when far away and moving faster than the sun's escape velocity
+        relative_velocity = batch.velocities[:, tracked_index] - batch.velocities[:, sun.index, None]
+        specific_energy = 0.5 * np.einsum('bij,bij->bi', relative_velocity, relative_velocity) - sun_mu[:, None] / distance
+        escaping = (distance > escape_distance) & (specific_energy > 0) & running[:, None]
+        for b, i in zip(*np.nonzero(escaping)):
+            escaped_at[b].setdefault(tags[b][i], batch.time / YEAR)
+
+        if( options['stop_on_escape'] ):
+            stopped = running & np.array([bool(escaped) for escaped in escaped_at])
+            if( stopped.any() ):
+                final_energy[stopped] = batch.total_energy()[stopped]
+                final_steps[stopped] = batch.steps
+                running &= ~stopped
+
+    final_energy[running] = batch.total_energy()[running]
+    final_steps[running] = batch.steps
+    wall_time = (time.perf_counter() - start) / size
+
+    summaries = []
+    for b, member in enumerate(members):
+        summaries.append({
+            'id': member['id'],
+            'member': member,
+            'bound': not escaped_at[b],
+            'escape_time_years': min(escaped_at[b].values()) if escaped_at[b] else None,
+            'escaped': escaped_at[b],
+            'min_distance_au': dict(zip(tags[b], (min_distance[b] / settings.AU).tolist())),
+            'max_distance_au': dict(zip(tags[b], (max_distance[b] / settings.AU).tolist())),
+            'energy_drift': float(abs(final_energy[b] / initial_energy[b] - 1)) if initial_energy[b] else 0.0,
+            'years': int(final_steps[b]) * settings.TIMESTEP / YEAR,
+            'steps': int(final_steps[b]),
+            'wall_time': wall_time,
+        })
+    return summaries
+
+
+def make_batches(members, batch_size):
+
+    # Split members into batches of at most batch_size members sharing a batch_key
+    groups = {}
+    for member in members:
+        groups.setdefault(batch_key(member), []).append(member)
+    batches = []
+    for group in groups.values():
+        for i in range(0, len(group), batch_size):
+            batches.append(group[i:i + batch_size])
+    return batches
+
+
+def load_results(path):
+
+    # Summaries already written to a results file, keyed by member id
+    results = {}
+    if( path and os.path.exists(path) ):
+        with open(path) as results_file:
+            for line in results_file:
+                line = line.strip()
+                if( not line ):
+                    continue
+                try:
+                    summary = json.loads(line)
+                except json.JSONDecodeError:
+                    # Last line of an interrupted sweep may be cut short
+                    continue
+                results[summary['id']] = summary
+    return results
+
+
+def run_ensemble(members, processes=None, chunksize=1, results_path=None, cancel=None, batch_size=1):
+
+    """
+    Run ensemble members across a pool of worker processes
+
+    members: list of member dicts ( see run_member and make_grid )
+    processes: number of worker processes, all cores by default
+    chunksize: batches handed to a worker at a time, raise it for many short members
+    results_path: JSON lines file every summary is appended to as it arrives,
+                  members already in the file are skipped so an interrupted
+                  sweep resumes where it stopped
+    cancel: optional threading.Event, the pool is terminated within CANCEL_POLL
+            seconds of it being set, even while members are running
+    batch_size: members with the same settings and number of planets are run
+                together in one BatchSimulation of up to this many members, which
+                amortizes the per member overhead for small systems
+
+    Yields one summary per member as members finish, in completion order
+    """
+
+    done = load_results(results_path)
+    pending = [member for member in members if member['id'] not in done]
+    if( not pending ):
+        return
+
+    results_file = open(results_path, 'a') if results_path else None
+    pool = multiprocessing.Pool(processes)
+    try:
+        batches = pool.imap_unordered(run_batch, make_batches(pending, batch_size), chunksize)
+        while( cancel is None or not cancel.is_set() ):
+            # Wait in short slices so a cancel is seen while long members are still running
+            try:
+                summaries = batches.next(CANCEL_POLL if cancel is not None else None)
+            except multiprocessing.TimeoutError:
+                continue
+            except StopIteration:
+                break
+            for summary in summaries:
+                if( results_file ):
+                    results_file.write(json.dumps(summary) + "\n")
+                yield summary
+            if( results_file ):
+                results_file.flush()
+    finally:
+        # Stops workers still running when cancelled, interrupted or finished early
+        pool.terminate()
+        pool.join()
+        if( results_file ):
+            results_file.close()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Sweep the orbit of an extra planet across many headless simulations")
+    parser.add_argument("--semi-major-axis", type=float, default=1.0, help="semi-major axis of the planet in AU")
+    parser.add_argument("--eccentricity", type=float, nargs="+", default=[0.0])
+    parser.add_argument("--mass", type=float, nargs="+", default=[5.9742e24])
+    parser.add_argument("--start-angle", type=float, nargs="+", default=[0.0])
+    parser.add_argument("--years", type=float, default=MEMBER_DEFAULTS['years'])
+    parser.add_argument("--timestep", type=float, default=MEMBER_DEFAULTS['timestep_days'], help="timestep in days")
+    parser.add_argument("--no-presets", action="store_true", help="do not spawn the planets of our solar system")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--chunksize", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=1, help="members run together in one vectorized simulation")
+    parser.add_argument("--out", default="ensemble.jsonl", help="results file, an existing file is resumed")
+    args = parser.parse_args()
+
+    members = make_grid(
+        {'name': "Test", 'semi_major_axis_au': args.semi_major_axis, 'eccentricity': 0.0, 'mass': 5.9742e24, 'radius': 10},
+        eccentricity=args.eccentricity,
+        mass=args.mass,
+        start_angle_deg=args.start_angle,
+    )
+    for member in members:
+        member.update(years=args.years, timestep_days=args.timestep, include_presets=not args.no_presets)
+
+    start = time.perf_counter()
+    for summary in run_ensemble(members, args.processes, args.chunksize, args.out, batch_size=args.batch_size):
+        state = "bound" if summary['bound'] else f"escaped after {summary['escape_time_years']:.1f} years"
+        print(f"{summary['id']}: {state}, energy drift {summary['energy_drift']:.2e}")
+    print(f"finished in {time.perf_counter() - start:.1f} s, results in {args.out}")
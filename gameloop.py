@@ -0,0 +1,240 @@
+import time
+from collections import deque
+
+
+class FrameScheduler:
+
+    """
+    Fixed timestep accumulator that decouples physics from the render frame rate
+
+    Every rendered frame the wall time since the previous frame is converted into
+    simulated time ( settings.DAYS_PER_SECOND ) and added to an accumulator. As many
+    whole physics steps of settings.TIMESTEP as the accumulator holds are then run in
+    one batch. The batch is limited by settings.MAX_STEPS_PER_FRAME and by the share
+    of the frame reserved for physics ( settings.PHYSICS_BUDGET ). If the physics
+    falls behind, at most settings.MAX_CATCHUP seconds of wall time are kept to catch
+    up on, so a slow frame never snowballs into slower and slower frames.
+
+    Setting settings.STEPS_PER_FRAME to a positive number runs exactly that many
+    steps every frame instead.
+    """
+
+    def __init__(self, settings, clock=time.perf_counter) -> None:
+        self.settings = settings
+        self.clock = clock
+        # Simulated seconds owed to the physics
+        self.accumulator = 0.0
+        self._last_frame = None
+        # Wall seconds per physics step, smoothed over recent frames
+        self.step_cost = None
+        # Physics steps and wall seconds of the last frame
+        self.steps = 0
+        self.physics_time = 0.0
+        # Measured rates, smoothed over recent frames
+        self.steps_per_second = 0.0
+        self.frames_per_second = 0.0
+
+    @property
+    def frame_interval(self):
+        # Seconds between rendered frames
+        return 1.0 / max(1, self.settings.FPS)
+
+    def steps_due(self, elapsed):
+
+        # Physics steps owed after elapsed wall seconds
+        if( self.settings.STEPS_PER_FRAME > 0 ):
+            return self.settings.STEPS_PER_FRAME
+
+        rate = self.settings.DAYS_PER_SECOND * 3600 * 24
+        self.accumulator += min(elapsed, self.settings.MAX_CATCHUP) * rate
+        # Never owe more than MAX_CATCHUP seconds worth of steps
+        self.accumulator = min(self.accumulator, self.settings.MAX_CATCHUP * rate + self.settings.TIMESTEP)
+        return int(self.accumulator // self.settings.TIMESTEP)
+
+    def run_frame(self, step, paused=False):
+
+        """
+        Run the physics for one rendered frame
+
+        step: function taking a number of steps to run
+        paused: nothing is stepped or owed while paused
+
+        Returns the number of steps run
+        """
+
+        now = self.clock()
+        elapsed = 0.0 if self._last_frame is None else now - self._last_frame
+        self._last_frame = now
+        if( elapsed > 0 ):
+            self.frames_per_second = 0.9 * self.frames_per_second + 0.1 / elapsed
+
+        self.steps = 0
+        self.physics_time = 0.0
+
+        if( paused ):
+            self.accumulator = 0.0
+            return 0
+
+        steps = min(self.steps_due(elapsed), self.settings.MAX_STEPS_PER_FRAME)
+
+        # Only run as many steps as fit in the physics share of the frame
+        if( self.step_cost ):
+            budget = self.frame_interval * self.settings.PHYSICS_BUDGET
+            steps = min(steps, max(1, int(budget / self.step_cost)))
+
+        if( steps <= 0 ):
+            return 0
+
+        start = self.clock()
+        step(steps)
+        self.physics_time = self.clock() - start
+
+        cost = self.physics_time / steps
+        self.step_cost = cost if self.step_cost is None else 0.8 * self.step_cost + 0.2 * cost
+        if( self.settings.STEPS_PER_FRAME <= 0 ):
+            self.accumulator = max(0.0, self.accumulator - steps * self.settings.TIMESTEP)
+        if( elapsed > 0 ):
+            self.steps_per_second = 0.9 * self.steps_per_second + 0.1 * steps / elapsed
+
+        self.steps = steps
+        return steps
+
+    def next_delay(self):
+
+        # Milliseconds to wait before the next frame, so frames are not drawn faster than FPS
+        spent = self.clock() - self._last_frame if self._last_frame is not None else 0.0
+        return max(1, int(round((self.frame_interval - spent) * 1000)))
+
+
+# Rendering quality levels, best first, each one gives up a little more than the one before:
+# ( share of MAX_TRAIL_POINTS drawn per trail, smoothed trails, frames between trail redraws,
+#   seconds between refreshes of the planet info panel )
+QUALITY_LEVELS = (
+    (1.0, True, 1, 0.0),
+    (0.5, True, 1, 0.0),
+    (0.25, True, 1, 0.0),
+    (0.25, False, 1, 0.0),
+    (0.25, False, 2, 0.0),
+    (0.25, False, 4, 0.0),
+    (0.25, False, 4, 0.25),
+)
+
+
+def describe_quality(level):
+
+    # Words for what a quality level draws, one entry per column of QUALITY_LEVELS
+    share, smooth, trail_frames, info_interval = QUALITY_LEVELS[level]
+    return (
+        f"{share:.0%} trail points",
+        "smoothed trails" if smooth else "unsmoothed trails",
+        "trails every frame" if trail_frames == 1 else f"trails every {trail_frames} frames",
+        "info panel every frame" if not info_interval else f"info panel every {info_interval * 1000:.0f} ms",
+    )
+
+
+class AdaptiveQuality:
+
+    """
+    Lowers rendering quality while rendering takes longer than its share of the frame
+
+    Rendering has no fixed cost: with many planets and long trails a frame can
+    take far longer than the frame interval. After every frame the time spent
+    outside physics is smoothed and compared with the render budget, the share
+    of the frame time ( settings.FRAME_TARGET_MS, or one frame interval of
+    settings.FPS if that is 0 ) that settings.PHYSICS_BUDGET leaves. Physics
+    fills its own share whatever the quality, so only rendering is judged.
+    Above the budget for `patience` frames in a row the next level of
+    QUALITY_LEVELS is taken: fewer trail points, no spline smoothing, trails
+    redrawn only every few frames and finally a rate limited planet info
+    panel. Below `headroom` times the budget for `recovery` frames the
+    previous level is taken again.
+    The wait before raising is longer, so quality does not flip back and forth.
+
+    Every change is kept in `changes` with its reason, and passed to on_change.
+    """
+
+    def __init__(self, settings, patience=10, recovery=120, headroom=0.6, clock=time.perf_counter, on_change=None) -> None:
+        self.settings = settings
+        self.patience = patience
+        self.recovery = recovery
+        self.headroom = headroom
+        self.clock = clock
+        self.on_change = on_change
+        # Index into QUALITY_LEVELS, 0 is full quality
+        self.level = 0
+        # Render time in milliseconds, frame time less physics, smoothed over recent frames
+        self.frame_ms = None
+        # Frames in a row over the budget and with headroom
+        self._over = 0
+        self._under = 0
+        # ( time, old level, new level, reason ) of the most recent changes
+        self.changes = deque(maxlen=100)
+        self.frames = 0
+        self._last_info = None
+
+    @property
+    def target_ms(self):
+
+        # Milliseconds rendering may take per frame, at least a tenth of the frame when physics may fill all of it
+        frame = self.settings.FRAME_TARGET_MS
+        if( frame <= 0 ):
+            frame = 1000.0 / max(1, self.settings.FPS)
+        return frame * max(0.1, 1.0 - self.settings.PHYSICS_BUDGET)
+
+    @property
+    def reason(self):
+        # Why the current level was taken, None at the start
+        return self.changes[-1][3] if self.changes else None
+
+    def trail_points(self, max_points):
+        # Points per trail to draw at this level
+        return max(2, int(max_points * QUALITY_LEVELS[self.level][0]))
+
+    @property
+    def smooth(self):
+        return QUALITY_LEVELS[self.level][1]
+
+    def trails_due(self):
+        # Whether trails are redrawn this frame
+        return self.frames % QUALITY_LEVELS[self.level][2] == 0
+
+    def info_due(self):
+
+        # Whether the info panel is refreshed now, at most every info interval of the level
+        interval = QUALITY_LEVELS[self.level][3]
+        now = self.clock()
+        if( interval and self._last_info is not None and now - self._last_info < interval ):
+            return False
+        self._last_info = now
+        return True
+
+    def end_frame(self, frame_ms):
+
+        # Account for a finished frame that spent frame_ms milliseconds rendering, returns the level for the next frame
+        self.frames += 1
+        self.frame_ms = frame_ms if self.frame_ms is None else 0.8 * self.frame_ms + 0.2 * frame_ms
+        if( not self.settings.ADAPTIVE_QUALITY ):
+            if( self.level ):
+                self.set_level(0, "adaptive quality switched off")
+            return self.level
+
+        target = self.target_ms
+        self._over = self._over + 1 if self.frame_ms > target else 0
+        self._under = self._under + 1 if self.frame_ms < self.headroom * target else 0
+
+        if( self._over >= self.patience and self.level < len(QUALITY_LEVELS) - 1 ):
+            self.set_level(self.level + 1, f"{self.frame_ms:.1f} ms renders over the {target:.1f} ms render budget")
+        elif( self._under >= self.recovery and self.level > 0 ):
+            self.set_level(self.level - 1, f"{self.frame_ms:.1f} ms renders well under the {target:.1f} ms render budget")
+        return self.level
+
+    def set_level(self, level, why):
+
+        # Switch to level, the reason names what changed and why
+        old, self.level = self.level, level
+        self._over = self._under = 0
+        changed = [new for before, new in zip(describe_quality(old), describe_quality(level)) if before != new]
+        reason = f"{why}: {', '.join(changed)}"
+        self.changes.append((self.clock(), old, level, reason))
+        if( self.on_change ):
+            self.on_change(old, level, reason)
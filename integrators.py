@@ -0,0 +1,242 @@
+import numpy as np
+from gravity import accelerations_and_jerks
+
+
+# Yoshida 4th order coefficients
+# Three leapfrog steps of w1*dt, w0*dt, w1*dt cancel the 3rd order error
+_CBRT2 = 2 ** (1 / 3)
+_W1 = 1 / (2 - _CBRT2)
+_W0 = -_CBRT2 / (2 - _CBRT2)
+YOSHIDA_DRIFT = (_W1 / 2, (_W0 + _W1) / 2, (_W0 + _W1) / 2, _W1 / 2)
+YOSHIDA_KICK = (_W1, _W0, _W1)
+
+
+class Integrator:
+
+    """
+    Base class for integrators
+
+    An integrator advances the positions and velocities arrays of every body in
+    place by one timestep. All bodies are advanced from the same snapshot of
+    positions, so the result does not depend on the order of the bodies.
+
+    acceleration: function of ( positions, masses ) returning an ( N, 2 ) array
+    """
+
+    # Name used by SimulationSettings.integrator
+    name = None
+    # Order of accuracy
+    order = 1
+
+    def __init__(self, acceleration) -> None:
+        self.acceleration = acceleration
+        self._cached_positions = None
+        self._cached_acceleration = None
+
+    def reset(self):
+        self._cached_positions = None
+        self._cached_acceleration = None
+
+    def current_acceleration(self, positions, masses):
+
+        # Acceleration at the current positions, reused from the end of the previous step
+        # as long as nothing has moved or added bodies since
+        if( self._cached_positions is not None
+                and self._cached_positions.shape == positions.shape
+                and np.array_equal(self._cached_positions, positions) ):
+            return self._cached_acceleration
+        return self.evaluate(positions, masses)
+
+    def evaluate(self, positions, masses):
+
+        # Evaluate and remember the acceleration at positions
+        acceleration = self.acceleration(positions, masses)
+        self._cached_positions = positions.copy()
+        self._cached_acceleration = acceleration
+        return acceleration
+
+    def step(self, positions, velocities, masses, dt):
+        raise NotImplementedError
+
+
+class SymplecticEuler(Integrator):
+
+    # Kick then drift, 1st order
+
+    name = "euler"
+    order = 1
+
+    def step(self, positions, velocities, masses, dt):
+
+        # a = dv/dt
+        # dv = a*dt
+        velocities += self.current_acceleration(positions, masses) * dt
+        # Increment position based on velocity and time
+        positions += velocities * dt
+
+
+class Leapfrog(Integrator):
+
+    # Kick-drift-kick leapfrog, 2nd order, one force evaluation per step
+
+    name = "leapfrog"
+    order = 2
+
+    def step(self, positions, velocities, masses, dt):
+
+        # Half kick with the acceleration at the start of the step
+        velocities += self.current_acceleration(positions, masses) * (dt / 2)
+        # Full drift
+        positions += velocities * dt
+        # Half kick with the acceleration at the end of the step
+        velocities += self.evaluate(positions, masses) * (dt / 2)
+
+
+class VelocityVerlet(Integrator):
+
+    # Velocity Verlet, 2nd order, one force evaluation per step
+
+    name = "verlet"
+    order = 2
+
+    def step(self, positions, velocities, masses, dt):
+
+        acceleration = self.current_acceleration(positions, masses)
+
+        # x(t+dt) = x + v*dt + a*dt^2/2
+        positions += velocities * dt + acceleration * (dt * dt / 2)
+
+        # v(t+dt) = v + ( a(t) + a(t+dt) ) * dt/2
+        new_acceleration = self.evaluate(positions, masses)
+        velocities += (acceleration + new_acceleration) * (dt / 2)
+
+
+class Yoshida4(Integrator):
+
+    # Yoshida 4th order, three force evaluations per step
+
+    name = "yoshida4"
+    order = 4
+
+    def step(self, positions, velocities, masses, dt):
+
+        for drift, kick in zip(YOSHIDA_DRIFT, YOSHIDA_KICK):
+            positions += velocities * (drift * dt)
+            velocities += self.evaluate(positions, masses) * (kick * dt)
+        positions += velocities * (YOSHIDA_DRIFT[-1] * dt)
+
+
+class BlockTimestep(Integrator):
+
+    """
+    Kick-drift-kick leapfrog with individual, power of two block timesteps
+
+    The global timestep dt is the largest step any body takes. Every body gets its
+    own step dt / 2^level, picked from its acceleration and jerk:
+
+        dt_i = eta * |a| / |da/dt|
+
+    so bodies on close encounters sub-step while distant ones take the full step.
+    Positions of all bodies drift together to the next time a body's step ends,
+    only the bodies whose step ends are kicked, and only their forces are evaluated.
+    A body may only move to a larger step when the current time lines up with it,
+    which keeps every step on the block hierarchy. All bodies are synchronized at
+    the end of each global step.
+
+    Forces are always exact direct sums, the gravity solver setting is not used.
+    """
+
+    name = "block"
+    order = 2
+
+    def __init__(self, acceleration, settings=None) -> None:
+        super().__init__(acceleration)
+        self.settings = settings
+        # Block level of every body after the last step, 0 = full timestep
+        self.levels = np.zeros(0, dtype=np.int64)
+        # Force evaluations of single bodies during the last step
+        self.evaluations = 0
+
+    @property
+    def eta(self):
+        return getattr(self.settings, 'block_eta', 0.05)
+
+    @property
+    def max_level(self):
+        return getattr(self.settings, 'max_block_level', 12)
+
+    def pick_levels(self, acceleration, jerk, dt):
+
+        # Smallest level whose step is below eta * |a| / |j|
+        a = np.hypot(acceleration[:, 0], acceleration[:, 1])
+        j = np.hypot(jerk[:, 0], jerk[:, 1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            desired = self.eta * a / j
+            levels = np.ceil(np.log2(dt / desired))
+        levels = np.nan_to_num(levels, nan=self.max_level, posinf=self.max_level, neginf=0)
+        return np.clip(levels, 0, self.max_level).astype(np.int64)
+
+    def step(self, positions, velocities, masses, dt):
+
+        G = self.settings.G
+        max_level = self.max_level
+        # Time inside this step is counted in integer ticks of dt / 2^max_level
+        ticks = 1 << max_level
+        tick = dt / ticks
+
+        acceleration, jerk = accelerations_and_jerks(positions, velocities, masses, G)
+        levels = self.pick_levels(acceleration, jerk, dt)
+        self.evaluations = len(masses)
+
+        # Opening half kick of every body
+        step_ticks = ticks >> levels
+        velocities += acceleration * (step_ticks * tick / 2)[:, None]
+        end = step_ticks.copy()
+        now = 0
+
+        while( now < ticks ):
+
+            # Drift everything to the next time a step ends
+            following = int(end.min())
+            positions += velocities * ((following - now) * tick)
+            now = following
+
+            active = np.flatnonzero(end == now)
+            new_acceleration, new_jerk = accelerations_and_jerks(positions, velocities, masses, G, active)
+            self.evaluations += len(active)
+            acceleration[active] = new_acceleration
+
+            # Closing half kick of the finished steps
+            velocities[active] += new_acceleration * (step_ticks[active] * tick / 2)[:, None]
+
+            if( now == ticks ):
+                break
+
+            # Next level, larger steps only where the current time lines up with them
+            aligned = (now & -now).bit_length() - 1
+            new_levels = np.maximum(self.pick_levels(new_acceleration, new_jerk, dt), max_level - aligned)
+            levels[active] = new_levels
+            step_ticks[active] = ticks >> new_levels
+
+            # Opening half kick of the next steps
+            velocities[active] += new_acceleration * (step_ticks[active] * tick / 2)[:, None]
+            end[active] = now + step_ticks[active]
+
+        self.levels = levels
+        self._cached_positions = positions.copy()
+        self._cached_acceleration = acceleration
+
+
+# Integrators selectable through SimulationSettings.integrator
+INTEGRATORS = {
+    integrator.name: integrator
+    for integrator in (SymplecticEuler, Leapfrog, VelocityVerlet, Yoshida4, BlockTimestep)
+}
+
+
+def make_integrator(name, acceleration, settings=None):
+    if( name not in INTEGRATORS ):
+        raise ValueError(f"Unknown integrator '{name}', expected one of {tuple(INTEGRATORS)}")
+    if( name == BlockTimestep.name ):
+        return BlockTimestep(acceleration, settings)
+    return INTEGRATORS[name](acceleration)
@@ -0,0 +1,262 @@
+import math
+import numpy as np
+
+
+def solve_kepler(mean_anomaly, eccentricity, tolerance=1e-14, max_iterations=50):
+
+    """
+    Eccentric anomaly E of Kepler's equation M = E - e sin E, for arrays of M and e
+
+    Newton iterations run on every element at once until the largest correction
+    is below tolerance. Starting from E = pi for very eccentric orbits keeps
+    Newton from overshooting near perihelion.
+    """
+
+    M = np.remainder(mean_anomaly, 2 * math.pi)
+    e = np.broadcast_to(eccentricity, M.shape)
+    E = np.where(e < 0.8, M + e * np.sin(M), math.pi)
+
+    for _ in range(max_iterations):
+        correction = (E - e * np.sin(E) - M) / (1 - e * np.cos(E))
+        E = E - correction
+        if( not correction.size or np.max(np.abs(correction)) < tolerance ):
+            break
+    return E
+
+
+def state_to_elements(positions, velocities, mu):
+
+    """
+    Orbital elements of bodies relative to a central body
+
+    positions, velocities: ( N, 2 ) arrays relative to the central body
+    mu: G times the mass of the central body plus the body itself, scalar or ( N, )
+
+    Returns a dict of ( N, ) arrays: semi_major_axis, eccentricity,
+    periapsis ( argument of periapsis in radians ), mean_anomaly, mean_motion and
+    direction ( +1 counterclockwise, -1 clockwise ). Unbound bodies get a
+    negative semi_major_axis and an eccentricity of at least 1.
+    """
+
+    x, y = positions[:, 0], positions[:, 1]
+    vx, vy = velocities[:, 0], velocities[:, 1]
+    r = np.hypot(x, y)
+    v2 = vx * vx + vy * vy
+    h = x * vy - y * vx
+
+    # Eccentricity vector, points at periapsis
+    rv = x * vx + y * vy
+    ex = ((v2 - mu / r) * x - rv * vx) / mu
+    ey = ((v2 - mu / r) * y - rv * vy) / mu
+    e = np.hypot(ex, ey)
+
+    energy = 0.5 * v2 - mu / r
+    with np.errstate(divide='ignore'):
+        a = -mu / (2 * energy)
+    periapsis = np.arctan2(ey, ex)
+    direction = np.where(h < 0, -1.0, 1.0)
+
+    # True anomaly measured in the direction of motion
+    true_anomaly = direction * (np.arctan2(y, x) - periapsis)
+    bound = e < 1
+    ec = np.where(bound, e, 0.0)
+    E = 2 * np.arctan2(np.sqrt(1 - ec) * np.sin(true_anomaly / 2), np.sqrt(1 + ec) * np.cos(true_anomaly / 2))
+    mean_anomaly = np.where(bound, E - ec * np.sin(E), np.nan)
+    with np.errstate(invalid='ignore'):
+        mean_motion = np.where(bound, np.sqrt(mu / np.abs(a) ** 3), np.nan)
+
+    return {
+        'semi_major_axis': a,
+        'eccentricity': e,
+        'periapsis': periapsis,
+        'mean_anomaly': mean_anomaly,
+        'mean_motion': mean_motion,
+        'direction': direction,
+    }
+
+
+def elements_to_state(elements, mean_anomaly, mu):
+
+    # Positions and velocities relative to the central body at the given mean anomalies ( bound orbits only )
+    a = elements['semi_major_axis']
+    e = elements['eccentricity']
+    direction = elements['direction']
+
+    E = solve_kepler(mean_anomaly, e)
+    cos_E, sin_E = np.cos(E), np.sin(E)
+    b = a * np.sqrt(1 - e * e)
+
+    # In the perifocal frame, x towards periapsis, y along the direction of motion
+    px = a * (cos_E - e)
+    py = b * sin_E
+    r = a * (1 - e * cos_E)
+    speed_factor = np.sqrt(mu * a) / r
+    pvx = -speed_factor * sin_E
+    pvy = speed_factor * np.sqrt(1 - e * e) * cos_E
+
+    # Mirror clockwise orbits, then rotate onto the argument of periapsis
+    py = py * direction
+    pvy = pvy * direction
+    cos_w, sin_w = np.cos(elements['periapsis']), np.sin(elements['periapsis'])
+    positions = np.stack((px * cos_w - py * sin_w, px * sin_w + py * cos_w), axis=1)
+    velocities = np.stack((pvx * cos_w - pvy * sin_w, pvx * sin_w + pvy * cos_w), axis=1)
+    return positions, velocities
+
+
+def propagate(positions, velocities, mu, dt):
+
+    """
+    Two-body positions and velocities dt seconds later, relative to the central body
+
+    Costs the same for any dt, one Kepler equation solve per body.
+    Every body has to be on a bound orbit.
+    """
+
+    elements = state_to_elements(positions, velocities, mu)
+    if( np.any(elements['eccentricity'] >= 1) ):
+        raise ValueError("Kepler propagation needs bound orbits")
+    return elements_to_state(elements, elements['mean_anomaly'] + elements['mean_motion'] * dt, mu)
+
+
+def central_body(simulation):
+    # Index of the body every orbit is measured around, the last sun
+    suns = np.flatnonzero(simulation.store.sun)
+    if( not len(suns) ):
+        raise ValueError("Kepler propagation needs a sun")
+    return int(suns[-1])
+
+
+def perturbation(simulation):
+
+    """
+    How far from a two-body orbit around the sun every body is
+
+    Ratio of the acceleration from everything except the sun to the acceleration
+    from the sun. 0 for the sun itself and inf for unbound bodies, which can
+    not be propagated analytically.
+    """
+
+    store = simulation.store
+    sun = central_body(simulation)
+    G = simulation.settings.G
+
+    total = simulation.accelerations(store.position, store.mass)
+    offset = store.position[sun] - store.position
+    distance = np.hypot(offset[:, 0], offset[:, 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        from_sun = G * store.mass[sun] * offset / distance[:, None] ** 3
+        ratio = np.hypot(*(total - from_sun).T) / np.hypot(*from_sun.T)
+
+        mu = G * (store.mass[sun] + store.mass)
+        relative_velocity = store.velocity - store.velocity[sun]
+        energy = 0.5 * np.einsum('ij,ij->i', relative_velocity, relative_velocity) - mu / distance
+    ratio[energy >= 0] = np.inf
+    ratio[sun] = 0.0
+    return ratio
+
+
+def kepler_jump(simulation, dt):
+
+    """
+    Move every body along its two-body orbit, in Jacobi coordinates
+
+    Bodies are taken outwards from the sun by distance. Each one orbits the
+    barycenter of the sun and the bodies inside it, with that barycenter's
+    mass, so the sun's pull on its reflex motion is accounted for. The
+    barycenter of everything moves on in a straight line, which keeps total
+    momentum and the barycenter of the massive bodies as they were.
+    """
+
+    store = simulation.store
+    sun = central_body(simulation)
+    sun_position = store.position[sun].copy()
+    sun_velocity = store.velocity[sun].copy()
+
+    # The sun first, then the other bodies from the inside out
+    offset = store.position - sun_position
+    distance = np.einsum('ij,ij->i', offset, offset)
+    distance[sun] = -1.0
+    order = np.argsort(distance, kind='stable')
+    mass = store.mass[order]
+    position = store.position[order]
+    velocity = store.velocity[order]
+
+    # Mass and barycenter of each body together with every body inside it
+    interior_mass = np.cumsum(mass)
+    interior_position = np.cumsum(mass[:, None] * position, axis=0) / interior_mass[:, None]
+    interior_velocity = np.cumsum(mass[:, None] * velocity, axis=0) / interior_mass[:, None]
+    barycenter = interior_position[-1] + interior_velocity[-1] * dt
+    barycenter_velocity = interior_velocity[-1]
+
+    mu = simulation.settings.G * interior_mass[1:]
+    positions, velocities = propagate(position[1:] - interior_position[:-1], velocity[1:] - interior_velocity[:-1], mu, dt)
+
+    # Each body moves the barycenter inside it by its share of the mass, the sun is where they all add up to the barycenter
+    weight = (mass[1:] / interior_mass[1:])[:, None]
+    shift = np.vstack(([0.0, 0.0], np.cumsum(weight * positions, axis=0)))
+    shift_velocity = np.vstack(([0.0, 0.0], np.cumsum(weight * velocities, axis=0)))
+    interior_position = barycenter - shift[-1] + shift
+    interior_velocity = barycenter_velocity - shift_velocity[-1] + shift_velocity
+
+    position[0] = interior_position[0]
+    velocity[0] = interior_velocity[0]
+    position[1:] = positions + interior_position[:-1]
+    velocity[1:] = velocities + interior_velocity[:-1]
+    store.position[order] = position
+    store.velocity[order] = velocity
+    new_sun_position = store.position[sun]
+    new_sun_velocity = store.velocity[sun]
+
+    # Test particles follow their own two-body orbits, unbound ones fly straight on
+    particles = simulation.particles
+    if( len(particles) ):
+        mu = simulation.settings.G * store.mass[sun]
+        relative_position = particles.position - sun_position
+        relative_velocity = particles.velocity - sun_velocity
+        bound = 0.5 * np.einsum('ij,ij->i', relative_velocity, relative_velocity) < mu / np.hypot(*relative_position.T)
+        positions, velocities = propagate(relative_position[bound], relative_velocity[bound], mu, dt)
+        particles.position[bound] = positions + new_sun_position
+        particles.velocity[bound] = velocities + new_sun_velocity
+        particles.position[~bound] += particles.velocity[~bound] * dt
+    simulation.time += dt
+    simulation.update_distance_to_sun()
+
+
+def time_warp(simulation, t, threshold=None, segment=None):
+
+    """
+    Jump the simulation to simulated time t without stepping through it
+
+    Time is covered in segments. At the start of each segment the perturbation
+    of every massive body is measured: if all of them are below threshold the segment is
+    crossed in one Kepler jump per body, otherwise the N-body integrator steps
+    through it. Perturbations are only checked at segment boundaries, so
+    encounters shorter than a segment can be missed, shorten the segment for
+    chaotic systems. Test particles do not decide anything, they are moved
+    along their own two-body orbits in jumped segments.
+
+    threshold: largest perturbation ( see perturbation ) still propagated
+               analytically, settings.KEPLER_THRESHOLD by default
+    segment: seconds between perturbation checks, settings.WARP_SEGMENT by default
+
+    Returns a dict with the simulated seconds jumped analytically and the
+    number of N-body steps taken
+    """
+
+    settings = simulation.settings
+    threshold = settings.KEPLER_THRESHOLD if threshold is None else threshold
+    segment = settings.WARP_SEGMENT if segment is None else segment
+
+    jumped = 0.0
+    steps = simulation.steps
+    while( simulation.time < t - 1e-9 * settings.TIMESTEP ):
+        span = min(segment, t - simulation.time)
+        if( np.any(simulation.store.sun) and np.max(perturbation(simulation)) <= threshold ):
+            kepler_jump(simulation, span)
+            jumped += span
+        else:
+            simulation.run_until(simulation.time + span)
+
+    # Accelerations cached by the integrator are stale after a jump
+    simulation.integrator.reset()
+    return {'kepler_time': jumped, 'nbody_steps': simulation.steps - steps}
@@ -1,30 +1,16 @@
 import math
 import tkinter as tk
-from tkinter import Canvas, Tk, ttk, IntVar
-from celestialobject import ObjectManager, Vector2
+from tkinter import Canvas, Tk, ttk, IntVar, filedialog, messagebox
+from celestialobject import ObjectManager, expression_convert
+from diagnostics import Diagnostics
+from recording import Replay, TrajectoryReader, TrajectoryRecorder
+from simulation import PLANET_PRESETS, Simulation, SimulationSettings, orbital_state
 
 
 WIDTH, HEIGHT = 1200, 675
 
-# Object for Simulation Settings and Constants
-class SimulationSettings():
-    def __init__(self):
-        # Astronomical Units ( converted to meters )
-        self.AU = 149.6e6 * 1000
-        # Gravitational Constant
-        self.G = 6.67428e-11
-        # Zoom Factor
-        self.zoom = 1.0
-        # pixels per AU
-        self.base_pixels_per_au = 200
-        # 1 day time step
-        self.TIMESTEP = 3600*24
-        # simulation speed in ms
-        self.SPEED = 50
-
-    @property
-    def SCALE(self):
-        return (self.base_pixels_per_au * self.zoom / self.AU) 
+# Top of the speed slider in simulated days per second, it is logarithmic from 1 day/s up
+MAX_DAYS_PER_SECOND = 10000
 
 # Main Orbit Simulation Object
 class OrbitSimulation:
@@ -43,6 +29,10 @@ class OrbitSimulation:
             'pause' : 0
         }
         self.simulation_settings = SimulationSettings()
+        # Bodies that touch merge instead of passing through each other
+        self.simulation_settings.collisions = True
+        # Headless simulation core, this class and ObjectManager only display it
+        self.simulation = Simulation(self.simulation_settings)
 
         self.build_gui()
 
@@ -150,20 +140,23 @@ class OrbitSimulation:
             command=self.update_zoom
         )
         zoom_scale.set(1.0) # default zoom
+        self.zoom_scale = zoom_scale
         zoom_scale.grid(row=7, column=0, sticky='w', padx=(5,0), pady=5, columnspan=2)
 
-        # speed slider
+        # speed slider, moves through powers of ten of days/s and names the speed in its label
         speed_scale = tk.Scale(
             form_frame,
-            from_=10,
-            to=100,
-            resolution=10,
+            from_=0,
+            to=math.log10(MAX_DAYS_PER_SECOND),
+            resolution=0.01,
             orient=tk.HORIZONTAL,
-            label="Speed ( ms )",
+            label="Speed ( days/s )",
+            showvalue=0,
             length=200,
             command=self.update_speed
         )
-        speed_scale.set(50) # default speed in ms
+        self.speed_scale = speed_scale
+        self.set_speed(self.simulation_settings.DAYS_PER_SECOND)
         speed_scale.grid(row=8, column=0, sticky='w', padx=(5,0), pady=5, columnspan=2)
 
         # Create a frame specifically for planet info in bottom right
@@ -197,6 +190,12 @@ class OrbitSimulation:
         self.info_labels['radius'] = ttk.Label(info_frame, text="Radius: 0")
         self.info_labels['radius'].pack(anchor=tk.W, pady=(5, 0))
 
+        # Conserved quantities of the whole simulation, red while the energy error is too large
+        self.info_labels['energy'] = ttk.Label(info_frame, text="Energy error: -")
+        self.info_labels['energy'].pack(anchor=tk.W, pady=(10, 0))
+        self.info_labels['momentum'] = ttk.Label(info_frame, text="Momentum: -")
+        self.info_labels['momentum'].pack(anchor=tk.W)
+
         # Clear planets button
         clear_planets = ttk.Button(form_frame, text="Clear Planets", command=self.clear_planets)
         clear_planets.grid(row=9, column=0, sticky='w', padx=(5,0), pady=5)
@@ -205,6 +204,75 @@ class OrbitSimulation:
         spawn_planets = ttk.Button(form_frame, text="Spawn Planets", command=self.spawn_planets)
         spawn_planets.grid(row=9, column=1, sticky='w', padx=(5,0), pady=5)
 
+        # Record trajectory button
+        record_button = ttk.Button(form_frame, text="Record", command=lambda: self.toggle_recording(record_button))
+        record_button.grid(row=10, column=0, sticky='w', padx=(5,0), pady=5)
+
+        # Replay recorded trajectory button
+        replay_button = ttk.Button(form_frame, text="Replay", command=self.open_replay)
+        replay_button.grid(row=10, column=1, sticky='w', padx=(5,0), pady=5)
+
+        # Save and load checkpoint buttons
+        save_button = ttk.Button(form_frame, text="Save", command=self.save_state)
+        save_button.grid(row=11, column=0, sticky='w', padx=(5,0), pady=5)
+        load_button = ttk.Button(form_frame, text="Load", command=self.load_state)
+        load_button.grid(row=11, column=1, sticky='w', padx=(5,0), pady=5)
+
+        # Autosave checkbox
+        autosave_var = IntVar()
+        autosave_option = ttk.Checkbutton(
+            form_frame,
+            text="Autosave",
+            variable=autosave_var,
+            command=lambda: self.toggle_autosave(autosave_var)
+        )
+        autosave_option.grid(row=12, column=0, sticky='w', padx=(5,0), pady=5)
+
+        # Performance HUD checkbox, F3 toggles it too
+        self.hud_var = IntVar()
+        hud_option = ttk.Checkbutton(
+            form_frame,
+            text="Performance HUD",
+            variable=self.hud_var,
+            command=self.toggle_hud
+        )
+        hud_option.grid(row=12, column=1, sticky='w', padx=(5,0), pady=5)
+        self.root.bind("<F3>", self.toggle_hud_key)
+
+        # Time warp label, entry and button
+        warp_label = ttk.Label(form_frame, text="Warp to (years):", anchor='w', font=('Arial', 12))
+        warp_label.grid(row=13, column=0, sticky='w', padx=(5,0), pady=5)
+        warp_entry = ttk.Entry(form_frame, width=15)
+        warp_entry.grid(row=13, column=1, sticky='w', padx=(5,0), pady=5)
+        warp_button = ttk.Button(form_frame, text="Time Warp", command=lambda: self.time_warp(warp_entry))
+        warp_button.grid(row=14, column=0, sticky='w', padx=(5,0), pady=5)
+
+        # Asteroid belt button
+        asteroid_button = ttk.Button(form_frame, text="Asteroid Belt", command=self.add_asteroid_belt)
+        asteroid_button.grid(row=14, column=1, sticky='w', padx=(5,0), pady=5)
+
+        # Export profiler trace button
+        trace_button = ttk.Button(form_frame, text="Export Trace", command=self.export_trace)
+        trace_button.grid(row=15, column=0, sticky='w', padx=(5,0), pady=5)
+
+        # Load scenario file button
+        scenario_button = ttk.Button(form_frame, text="Load Scenario", command=self.load_scenario)
+        scenario_button.grid(row=15, column=1, sticky='w', padx=(5,0), pady=5)
+
+        # Remove escaped bodies button
+        escaped_button = ttk.Button(form_frame, text="Remove Escaped", command=self.remove_escaped)
+        escaped_button.grid(row=16, column=0, sticky='w', padx=(5,0), pady=5)
+
+        # Physics worker process checkbox
+        worker_var = IntVar()
+        worker_option = ttk.Checkbutton(
+            form_frame,
+            text="Physics Worker",
+            variable=worker_var,
+            command=lambda: self.toggle_worker(worker_var)
+        )
+        worker_option.grid(row=16, column=1, sticky='w', padx=(5,0), pady=5)
+
         # Canvas x,y arrows
         self.canvas.create_line(10, 10, 10, 50, arrow=tk.LAST, width=1, fill="white")
         self.canvas.create_line(10, 10, 50, 10, arrow=tk.LAST, width=1, fill="white")
@@ -242,6 +310,21 @@ class OrbitSimulation:
 
         self.info_labels['radius'].config(text=f"Radius: {planet.base_radius} pixels")
 
+    def update_diagnostics(self, diagnostics):
+
+        # Show the latest energy and momentum sample
+        sample = diagnostics.latest()
+        if( sample is None ):
+            return
+        self.info_labels['energy'].config(
+            text=f"Energy error: {sample['energy_error']:.2e} ( {sample['energy']:.4e} J )",
+            foreground="red" if diagnostics.alerting else ""
+        )
+        momentum = (sample['momentum_x'] ** 2 + sample['momentum_y'] ** 2) ** 0.5
+        self.info_labels['momentum'].config(
+            text=f"Momentum: {momentum:.3e} kg m/s, L error: {sample['angular_momentum_error']:.1e}"
+        )
+
     def clear_planet_info(self):
 
         # clear selected planet of objectManager class
@@ -259,14 +342,8 @@ class OrbitSimulation:
         # update simulation settings zoom value
         self.simulation_settings.zoom = float(value)
 
-        # remove all orbit lines and redraw planets
-        for planet in self.orbit_simulator.celestialObjects:
-            self.canvas.delete(f"{planet.tag}_orbit")
-            planet.orbit_line_id = None
-            planet.orbit = []
-            planet.update_radius()
-            planet.update_screen_position()
-            planet.draw()
+        # planets and orbit trails are kept in meters and are reprojected by the redraw
+        self.orbit_simulator.redraw()
             
     def show_info(self):
         
@@ -336,14 +413,53 @@ better scaling.
 You can click on any planet to view its planet information in the bottom right. You should be
 able to use these values for reference to generate stable orbits for your planet.
 
-You can adjust the speed of the simulation with the speed slider. This controls the delay of 
-the loop that handles all of the movement and physics. 
-It ranges from 10ms ( Very Fast ) to 100ms ( Very Slow )
+You can adjust the speed of the simulation with the speed slider. This sets how many days
+are simulated every second, the screen is still redrawn at a steady frame rate.
+It is logarithmic, from 1 day/s ( Very Slow ) to 10000 days/s ( over 27 years every second )
 
 Select the "Draw Orbits" checkbox to draw orbits for the planets for better visualization.
 
 Must I explain what the Pause/Continue button does? (:
 
+The "Record" button saves the positions and velocities of every planet to a file while the
+simulation runs, click it again to stop. "Replay" opens such a file and plays it back, you can
+drag the frame slider to jump around and set the replay speed ( negative plays it backwards ).
+"Back to Simulation" returns to the live simulation right where you left it.
+
+"Asteroid Belt" scatters 100,000 asteroids between Mars and Jupiter. They are pulled around by
+the sun and planets but are too small to pull on anything themselves. Clearing the planets
+removes them too.
+
+Type a year into "Warp to (years)" and press "Time Warp" to jump the simulation ahead. Planets
+that only feel the sun are moved along their orbits in one go, the simulation only steps
+through the stretches where planets pull noticeably on each other.
+
+"Save" writes the whole simulation, including orbit trails and the selected planet, to a file
+and "Load" continues it later. With "Autosave" checked the simulation is saved every few
+seconds to autosave.orbit, and once more when you close the window.
+
+"Load Scenario" adds every body of a .csv, .json or .npz file to the simulation. Each body has a
+mass and optionally a tag, radius and sun flag, and is placed either by x, y ( meters ) and
+vx, vy ( m/s ) or by its orbit around the sun: semi_major_axis ( AU ), eccentricity, periapsis
+and mean_anomaly ( degrees ). A CSV file names these columns in its first row.
+
+"Remove Escaped" removes every body further than 100 AU from the sun that is moving too fast to
+ever come back.
+
+With "Physics Worker" checked the physics runs in a separate process on another core, so the
+window stays responsive however long a step takes. Planets spawned, deleted or loaded show up
+with the next frame the worker sends.
+
+"Performance HUD" ( or F3 ) shows the frame rate, physics steps per second, the milliseconds
+spent in each part of a frame and the number of canvas calls. When frames take too long the
+orbit lines get fewer points, lose their smoothing and are redrawn less often, the HUD shows the
+current quality level and why it last changed. Quality comes back once frames are fast again.
+
+Below the planet information the total energy and momentum of the simulation are checked every
+10 simulated days. The energy error turns red when energy drifted by more than 0.01% since the
+bodies last changed, a sign the timestep is too large for the orbits on screen. "Export Trace" saves the timings
+of the last frames to a file that chrome://tracing or ui.perfetto.dev can open.
+
 Thank you for checking out my simulator!
 
 -Jaygnat
@@ -363,7 +479,19 @@ Thank you for checking out my simulator!
             
 
     def update_speed(self, value):
-        self.simulation_settings.SPEED = value
+
+        # Slider values are powers of ten, rounded to two significant digits so the speed reads well
+        days = self.simulation_settings.DAYS_PER_SECOND
+        # A speed set elsewhere, e.g. by a loaded checkpoint, is kept while the slider still points at it
+        if( round(math.log10(max(days, 1)), 2) != round(float(value), 2) ):
+            days = float(f"{10 ** float(value):.2g}")
+        self.simulation_settings.DAYS_PER_SECOND = days
+        self.speed_scale.config(label=f"Speed ( {days:g} days/s )")
+
+    def set_speed(self, days):
+        # Move the speed slider to days simulated per second
+        self.speed_scale.set(math.log10(min(max(days, 1), MAX_DAYS_PER_SECOND)))
+        self.update_speed(self.speed_scale.get())
 
     def toggle_pause(self, pause_button):
 
@@ -378,6 +506,286 @@ Thank you for checking out my simulator!
             self.object_config['pause'] = 1
             print("Pausing sim...")
 
+    def save_state(self):
+
+        # Checkpoint the simulation to a file
+        path = filedialog.asksaveasfilename(
+            title="Save simulation",
+            defaultextension=".orbit",
+            filetypes=[("Simulation", "*.orbit"), ("All files", "*.*")]
+        )
+        if( not path ):
+            return
+        try:
+            self.orbit_simulator.save_state(path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not save simulation: {e}")
+
+    def load_state(self):
+
+        # Continue a saved simulation
+        path = filedialog.askopenfilename(
+            title="Load simulation",
+            filetypes=[("Simulation", "*.orbit"), ("All files", "*.*")]
+        )
+        if( not path ):
+            return
+        self.close_replay()
+        try:
+            self.orbit_simulator.load_state(path)
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("Error", f"Could not load simulation: {e}")
+            return
+
+        # Sliders follow the restored settings
+        self.zoom_scale.set(self.simulation_settings.zoom)
+        self.set_speed(self.simulation_settings.DAYS_PER_SECOND)
+
+    def load_scenario(self, path=None):
+
+        # Add the bodies of a scenario file to the running simulation
+        if( self.orbit_simulator.replay is not None ):
+            messagebox.showerror("Error", "Cannot add planets during a replay")
+            return
+        if( path is None ):
+            path = filedialog.askopenfilename(
+                title="Load scenario",
+                filetypes=[("Scenario", "*.csv *.json *.npz"), ("All files", "*.*")]
+            )
+        if( not path ):
+            return
+        try:
+            added = self.orbit_simulator.load_scenario(path)
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("Error", f"Could not load scenario: {e}")
+            return
+        if( added is None ):
+            print(f"Loading {path} in the physics worker...")
+            return
+        print(f"Loaded {len(added)} bodies from {path}")
+
+    def remove_escaped(self):
+
+        # Drop every body that left the solar system for good
+        if( self.orbit_simulator.replay is not None ):
+            messagebox.showerror("Error", "Cannot remove planets during a replay")
+            return
+        removed = self.orbit_simulator.remove_escaped()
+        print(f"Removed {removed} escaped bodies")
+
+    def add_asteroid_belt(self):
+
+        if( self.orbit_simulator.replay is not None ):
+            messagebox.showerror("Error", "Cannot add asteroids during a replay")
+            return
+        self.orbit_simulator.add_asteroid_belt()
+
+    def time_warp(self, warp_entry):
+
+        # Jump to the simulated year typed into the warp entry
+        if( self.orbit_simulator.replay is not None ):
+            messagebox.showerror("Error", "Cannot time warp during a replay")
+            return
+        try:
+            years = expression_convert(warp_entry.get())
+        except ValueError as e:
+            messagebox.showerror("Error", f"{e} (warp)")
+            return
+        if( years is None or warp_entry.get().strip() == "" ):
+            return
+
+        year = 365.25 * 24 * 3600
+        if( years * year <= self.simulation.time ):
+            messagebox.showerror("Error", f"Simulation is already at year {self.simulation.time / year:.2f}")
+            return
+
+        result = self.orbit_simulator.time_warp(years * year)
+        warp_entry.delete(0, tk.END)
+        if( result is None ):
+            print(f"Warping to year {years:.2f} in the physics worker...")
+            return
+        print(f"Warped to year {self.simulation.time / year:.2f}, "
+              f"{result['kepler_time'] / year:.2f} years analytically, {result['nbody_steps']} N-body steps")
+
+    def toggle_autosave(self, autosave_var):
+        self.orbit_simulator.autosave = bool(autosave_var.get())
+
+    def toggle_worker(self, worker_var):
+
+        # Move the physics into a worker process or back into this one
+        if( worker_var.get() ):
+            self.orbit_simulator.start_worker()
+        else:
+            self.orbit_simulator.stop_worker()
+
+    def toggle_hud(self):
+        # Show or hide the performance HUD to match its checkbox
+        if( self.orbit_simulator.hud.visible != bool(self.hud_var.get()) ):
+            self.orbit_simulator.hud.toggle()
+
+    def toggle_hud_key(self, event):
+        self.hud_var.set(0 if self.hud_var.get() else 1)
+        self.toggle_hud()
+
+    def export_trace(self):
+
+        # Write the profiled frames to a trace file for chrome://tracing or Perfetto
+        path = filedialog.asksaveasfilename(
+            title="Export trace",
+            defaultextension=".json",
+            filetypes=[("Chrome trace", "*.json"), ("All files", "*.*")]
+        )
+        if( not path ):
+            return
+        try:
+            self.orbit_simulator.export_trace(path)
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not export trace: {e}")
+
+    def toggle_recording(self, record_button):
+
+        # Start streaming the trajectory to a file, or stop if already recording
+        if( self.simulation.recorder is not None ):
+            self.stop_recording()
+            record_button.config(text="Record")
+            return
+
+        path = filedialog.asksaveasfilename(
+            title="Record trajectory",
+            defaultextension=".traj",
+            filetypes=[("Trajectory", "*.traj"), ("All files", "*.*")]
+        )
+        if( not path ):
+            return
+
+        self.simulation.recorder = TrajectoryRecorder(path, self.simulation_settings)
+        self.simulation.recorder.record(self.simulation)
+        record_button.config(text="Stop Recording")
+        print(f"Recording to {path}...")
+
+    def stop_recording(self):
+
+        if( self.simulation.recorder is None ):
+            return
+        recorder = self.simulation.recorder
+        self.simulation.recorder = None
+        recorder.close()
+        print(f"Recorded {recorder.frames} frames to {recorder.path}")
+
+    def open_replay(self):
+
+        # Replay a recorded trajectory instead of the simulation
+        path = filedialog.askopenfilename(
+            title="Replay trajectory",
+            filetypes=[("Trajectory", "*.traj"), ("All files", "*.*")]
+        )
+        if( not path ):
+            return
+
+        try:
+            reader = TrajectoryReader(path)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Could not open recording: {e}")
+            return
+        if( not len(reader) ):
+            reader.close()
+            messagebox.showerror("Error", "Recording has no frames")
+            return
+
+        self.close_replay()
+        self.orbit_simulator.start_replay(Replay(reader, self.simulation_settings))
+        self.orbit_simulator.replay_callback = self.update_replay_controls
+        self.build_replay_controls(len(reader))
+
+    def build_replay_controls(self, frames):
+
+        # Window with the scrub slider, speed and play controls of the replay
+        self.replay_window = tk.Toplevel(self.root)
+        self.replay_window.title("Replay")
+        self.replay_window.transient(self.root)
+        self.replay_window.resizable(0,0)
+        self.replay_window.protocol("WM_DELETE_WINDOW", self.close_replay)
+
+        self.replay_frame = IntVar(value=0)
+        scrub_scale = tk.Scale(
+            self.replay_window,
+            from_=0,
+            to=frames - 1,
+            resolution=1,
+            orient=tk.HORIZONTAL,
+            label="Frame",
+            length=400,
+            variable=self.replay_frame,
+            command=self.scrub_replay
+        )
+        scrub_scale.pack(padx=10, pady=5)
+
+        self.replay_time = ttk.Label(self.replay_window, text="Time: 0.0 days")
+        self.replay_time.pack(anchor=tk.W, padx=10)
+
+        speed_scale = tk.Scale(
+            self.replay_window,
+            from_=-365,
+            to=365,
+            resolution=1,
+            orient=tk.HORIZONTAL,
+            label="Replay Speed ( days/s )",
+            length=400,
+            command=self.update_replay_speed
+        )
+        speed_scale.set(self.simulation_settings.DAYS_PER_SECOND)
+        speed_scale.pack(padx=10, pady=5)
+
+        controls = ttk.Frame(self.replay_window)
+        controls.pack(pady=10)
+        play_button = ttk.Button(controls, text="Pause", command=lambda: self.toggle_replay(play_button))
+        play_button.grid(row=0, column=0, padx=5)
+        self.replay_play_button = play_button
+        close_button = ttk.Button(controls, text="Back to Simulation", command=self.close_replay)
+        close_button.grid(row=0, column=1, padx=5)
+
+    def update_replay_controls(self, replay):
+
+        # Follow playback with the scrub slider
+        if( self.replay_frame.get() != replay.index ):
+            self.replay_frame.set(replay.index)
+        self.replay_time.config(text=f"Time: {replay.time / (3600 * 24):.1f} days")
+        self.replay_play_button.config(text="Pause" if replay.playing else "Play")
+
+    def scrub_replay(self, value):
+
+        # Jump to the frame picked on the scrub slider
+        replay = self.orbit_simulator.replay
+        if( replay is not None and int(value) != replay.index ):
+            self.orbit_simulator.seek_replay(int(value))
+
+    def update_replay_speed(self, value):
+        if( self.orbit_simulator.replay is not None ):
+            self.orbit_simulator.replay.speed = float(value)
+
+    def toggle_replay(self, play_button):
+
+        replay = self.orbit_simulator.replay
+        if( replay is None ):
+            return
+        if( not replay.playing and (replay.index == len(replay.reader) - 1 and replay.speed > 0) ):
+            # Play again from the start once the end was reached
+            self.orbit_simulator.seek_replay(0)
+        replay.playing = not replay.playing
+        play_button.config(text="Pause" if replay.playing else "Play")
+
+    def close_replay(self):
+
+        # Go back to the live simulation
+        replay = self.orbit_simulator.replay
+        if( replay is None ):
+            return
+        self.orbit_simulator.replay_callback = None
+        self.orbit_simulator.stop_replay()
+        replay.reader.close()
+        if( hasattr(self, 'replay_window') and self.replay_window.winfo_exists() ):
+            self.replay_window.destroy()
+
     def add_planet(self, name, semi_major_axis_au, eccentricity, mass, radius, start_angle_deg=0, at_perihelion=True):
         
         """
@@ -391,25 +799,13 @@ Thank you for checking out my simulator!
         at_perihelion: true if starting at closest point to sun
         """
 
-        sun_mass = 1.98892 * 10**30
-
-        if at_perihelion:
-            # Perihelion distance = a(1-e)
-            distance = semi_major_axis_au * self.simulation_settings.AU * (1 - eccentricity)
-            # speed at perihelion from vis-viva equation: v squared = GM(2/r - 1/a)
-            a = semi_major_axis_au * self.simulation_settings.AU # Convert to meters
-            speed = math.sqrt(self.simulation_settings.G * sun_mass * (2/distance - 1/a))
-        else:
-            # Aphelion distance = a(1+e)
-            distance = semi_major_axis_au * self.simulation_settings.AU * (1 + eccentricity)
-            a = semi_major_axis_au * self.simulation_settings.AU
-            speed = math.sqrt(self.simulation_settings.G * sun_mass * (2/distance - 1/a))
-
-        angle = math.radians(start_angle_deg)
-        position = Vector2(distance * math.cos(angle), distance * math.sin(angle))
-
-        # Tangiental velocity ( perpendicular to radius )
-        velocity = Vector2(-speed * math.sin(angle), speed * math.cos(angle))
+        position, velocity = orbital_state(
+            self.simulation_settings,
+            semi_major_axis_au,
+            eccentricity,
+            start_angle_deg,
+            at_perihelion
+        )
 
         # Spawn planet with calculated properties
         self.orbit_simulator.spawn_object_hard(
@@ -423,12 +819,8 @@ Thank you for checking out my simulator!
     def spawn_planets(self):
 
         # Spawn Mercury, Venus, Earth, Mars, Jupiter, Saturn
-        self.add_planet("Earth", 1.000, 0.0167, 5.9742e24, 15, 90, False)
-        self.add_planet("Mercury", 0.387, 0.2056, 3.30e23, 10, 0, True)
-        self.add_planet("Venus", 0.723, 0.0068, 4.8685e24, 10, 45, False)
-        self.add_planet("Mars", 1.524, 0.0934, 6.39e23, 15, 135, True)
-        self.add_planet("Jupiter", 5.203, 0.0489, 1.898e27, 40, 180, False)
-        self.add_planet("Saturn", 9.537, 0.0539, 5.683e26, 35, 225, False)
+        for preset in PLANET_PRESETS:
+            self.add_planet(*preset)
         
     # Begin Simulation
     def start(self):
@@ -440,9 +832,15 @@ Thank you for checking out my simulator!
             self.object_config, 
             self.simulation_settings,
             self.update_planet_info,
-            self.clear_planet_info
+            self.clear_planet_info,
+            self.simulation
         )
         self.orbit_simulator.spawn_sun()
+
+        # Sample energy and momentum while the simulation runs
+        settings = self.simulation_settings
+        self.simulation.diagnostics = Diagnostics(settings.DIAGNOSTICS_INTERVAL, settings.ENERGY_ALERT, settings.DIAGNOSTICS_SAMPLES)
+        self.orbit_simulator.diagnostics_callback = self.update_diagnostics
                                      
         self.orbit_simulator.update_objects()
 
@@ -457,5 +855,9 @@ if __name__ == "__main__":
     orbit_sim = OrbitSimulation(root)
     orbit_sim.start()
     root.mainloop()
+    orbit_sim.orbit_simulator.stop_worker()
+    orbit_sim.stop_recording()
+    if( orbit_sim.orbit_simulator.autosave ):
+        orbit_sim.orbit_simulator.save_state(orbit_sim.simulation_settings.CHECKPOINT_PATH)
 
     print("Exiting orbitSim")
@@ -0,0 +1,146 @@
+import math
+import numpy as np
+from gravity import field_accelerations
+
+
+class ParticleSet:
+
+    """
+    Massless test particles, e.g. an asteroid belt or a debris disk
+
+    Particles feel the gravity of the massive bodies of a Simulation but exert
+    none, so they cost O( massive bodies x particles ) per step and never slow
+    down the massive bodies. They are kept in two plain ( P, 2 ) arrays, with
+    none of the per body objects, tags or canvas items of the massive bodies.
+
+    Particles are advanced with a kick-drift-kick leapfrog using the positions
+    of the massive bodies at the start and end of every step, whatever
+    integrator moves the massive bodies.
+    """
+
+    def __init__(self, capacity=1024) -> None:
+        self.count = 0
+        self._position = np.zeros((capacity, 2), dtype=np.float64)
+        self._velocity = np.zeros((capacity, 2), dtype=np.float64)
+        # Acceleration at the end of the last step and the massive positions it was computed for
+        self._acceleration = None
+        self._sources = None
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def position(self):
+        return self._position[:self.count]
+
+    @property
+    def velocity(self):
+        return self._velocity[:self.count]
+
+    def add(self, positions, velocities):
+
+        # Append particles from ( P, 2 ) arrays of positions and velocities
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        velocities = np.asarray(velocities, dtype=np.float64).reshape(-1, 2)
+        end = self.count + len(positions)
+        if( end > len(self._position) ):
+            capacity = max(1024, 1 << (end - 1).bit_length())
+            for name in ('_position', '_velocity'):
+                old = getattr(self, name)
+                new = np.zeros((capacity, 2), dtype=np.float64)
+                new[:self.count] = old[:self.count]
+                setattr(self, name, new)
+
+        self._position[self.count:end] = positions
+        self._velocity[self.count:end] = velocities
+        self.count = end
+        self._acceleration = None
+
+    def remove(self, mask):
+
+        # Remove the particles where mask is True, the others keep their order
+        keep = ~np.asarray(mask, dtype=bool)
+        kept = int(np.count_nonzero(keep))
+        self._position[:kept] = self.position[keep]
+        self._velocity[:kept] = self.velocity[keep]
+        self.count = kept
+        self._acceleration = None
+
+    def clear(self):
+        self.count = 0
+        self._acceleration = None
+
+    @property
+    def capacity(self):
+        return len(self._position)
+
+    def attach(self, positions, velocities, count):
+        # Use ( capacity, 2 ) arrays, e.g. in shared memory, as storage with count live particles
+        self._position = positions
+        self._velocity = velocities
+        self.count = count
+        self._acceleration = None
+
+    def detach(self):
+        # Copy attached arrays into arrays of the set's own, so the memory behind them can go
+        self.attach(self._position.copy(), self._velocity.copy(), self.count)
+
+    def accelerations(self, sources, masses, G):
+
+        # Acceleration of every particle due to the massive bodies at sources
+        if( self._acceleration is not None and self._sources.shape == sources.shape
+                and np.array_equal(self._sources, sources) ):
+            return self._acceleration
+        self._acceleration = field_accelerations(self.position, sources, masses, G)
+        self._sources = sources.copy()
+        return self._acceleration
+
+    def step(self, sources_before, sources_after, masses, G, dt):
+
+        # Advance every particle by dt while the massive bodies moved from sources_before to sources_after
+        if( not self.count ):
+            return
+        velocity = self.velocity
+        position = self.position
+        velocity += self.accelerations(sources_before, masses, G) * (dt / 2)
+        position += velocity * dt
+        self._acceleration = None
+        velocity += self.accelerations(sources_after, masses, G) * (dt / 2)
+
+
+def belt(settings, count, inner_au, outer_au, central_mass, max_eccentricity=0.1, rng=None):
+
+    """
+    Positions and velocities of particles on random orbits in a ring around the origin
+
+    count: number of particles
+    inner_au, outer_au: range of semi-major axes in AU
+    central_mass: mass the particles orbit in kg
+    max_eccentricity: eccentricities are drawn uniformly up to this
+
+    Returns two ( count, 2 ) arrays, relative to the central body
+    """
+
+    rng = np.random.default_rng() if rng is None else rng
+    mu = settings.G * central_mass
+
+    a = rng.uniform(inner_au, outer_au, count) * settings.AU
+    e = rng.uniform(0, max_eccentricity, count)
+    periapsis = rng.uniform(0, 2 * math.pi, count)
+    # Uniform in true anomaly, good enough for a nearly circular belt
+    anomaly = rng.uniform(0, 2 * math.pi, count)
+
+    p = a * (1 - e * e)
+    r = p / (1 + e * np.cos(anomaly))
+    angle = periapsis + anomaly
+    positions = np.stack((r * np.cos(angle), r * np.sin(angle)), axis=1)
+
+    # Radial and tangential velocity of a counterclockwise keplerian orbit
+    radial = np.sqrt(mu / p) * e * np.sin(anomaly)
+    tangential = np.sqrt(mu / p) * (1 + e * np.cos(anomaly))
+    velocities = np.stack((
+        radial * np.cos(angle) - tangential * np.sin(angle),
+        radial * np.sin(angle) + tangential * np.cos(angle)
+    ), axis=1)
+
+    return positions, velocities
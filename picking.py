@@ -0,0 +1,115 @@
+import numpy as np
+
+
+# Pixels around an oval that still count as on it, as Tk's closeenough canvas option
+CLOSE_ENOUGH = 1.0
+
+# Offset that keeps grid rows of the keys positive, ovals are never this far off screen
+_ROW_OFFSET = 1 << 31
+
+
+def _keys(column, row):
+    # Sort key of grid cells, the cells of one column are consecutive
+    return (column << 32) + (row + _ROW_OFFSET)
+
+
+class PickIndex:
+
+    """
+    Finds the planet drawn under a point of the canvas
+
+    Takes the place of Tk event bindings on every planet: the canvas has one
+    handler for clicks and hovers, which looks the planet up here. The renderer
+    hands over the screen rectangles of the ovals it drew each frame and the
+    index over them is only built when a point is looked up, at most once a frame.
+
+    Ovals are sorted into a uniform grid of `cell` pixel squares by their center.
+    An oval that reaches no further than a cell from its center, radius plus
+    CLOSE_ENOUGH, and covers a point has its center in the cell of the point or
+    one of the 8 around it, so a lookup tests a handful of ovals whatever the
+    number of planets. The few larger ovals are tested directly.
+    """
+
+    def __init__(self, cell=32) -> None:
+        self.cell = cell
+        self._planets = []
+        self._rects = np.zeros((0, 4), dtype=np.int64)
+        # Planets drawn on their own since the last frame, with the rectangle they were drawn at
+        self._extra = []
+        self._built = False
+
+    def __len__(self):
+        return len(self._planets) + len(self._extra)
+
+    def update(self, planets, rects):
+
+        # Replace the index with the ovals drawn this frame, a list of planets and their ( N, 4 ) rectangles
+        self._planets = planets
+        self._rects = np.asarray(rects, dtype=np.int64).reshape(-1, 4)
+        self._extra = []
+        self._built = False
+
+    def add(self, planet, rect):
+        # A planet drawn between frames, e.g. one just spawned while paused
+        self._extra.append((planet, list(rect)))
+
+    def clear(self):
+        self.update([], ())
+
+    def _build(self):
+
+        rects = self._rects.astype(np.float64)
+        self._center = (rects[:, :2] + rects[:, 2:]) / 2
+        self._radius = (rects[:, 2] - rects[:, 0]) / 2
+
+        # Clicks count up to CLOSE_ENOUGH outside an oval, that has to stay within the cells searched
+        large = self._radius + CLOSE_ENOUGH > self.cell
+        self._large = np.flatnonzero(large)
+        small = np.flatnonzero(~large)
+        grid = np.floor(self._center[small] / self.cell).astype(np.int64)
+        keys = _keys(grid[:, 0], grid[:, 1])
+        order = np.argsort(keys, kind='stable')
+        self._small = small[order]
+        self._keys = keys[order]
+        self._built = True
+
+    def _covers(self, planet, rect, x, y):
+
+        # Whether the oval of planet is still drawn at rect and covers x, y
+        if( planet.oval_id is None or planet.hidden or planet.screen_rect != rect ):
+            return False
+        radius = (rect[2] - rect[0]) / 2 + CLOSE_ENOUGH
+        dx = x - (rect[0] + rect[2]) / 2
+        dy = y - (rect[1] + rect[3]) / 2
+        return dx * dx + dy * dy <= radius * radius
+
+    def find(self, x, y):
+
+        # Topmost planet whose oval covers canvas point x, y, None if there is none
+        if( not self._built ):
+            self._build()
+
+        column = int(x // self.cell)
+        row = int(y // self.cell)
+        candidates = [self._large]
+        for dx in (-1, 0, 1):
+            # Rows row - 1 to row + 1 of a column are one run of the sorted keys
+            start = np.searchsorted(self._keys, _keys(column + dx, row - 1), 'left')
+            stop = np.searchsorted(self._keys, _keys(column + dx, row + 1), 'right')
+            candidates.append(self._small[start:stop])
+        index = np.concatenate(candidates)
+
+        # Ovals created later are drawn on top
+        found = None
+        if( len(index) ):
+            offset = np.hypot(*(self._center[index] - (x, y)).T)
+            for i in index[offset <= self._radius[index] + CLOSE_ENOUGH].tolist():
+                planet = self._planets[i]
+                if( self._covers(planet, self._rects[i].tolist(), x, y) ):
+                    if( found is None or planet.oval_id > found.oval_id ):
+                        found = planet
+        for planet, rect in self._extra:
+            if( self._covers(planet, rect, x, y) ):
+                if( found is None or planet.oval_id > found.oval_id ):
+                    found = planet
+        return found
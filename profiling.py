@@ -0,0 +1,243 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+import numpy as np
+from gameloop import QUALITY_LEVELS
+
+
+class RollingHistogram:
+
+    """
+    The last `size` samples of a timing, kept in a ring buffer
+
+    Adding a sample is O(1), the statistics are computed from the buffer when asked for.
+    """
+
+    def __init__(self, size=240) -> None:
+        self.samples = np.zeros(size, dtype=np.float64)
+        self.count = 0
+        self._next = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value):
+        self.samples[self._next] = value
+        self._next = (self._next + 1) % len(self.samples)
+        self.count = min(self.count + 1, len(self.samples))
+
+    def values(self):
+        # Samples currently in the window, oldest first
+        if( self.count < len(self.samples) ):
+            return self.samples[:self.count]
+        return np.roll(self.samples, -self._next)
+
+    def mean(self):
+        return float(np.mean(self.samples[:self.count])) if self.count else 0.0
+
+    def percentile(self, q):
+        return float(np.percentile(self.samples[:self.count], q)) if self.count else 0.0
+
+    def histogram(self, bins=10):
+        # ( counts, edges ) of the samples in the window
+        return np.histogram(self.samples[:self.count], bins=bins)
+
+
+class _Phase:
+
+    # Context manager timing one phase of a frame
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name) -> None:
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = self.profiler.clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_phase(self.name, self.start, self.profiler.clock())
+        return False
+
+
+class FrameProfiler:
+
+    """
+    Times the phases of every rendered frame
+
+    Frames are delimited by begin_frame and end_frame, and each phase of a frame
+    is wrapped in `with profiler.phase(name):`. Phase times and the whole frame
+    time go into rolling histograms of the last `window` frames, counters such
+    as Tk calls or physics steps are passed to end_frame. A phase may run
+    several times in a frame, its times are summed.
+
+    Every phase is also kept as an event of a trace ( at most `trace_events` of
+    them ) that export_trace writes in the Chrome trace event format, which
+    chrome://tracing, Perfetto and speedscope can open. Things that happen at
+    an instant, e.g. a change of rendering quality, are added with mark.
+    """
+
+    def __init__(self, window=240, trace_events=200000, clock=time.perf_counter) -> None:
+        self.window = window
+        self.clock = clock
+        # name: RollingHistogram of milliseconds per frame
+        self.phases = {}
+        self.frame = RollingHistogram(window)
+        # name: RollingHistogram of the counter values per frame
+        self.counters = {}
+        self.frames = 0
+        self.events = deque(maxlen=trace_events)
+        self._origin = clock()
+        self._frame_start = None
+        self._current = {}
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def begin_frame(self):
+        self._frame_start = self.clock()
+        self._current = {}
+
+    def add_phase(self, name, start, end):
+
+        # Record a phase that ran from start to end seconds on the profiler clock
+        if( self._frame_start is not None ):
+            self._current[name] = self._current.get(name, 0.0) + end - start
+        self.events.append(("X", name, start, end - start))
+
+    def phase_ms(self, name):
+        # Milliseconds spent in phase name so far in the current frame
+        return self._current.get(name, 0.0) * 1000
+
+    def mark(self, name, **args):
+        # Record an instant event with args shown alongside it in the trace
+        self.events.append(("i", name, self.clock(), args))
+
+    def end_frame(self, **counters):
+
+        # Close the frame started by begin_frame, counters are numbers to track per frame. Returns the frame time in ms
+        if( self._frame_start is None ):
+            return None
+        end = self.clock()
+        frame_ms = (end - self._frame_start) * 1000
+        self.frame.add(frame_ms)
+        self.events.append(("X", "frame", self._frame_start, end - self._frame_start))
+
+        # Phases that did not run this frame count as zero
+        for name in self._current:
+            if( name not in self.phases ):
+                self.phases[name] = RollingHistogram(self.window)
+        for name, histogram in self.phases.items():
+            histogram.add(self._current.get(name, 0.0) * 1000)
+        for name, value in counters.items():
+            if( name not in self.counters ):
+                self.counters[name] = RollingHistogram(self.window)
+            self.counters[name].add(value)
+            self.events.append(("C", name, end, value))
+
+        self.frames += 1
+        self._frame_start = None
+        return frame_ms
+
+    def summary(self):
+
+        # Mean and 95th percentile of the frame, every phase and every counter over the window
+        return {
+            'frames': self.frames,
+            'frame_ms': (self.frame.mean(), self.frame.percentile(95)),
+            'phases': {name: (h.mean(), h.percentile(95)) for name, h in self.phases.items()},
+            'counters': {name: (h.mean(), h.percentile(95)) for name, h in self.counters.items()},
+        }
+
+    def trace(self):
+
+        # Trace events in the Chrome trace event format, timestamps in microseconds
+        pid, tid = os.getpid(), threading.get_ident()
+        events = []
+        for kind, name, start, value in list(self.events):
+            ts = (start - self._origin) * 1e6
+            if( kind == "C" ):
+                events.append({'name': name, 'ph': "C", 'ts': ts, 'pid': pid, 'args': {name: value}})
+            elif( kind == "i" ):
+                events.append({'name': name, 'ph': "i", 's': "p", 'ts': ts, 'pid': pid, 'tid': tid, 'args': value})
+            else:
+                events.append({'name': name, 'ph': "X", 'ts': ts, 'dur': value * 1e6, 'pid': pid, 'tid': tid})
+        return {'traceEvents': events, 'displayTimeUnit': "ms"}
+
+    def export_trace(self, path):
+        with open(path, 'w') as trace_file:
+            json.dump(self.trace(), trace_file)
+
+
+class PerformanceHUD:
+
+    """
+    Text overlay in the corner of the canvas with the frame rate and phase timings
+
+    One canvas text item, refreshed at most every `interval` wall seconds so the
+    HUD itself does not show up in the timings it reports. With an AdaptiveQuality
+    it also shows the rendering quality level and why it was last changed.
+    """
+
+    def __init__(self, canvas, profiler, scheduler, interval=0.25, x=890, y=10, quality=None) -> None:
+        self.canvas = canvas
+        self.profiler = profiler
+        self.scheduler = scheduler
+        self.quality = quality
+        self.interval = interval
+        self.visible = False
+        self.item = None
+        self.x, self.y = x, y
+        self._last = None
+
+    def toggle(self):
+        self.visible = not self.visible
+        if( self.item is not None ):
+            self.canvas.itemconfig(self.item, state="normal" if self.visible else "hidden")
+        self._last = None
+
+    def text(self):
+
+        # Lines shown by the HUD
+        summary = self.profiler.summary()
+        mean, p95 = summary['frame_ms']
+        lines = [
+            f"{self.scheduler.frames_per_second:5.1f} fps   {mean:5.1f} ms ( p95 {p95:5.1f} )",
+            f"{self.scheduler.steps_per_second:7.0f} steps/s",
+        ]
+        if( self.quality is not None ):
+            lines.append(f"quality {self.quality.level} / {len(QUALITY_LEVELS) - 1}")
+            if( self.quality.reason ):
+                lines.append(self.quality.reason)
+        for name, (mean, p95) in summary['phases'].items():
+            lines.append(f"{name:<18} {mean:6.2f} ms ( p95 {p95:6.2f} )")
+        for name, (mean, p95) in summary['counters'].items():
+            lines.append(f"{name:<18} {mean:6.0f}    ( p95 {p95:6.0f} )")
+        return "\n".join(lines)
+
+    def update(self):
+
+        # Refresh the text if visible and the interval has passed, returns the number of Tk calls made
+        if( not self.visible ):
+            return 0
+        now = time.perf_counter()
+        if( self._last is not None and now - self._last < self.interval ):
+            return 0
+        self._last = now
+
+        if( self.item is None ):
+            self.item = self.canvas.create_text(
+                self.x, self.y,
+                text=self.text(),
+                font=("Courier", 8),
+                fill="lime",
+                anchor="ne",
+                tags="performance_hud"
+            )
+            return 1
+        self.canvas.itemconfig(self.item, text=self.text())
+        self.canvas.tag_raise(self.item)
+        return 2
@@ -0,0 +1,295 @@
+import json
+import mmap
+import queue
+import struct
+import threading
+import time
+import numpy as np
+from simulation import Simulation
+from vector import Vector2
+
+
+# First bytes of every trajectory file
+MAGIC = b"ORBTRAJ1"
+
+# Record header: kind, segment, frames, bodies, payload bytes
+RECORD = struct.Struct("<4sIIIQ")
+
+# Record kinds
+SEGMENT = b"SEGM"
+CHUNK = b"CHNK"
+
+
+def _padded(data):
+    # Pad bytes to a multiple of 8 so the arrays that follow stay aligned
+    return data + b" " * (-len(data) % 8)
+
+
+class TrajectoryRecorder:
+
+    """
+    Streams the state of every body to a chunked binary trajectory file
+
+    File layout:
+    - MAGIC, a little endian uint64 header length and a JSON header with the
+      timestep, G and AU of the simulation
+    - a sequence of records, each a RECORD header followed by its payload:
+      SEGM: JSON with the tags, masses, radii and sun flags of the bodies, written
+            whenever bodies are added or removed. Frames that follow belong to it.
+      CHNK: `frames` float64 times followed by a ( frames, bodies, 4 ) float64 array
+            of x, y, vx, vy in meters and m/s
+
+    Recording a frame only copies the state into an in-memory chunk. Full chunks
+    are written by a background thread, so the step loop never waits on the disk.
+    A file cut short by a crash is still readable up to its last complete chunk.
+    """
+
+    def __init__(self, path, settings, chunk_frames=256) -> None:
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.frames = 0
+        self._file = open(path, 'wb')
+        header = _padded(json.dumps({
+            'timestep': settings.TIMESTEP,
+            'G': settings.G,
+            'AU': settings.AU,
+        }).encode())
+        self._file.write(MAGIC + struct.pack("<Q", len(header)) + header)
+
+        self._segment = -1
+        self._store = None
+        self._generation = None
+        self._times = None
+        self._state = None
+        self._filled = 0
+
+        # Chunks waiting to be written, None stops the writer
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def record(self, simulation):
+
+        # Append the current state of simulation as one frame
+        store = simulation.store
+        if( store is not self._store or store.generation != self._generation ):
+            self._start_segment(store)
+
+        self._times[self._filled] = simulation.time
+        self._state[self._filled, :, :2] = store.position
+        self._state[self._filled, :, 2:] = store.velocity
+        self._filled += 1
+        self.frames += 1
+
+        if( self._filled == self.chunk_frames ):
+            self._flush_chunk()
+
+    def _start_segment(self, store):
+
+        # Bodies changed, finish the current chunk and describe the new set of bodies
+        self._flush_chunk()
+        self._segment += 1
+        self._store = store
+        self._generation = store.generation
+        description = _padded(json.dumps({
+            # Replays give the bodies new ids, unnamed bodies are written with the names they have here
+            'tags': [store.tag(index) for index in range(len(store))],
+            'masses': store.mass.tolist(),
+            'radii': store.radius.tolist(),
+            'sun': store.sun.tolist(),
+        }).encode())
+        self._queue.put(RECORD.pack(SEGMENT, self._segment, 0, len(store), len(description)) + description)
+
+        self._times = np.zeros(self.chunk_frames, dtype=np.float64)
+        self._state = np.zeros((self.chunk_frames, len(store), 4), dtype=np.float64)
+        self._filled = 0
+
+    def _flush_chunk(self):
+
+        # Hand the filled part of the current chunk to the writer thread
+        if( not self._filled ):
+            return
+        times = self._times[:self._filled].tobytes()
+        state = self._state[:self._filled].tobytes()
+        bodies = self._state.shape[1]
+        self._queue.put(RECORD.pack(CHUNK, self._segment, self._filled, bodies, len(times) + len(state)) + times + state)
+        self._filled = 0
+
+    def _write_loop(self):
+        while( True ):
+            data = self._queue.get()
+            if( data is None ):
+                break
+            self._file.write(data)
+
+    def flush(self):
+        # Write out frames recorded so far
+        self._flush_chunk()
+
+    def close(self):
+
+        # Write the last frames and close the file, blocks until the writer is done
+        if( self._file.closed ):
+            return
+        self._flush_chunk()
+        self._queue.put(None)
+        self._writer.join()
+        self._file.close()
+
+
+class TrajectoryReader:
+
+    """
+    Random access to the frames of a trajectory file
+
+    The file is memory-mapped and indexed once when opened, frames are numpy
+    views straight into the mapping, so scrubbing through a recording of any
+    length only touches the pages of the frames actually looked at.
+    """
+
+    def __init__(self, path) -> None:
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if( self._map[:len(MAGIC)] != MAGIC ):
+            self.close()
+            raise ValueError(f"{path} is not a trajectory file")
+        (length,) = struct.unpack_from("<Q", self._map, len(MAGIC))
+        offset = len(MAGIC) + 8
+        self.header = json.loads(self._map[offset:offset + length])
+        offset += length
+
+        # Bodies of every segment
+        self.segments = []
+        # Per chunk: file offset of its times, segment, first frame, frames and bodies
+        chunks = []
+        frames = 0
+        size = len(self._map)
+        while( offset + RECORD.size <= size ):
+            kind, segment, count, bodies, length = RECORD.unpack_from(self._map, offset)
+            offset += RECORD.size
+            if( offset + length > size ):
+                # Record cut short, the recording was interrupted
+                break
+            if( kind == SEGMENT ):
+                self.segments.append(json.loads(self._map[offset:offset + length]))
+            elif( kind == CHUNK ):
+                chunks.append((offset, segment, frames, count, bodies))
+                frames += count
+            offset += length
+
+        self._chunks = chunks
+        self._chunk_first = np.array([chunk[2] for chunk in chunks], dtype=np.int64)
+        self.frames = frames
+        self.times = np.concatenate([
+            np.frombuffer(self._map, dtype=np.float64, count=count, offset=start)
+            for start, _, _, count, _ in chunks
+        ]) if chunks else np.zeros(0)
+
+    def __len__(self):
+        return self.frames
+
+    @property
+    def timestep(self):
+        return self.header['timestep']
+
+    def frame(self, index):
+
+        """
+        State of frame index
+
+        Returns ( time, segment, state ) where state is a read-only
+        ( bodies, 4 ) view of x, y, vx, vy into the file
+        """
+
+        chunk = int(np.searchsorted(self._chunk_first, index, side='right')) - 1
+        start, segment, first, count, bodies = self._chunks[chunk]
+        row = index - first
+        offset = start + count * 8 + row * bodies * 32
+        state = np.frombuffer(self._map, dtype=np.float64, count=bodies * 4, offset=offset).reshape(bodies, 4)
+        return float(self.times[index]), segment, state
+
+    def index_at(self, t):
+        # Last frame recorded at or before simulated time t
+        return max(0, min(self.frames - 1, int(np.searchsorted(self.times, t, side='right')) - 1))
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+class Replay:
+
+    """
+    Plays a recorded trajectory back without running any physics
+
+    Bodies of the frame being shown are loaded into a Simulation that is only
+    used as a container and never stepped, so the usual canvas views can draw
+    it. Playback speed is given in simulated days per wall second and may be
+    negative to play backwards.
+    """
+
+    def __init__(self, reader, settings, clock=time.perf_counter) -> None:
+        self.reader = reader
+        self.settings = settings
+        self.clock = clock
+        self.simulation = Simulation(settings)
+        self.speed = settings.DAYS_PER_SECOND
+        self.playing = True
+        self.index = 0
+        self.segment = None
+        self.time = float(reader.times[0]) if len(reader) else 0.0
+        self._last = None
+
+    def seek(self, index):
+
+        # Show frame index, returns True if the set of bodies changed
+        if( not len(self.reader) ):
+            return False
+        self.index = max(0, min(len(self.reader) - 1, int(index)))
+        self.time, segment, state = self.reader.frame(self.index)
+
+        changed = segment != self.segment
+        if( changed ):
+            self._load_segment(segment)
+
+        store = self.simulation.store
+        store.position[:] = state[:, :2]
+        store.velocity[:] = state[:, 2:]
+        self.simulation.time = self.time
+        self.simulation.update_distance_to_sun()
+        return changed
+
+    def _load_segment(self, segment):
+
+        # Replace the bodies of the container simulation with those of segment
+        self.segment = segment
+        description = self.reader.segments[segment]
+        self.simulation = Simulation(self.settings)
+        for tag, mass, radius, sun in zip(description['tags'], description['masses'], description['radii'], description['sun']):
+            self.simulation.add_body(Vector2(0, 0), Vector2(0, 0), mass, radius, tag, sun)
+
+    def advance(self):
+
+        # Move playback on by the wall time since the last call, returns True if the set of bodies changed
+        now = self.clock()
+        elapsed = 0.0 if self._last is None else now - self._last
+        self._last = now
+        if( not len(self.reader) ):
+            return False
+        if( not self.playing ):
+            return self.seek(self.index) if self.segment is None else False
+
+        target = self.time + elapsed * self.speed * 3600 * 24
+        index = self.reader.index_at(target)
+        if( index == self.index and self.segment is not None ):
+            # Between two recorded frames, keep counting simulated time
+            self.time = target
+            return False
+        changed = self.seek(index)
+        self.time = min(max(target, float(self.reader.times[0])), float(self.reader.times[-1]))
+        if( index == len(self.reader) - 1 and self.speed > 0 or index == 0 and self.speed < 0 ):
+            # Reached the end of the recording
+            self.playing = False
+        return changed
@@ -0,0 +1,302 @@
+import tkinter as tk
+import numpy as np
+from picking import PickIndex
+
+
+# Canvas Dimensions
+WIDTH, HEIGHT = 900, 675
+
+
+class PointLayer:
+
+    """
+    Single canvas image item that draws many bodies as one pixel points
+
+    Bodies smaller than a pixel are not worth an oval item each, they are
+    plotted into one PPM image instead, which costs one Tk call per frame no
+    matter how many points there are. The image sits below every other item
+    on the canvas and has the canvas background color.
+    """
+
+    # Class of the image the points are drawn into, replaceable for headless use
+    image_class = tk.PhotoImage
+
+    def __init__(self, canvas, width=WIDTH, height=HEIGHT, color=(255, 255, 255), background=(0, 0, 0)) -> None:
+        self.canvas = canvas
+        self.width = width
+        self.height = height
+        self.color = np.array(color, dtype=np.uint8)
+        self.background = np.array(background, dtype=np.uint8)
+        self.header = f"P6 {width} {height} 255 ".encode()
+        self.image = None
+        self.item = None
+        self.shown = False
+        self._last = None
+
+    def draw(self, x, y):
+
+        # Plot points at screen coordinates x, y, returns the number of Tk calls made
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        x = x[inside].astype(np.int64)
+        y = y[inside].astype(np.int64)
+
+        if( not len(x) ):
+            if( self.shown ):
+                self.canvas.itemconfig(self.item, state="hidden")
+                self.shown = False
+                self._last = None
+                return 1
+            return 0
+
+        # Nothing to do if every point lands on the same pixel as last frame
+        pixels = np.unique(y * self.width + x)
+        if( self.shown and self._last is not None and np.array_equal(pixels, self._last) ):
+            return 0
+        self._last = pixels
+
+        frame = np.empty((self.height * self.width, 3), dtype=np.uint8)
+        frame[:] = self.background
+        frame[pixels] = self.color
+        data = self.header + frame.tobytes()
+
+        calls = 0
+        if( self.image is None ):
+            self.image = self.image_class(width=self.width, height=self.height, data=data, format='PPM')
+            self.item = self.canvas.create_image(0, 0, image=self.image, anchor="nw", tags="point_layer")
+            self.canvas.tag_lower(self.item)
+            calls += 3
+        else:
+            self.image.configure(data=data, format='PPM')
+            calls += 1
+        if( not self.shown ):
+            self.canvas.itemconfig(self.item, state="normal")
+            calls += 1
+        self.shown = True
+        return calls
+
+
+class CanvasRenderer:
+
+    """
+    Draws celestial objects on the canvas with as few Tk calls as possible
+
+    Every Tk call crosses into Tcl, so per frame the renderer:
+    - computes the rounded screen rectangle of every body at once with numpy
+    - skips bodies whose rectangle did not change since the last frame
+    - hides bodies that are completely outside the viewport instead of moving them
+    - draws bodies smaller than a pixel, bodies without a view and test particles into a single point layer instead of ovals
+
+    The ovals drawn each frame go into a PickIndex, which finds the planet under
+    the mouse for the canvas' click and hover handlers.
+
+    The number of Tk calls made in the last frame is kept in `frame_calls`,
+    along with a breakdown in `stats`. A frame runs from begin_frame to
+    end_frame, canvas calls made in it outside the renderer go through delete
+    and itemconfig or are added to `calls`, so every call is counted.
+    """
+
+    def __init__(self, canvas, settings, width=WIDTH, height=HEIGHT) -> None:
+        self.canvas = canvas
+        self.settings = settings
+        self.width = width
+        self.height = height
+        self.points = PointLayer(canvas, width, height)
+        # Planets whose ovals are on screen, for looking up the planet under the mouse
+        self.picker = PickIndex()
+        # Tk calls made in the current frame
+        self.calls = 0
+        # Tk calls made in the last finished frame
+        self.frame_calls = 0
+        self.stats = {}
+        # Whether orbit lines are drawn as smoothed splines
+        self.smooth = True
+
+    def begin_frame(self):
+        # Start counting the calls of a new frame, calls made between frames belong to none
+        self.calls = 0
+
+    def end_frame(self):
+        self.frame_calls = self.calls
+        self.stats['tk_calls'] = self.calls
+
+    def screen_rects(self, planets):
+
+        # Rounded ( x1, y1, x2, y2 ) screen rectangle and pixel radius of every planet
+        store = planets[0].body.store
+        index = np.fromiter((planet.body.index for planet in planets), dtype=np.int64, count=len(planets))
+        return self.rects(store.position[index], store.radius[index])
+
+    def rects(self, positions, radii):
+
+        # Screen centers, pixel radii and rounded ( x1, y1, x2, y2 ) rectangles of bodies at world positions, radii in pixels at zoom 1.0
+        center = self.project(positions)
+        radius = radii.astype(np.float64) * self.settings.zoom
+        rects = np.rint(np.concatenate((center - radius[:, None], center + radius[:, None]), axis=1)).astype(np.int64)
+        return center, radius, rects
+
+    def onscreen(self, rects):
+        # Which rectangles overlap the viewport
+        return (rects[:, 2] >= 0) & (rects[:, 0] <= self.width) & (rects[:, 3] >= 0) & (rects[:, 1] <= self.height)
+
+    def drawn_as_oval(self, positions, radii):
+        # Which bodies at world positions with radii in pixels at zoom 1.0 draw_objects would show as ovals
+        _, radius, rects = self.rects(positions, radii)
+        return self.onscreen(rects) & (radius >= self.settings.SUBPIXEL_RADIUS)
+
+    def project(self, positions):
+        # Screen coordinates of ( N, 2 ) world positions in meters
+        return positions * self.settings.SCALE + (self.width / 2, self.height / 2)
+
+    def draw_objects(self, planets, points=None):
+
+        """
+        Draw every planet, skipping unchanged and culling off-screen ones
+
+        points: optional ( P, 2 ) array of positions in meters of test particles
+                and bodies without a view, plotted into the point layer along
+                with sub-pixel planets
+        """
+
+        if( points is not None and len(points) ):
+            particle_points = self.project(points)
+        else:
+            particle_points = np.zeros((0, 2))
+        self.stats['particles'] = len(particle_points)
+
+        if( not len(planets) ):
+            self.picker.clear()
+            self.calls += self.points.draw(particle_points[:, 0], particle_points[:, 1])
+            return
+
+        center, radius, rects = self.screen_rects(planets)
+
+        onscreen = self.onscreen(rects)
+        subpixel = radius < self.settings.SUBPIXEL_RADIUS
+
+        drawn = skipped = culled = 0
+        shown = []
+        for planet, rect, visible, tiny in zip(planets, rects.tolist(), onscreen.tolist(), subpixel.tolist()):
+            if( visible and not tiny ):
+                if( self.show(planet, rect) ):
+                    drawn += 1
+                else:
+                    skipped += 1
+                shown.append(planet)
+            else:
+                self.hide(planet)
+                culled += 1
+        self.picker.update(shown, rects[onscreen & ~subpixel])
+
+        # Sub-pixel bodies and particles go into the point layer
+        points = np.concatenate((center[subpixel], particle_points))
+        self.calls += self.points.draw(points[:, 0], points[:, 1])
+
+        self.stats.update(drawn=drawn, skipped=skipped, culled=culled, points=int(np.count_nonzero(subpixel & onscreen)))
+
+    def draw_object(self, planet):
+
+        # Draw a single planet right away
+        center, radius, rects = self.screen_rects([planet])
+        if( radius[0] < self.settings.SUBPIXEL_RADIUS ):
+            self.hide(planet)
+            return
+        self.show(planet, rects[0].tolist())
+        self.picker.add(planet, planet.screen_rect)
+
+    def show(self, planet, rect):
+
+        # Place planet oval at rect, returns False if nothing had to change
+        if( planet.oval_id is None ):
+            if( planet.sun ):
+                planet.oval_id = self.canvas.create_oval(*rect, fill="yellow", outline=planet.color, tags="body")
+            else:
+                planet.oval_id = self.canvas.create_oval(*rect, fill="black", outline=planet.color, tags="body")
+            self.calls += 1
+        elif( planet.hidden ):
+            self.canvas.itemconfig(planet.oval_id, state="normal")
+            self.canvas.coords(planet.oval_id, *rect)
+            self.calls += 2
+        elif( rect != planet.screen_rect ):
+            self.canvas.coords(planet.oval_id, *rect)
+            self.calls += 1
+        else:
+            return False
+
+        planet.screen_rect = rect
+        planet.hidden = False
+        return True
+
+    def hide(self, planet):
+
+        # Hide planet oval, if it has one and is not hidden already
+        if( planet.oval_id is not None and not planet.hidden ):
+            self.canvas.itemconfig(planet.oval_id, state="hidden")
+            self.calls += 1
+        planet.hidden = True
+
+    def draw_orbits(self, planets, max_points=None, smooth=None):
+
+        """
+        Create or update the orbit lines of planets
+
+        Trails are stored in meters, the visible part of every trail is projected
+        onto the screen in one batched transform, so a zoom change only needs a
+        redraw and no trail history is lost.
+
+        Every line ends at the current position of its planet.
+
+        max_points: points drawn per trail, settings.MAX_TRAIL_POINTS by default
+        smooth: whether lines are smoothed splines, switching it restyles every
+                orbit line in one call. Unchanged by default
+        """
+
+        if( max_points is None ):
+            max_points = self.settings.MAX_TRAIL_POINTS
+        if( smooth is not None and smooth != self.smooth ):
+            self.smooth = smooth
+            self.canvas.itemconfig("orbit", smooth=smooth)
+            self.calls += 1
+
+        if( not planets ):
+            return
+        store = planets[0].body.store
+        index = np.fromiter((planet.body.index for planet in planets), dtype=np.int64, count=len(planets))
+        current = store.position[index].tolist()
+
+        trails = []
+        for planet, position in zip(planets, current):
+            points = planet.orbit.thinned(max_points, position)
+            if( len(points) >= 2 ):
+                trails.append((planet, points))
+
+        if( not trails ):
+            return
+
+        points = np.concatenate([points for planet, points in trails])
+        screen = self.project(points)
+        splits = np.cumsum([len(points) for planet, points in trails])[:-1]
+
+        for (planet, _), line in zip(trails, np.split(screen, splits)):
+            coords = line.ravel().tolist()
+            if( planet.orbit_line_id is None ):
+                planet.orbit_line_id = self.canvas.create_line(
+                    *coords,
+                    dash=(5,2),
+                    smooth=self.smooth,
+                    fill="white",
+                    width=1,
+                    splinesteps=5,
+                    tags="orbit"
+                )
+            else:
+                # Update existing orbit line
+                self.canvas.coords(planet.orbit_line_id, *coords)
+            self.calls += 1
+
+    def delete(self, *items):
+        self.canvas.delete(*items)
+        self.calls += 1
+
+    def itemconfig(self, item, **options):
+        self.canvas.itemconfig(item, **options)
+        self.calls += 1
@@ -0,0 +1,203 @@
+import csv
+import json
+import math
+import os
+import numpy as np
+from kepler import elements_to_state
+
+
+# Columns a scenario can give for every body, and the value used where it leaves one out.
+# A body is placed either by its state vector ( x, y in meters, vx, vy in m/s ) or by
+# orbital elements around the sun ( semi_major_axis in AU, eccentricity, periapsis and
+# mean_anomaly in degrees, direction +1 counterclockwise or -1 clockwise ), the state
+# vector is used where semi_major_axis is missing
+COLUMNS = {
+    'mass': None,
+    'radius': 5.0,
+    'sun': False,
+    'x': 0.0,
+    'y': 0.0,
+    'vx': 0.0,
+    'vy': 0.0,
+    'semi_major_axis': math.nan,
+    'eccentricity': 0.0,
+    'periapsis': 0.0,
+    'mean_anomaly': 0.0,
+    'direction': 1.0,
+}
+
+# Values of the sun column that mean true in a CSV file
+_TRUE = ('1', 'true', 'yes')
+
+
+def read_scenario(path):
+
+    """
+    Columns of a scenario file as numpy arrays
+
+    .csv: a header row naming the columns, then one row per body
+    .json: a list of bodies as objects, or one object mapping each column to a list,
+           either one optionally under a "bodies" key
+    .npz: one array per column, as written by numpy.savez
+
+    Columns are named as in COLUMNS, plus an optional tag column. Numbers in
+    CSV and column files are parsed in one numpy pass per file, which loads a
+    million bodies in about a second from CSV and in a fraction of that from npz.
+
+    Returns a dict of column name to ( N, ) array, with only the columns the file has
+    """
+
+    extension = os.path.splitext(path)[1].lower()
+    if( extension == ".csv" ):
+        return _read_csv(path)
+    if( extension == ".json" ):
+        return _read_json(path)
+    if( extension == ".npz" ):
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+    raise ValueError(f"unknown scenario format {extension!r}, expected .csv, .json or .npz")
+
+
+def _read_csv(path):
+
+    with open(path, newline='') as scenario_file:
+        header = [name.strip() for name in next(csv.reader(scenario_file), [])]
+    if( not header ):
+        raise ValueError(f"{path} has no header row")
+
+    columns = {}
+    numbers = [index for index, name in enumerate(header) if name not in ('tag', 'sun')]
+    if( numbers ):
+        values = np.loadtxt(path, delimiter=',', skiprows=1, usecols=numbers, dtype=np.float64, ndmin=2)
+        for k, index in enumerate(numbers):
+            columns[header[index]] = values[:, k]
+    for name in ('tag', 'sun'):
+        if( name in header ):
+            columns[name] = np.char.strip(np.loadtxt(path, delimiter=',', skiprows=1, usecols=header.index(name), dtype=str, ndmin=1))
+    if( 'sun' in columns ):
+        columns['sun'] = np.isin(np.char.lower(columns['sun']), _TRUE)
+    return columns
+
+
+def _read_json(path):
+
+    with open(path) as scenario_file:
+        data = json.load(scenario_file)
+    if( isinstance(data, dict) and 'bodies' in data ):
+        data = data['bodies']
+
+    # Column oriented
+    if( isinstance(data, dict) ):
+        return {name: np.asarray(values) for name, values in data.items()}
+
+    # One object per body
+    if( not isinstance(data, list) or not all(isinstance(body, dict) for body in data) ):
+        raise ValueError(f"{path} must hold a list of bodies or an object of columns")
+    names = {name for body in data for name in body}
+    columns = {}
+    for name in names:
+        default = None if name == 'tag' else COLUMNS.get(name)
+        columns[name] = np.asarray([body.get(name, default) for body in data])
+    return columns
+
+
+def add_scenario(simulation, columns):
+
+    """
+    Add every body of a scenario to simulation in one go
+
+    columns: dict of column name to sequence, see COLUMNS, e.g. from read_scenario.
+             mass is required, bodies without a tag are named body_<id>
+
+    Orbital elements are converted to state vectors in one vectorized pass,
+    around the last sun of the scenario or, if it has none, the last sun of the
+    simulation, then all bodies are appended to the body store at once.
+
+    Returns range of the store indices of the new bodies
+    """
+
+    unknown = set(columns) - set(COLUMNS) - {'tag'}
+    if( unknown ):
+        raise ValueError(f"unknown scenario columns: {', '.join(sorted(unknown))}")
+    if( 'mass' not in columns ):
+        raise ValueError("scenario has no mass column")
+
+    count = len(columns['mass'])
+    values = {}
+    for name, default in COLUMNS.items():
+        if( name in columns ):
+            try:
+                values[name] = np.asarray(columns[name], dtype=bool if name == 'sun' else np.float64)
+            except (TypeError, ValueError):
+                raise ValueError(f"scenario column {name} must hold a number for every body") from None
+            if( values[name].shape != (count,) ):
+                raise ValueError(f"scenario column {name} has {len(values[name])} values, expected {count}")
+        else:
+            values[name] = np.full(count, default, dtype=bool if name == 'sun' else np.float64)
+
+    mass = values['mass']
+    if( not np.all(np.isfinite(mass)) or np.any(mass < 0) ):
+        raise ValueError("scenario masses must be finite and not negative")
+
+    store = simulation.store
+    settings = simulation.settings
+    positions = np.stack((values['x'], values['y']), axis=1)
+    velocities = np.stack((values['vx'], values['vy']), axis=1)
+
+    orbiting = ~np.isnan(values['semi_major_axis'])
+    if( np.any(orbiting) ):
+        eccentricity = values['eccentricity'][orbiting]
+        if( np.any((eccentricity < 0) | (eccentricity >= 1)) or np.any(values['semi_major_axis'][orbiting] <= 0) ):
+            raise ValueError("orbital elements must describe bound orbits, 0 <= eccentricity < 1 and semi_major_axis > 0")
+
+        # Central body, a sun placed by its state vector in the scenario or one already simulated
+        own_suns = np.flatnonzero(values['sun'] & ~orbiting)
+        if( len(own_suns) ):
+            center = own_suns[-1]
+            central = (positions[center], velocities[center], mass[center])
+        else:
+            suns = np.flatnonzero(store.sun)
+            if( not len(suns) ):
+                raise ValueError("orbital elements need a sun to orbit")
+            center = suns[-1]
+            central = (store.position[center], store.velocity[center], store.mass[center])
+
+        direction = values['direction'][orbiting]
+        elements = {
+            'semi_major_axis': values['semi_major_axis'][orbiting] * settings.AU,
+            'eccentricity': eccentricity,
+            'periapsis': np.radians(values['periapsis'][orbiting]),
+            'direction': np.where(direction < 0, -1.0, 1.0),
+        }
+        mu = settings.G * (central[2] + mass[orbiting])
+        relative_positions, relative_velocities = elements_to_state(elements, np.radians(values['mean_anomaly'][orbiting]), mu)
+        positions[orbiting] = relative_positions + central[0]
+        velocities[orbiting] = relative_velocities + central[1]
+
+    # Bodies without a tag are named after their id when the tag is first read ( see bodystore.default_tag )
+    start = len(store)
+    tags = columns.get('tag')
+    if( tags is None ):
+        tags = []
+    else:
+        tags = np.asarray(tags)
+        # Text columns are strings already, anything else is converted one tag at a time
+        if( tags.dtype.kind == 'U' ):
+            tags = tags.tolist()
+        else:
+            tags = [None if tag is None else str(tag) for tag in tags.tolist()]
+    if( len(tags) not in (0, count) ):
+        raise ValueError(f"scenario column tag has {len(tags)} values, expected {count}")
+    if( not tags ):
+        tags = None
+    elif( "" in tags ):
+        tags = [tag if tag else None for tag in tags]
+
+    store.extend(positions, velocities, mass, values['radius'], tags, values['sun'])
+    simulation.update_distance_to_sun()
+    return range(start, start + count)
+
+
+def load_scenario(path, simulation):
+    # Add the bodies of a scenario file to simulation, returns range of their store indices
+    return add_scenario(simulation, read_scenario(path))
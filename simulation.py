@@ -0,0 +1,502 @@
+import argparse
+import math
+import time
+import numpy as np
+from bodystore import BodyList, BodyStore
+from checkpoint import load_checkpoint, save_checkpoint
+from collisions import CollisionDetector, merge_groups
+from diagnostics import Diagnostics
+from gravity import accelerations, compute_accelerations, potential_energy
+from integrators import make_integrator
+from kepler import time_warp
+from particles import ParticleSet, belt
+from scenario import add_scenario, read_scenario
+from vector import Vector2
+
+
+# Mass of the sun in kg
+SUN_MASS = 1.98892 * 10**30
+
+# Preset planets of our solar system
+# ( name, semi-major axis in AU, eccentricity, mass in kg, visual radius, start angle in degrees, start at perihelion )
+PLANET_PRESETS = (
+    ("Earth", 1.000, 0.0167, 5.9742e24, 15, 90, False),
+    ("Mercury", 0.387, 0.2056, 3.30e23, 10, 0, True),
+    ("Venus", 0.723, 0.0068, 4.8685e24, 10, 45, False),
+    ("Mars", 1.524, 0.0934, 6.39e23, 15, 135, True),
+    ("Jupiter", 5.203, 0.0489, 1.898e27, 40, 180, False),
+    ("Saturn", 9.537, 0.0539, 5.683e26, 35, 225, False),
+)
+
+
+# Object for Simulation Settings and Constants
+class SimulationSettings():
+    def __init__(self):
+        # Astronomical Units ( converted to meters )
+        self.AU = 149.6e6 * 1000
+        # Gravitational Constant
+        self.G = 6.67428e-11
+        # Zoom Factor
+        self.zoom = 1.0
+        # pixels per AU
+        self.base_pixels_per_au = 200
+        # 1 day time step
+        self.TIMESTEP = 3600*24
+        # simulation speed in simulated days per second
+        self.DAYS_PER_SECOND = 20
+        # rendered frames per second
+        self.FPS = 60
+        # fixed number of physics steps per rendered frame, 0 to follow DAYS_PER_SECOND
+        self.STEPS_PER_FRAME = 0
+        # most physics steps run for one rendered frame
+        self.MAX_STEPS_PER_FRAME = 5000
+        # share of each frame that may be spent on physics
+        self.PHYSICS_BUDGET = 0.75
+        # longest wall time in seconds the physics catches up on when it falls behind
+        self.MAX_CATCHUP = 0.25
+        # points kept in each orbit trail
+        self.TRAIL_CAPACITY = 4096
+        # pixels travelled at zoom 1.0 between stored orbit trail points
+        self.TRAIL_SPACING = 2.0
+        # degrees turned that also stores an orbit trail point
+        self.TRAIL_ANGLE = 5.0
+        # most orbit trail points sent to the canvas per orbit line
+        self.MAX_TRAIL_POINTS = 400
+        # planets with a smaller radius in pixels are drawn as single points
+        self.SUBPIXEL_RADIUS = 0.5
+        # gravity solver, "direct" ( exact, O(N^2) ) or "barnes_hut" ( approximate, O(N log N) )
+        self.solver = "direct"
+        # Barnes-Hut opening angle, smaller is more accurate and slower
+        self.theta = 0.5
+        # integrator, "euler", "leapfrog", "verlet", "yoshida4" or "block" ( adaptive per body timesteps )
+        self.integrator = "leapfrog"
+        # accuracy of the block timestep integrator, smaller takes smaller steps
+        self.block_eta = 0.05
+        # deepest block level, the smallest step is TIMESTEP / 2^max_block_level
+        self.max_block_level = 12
+        # time warp propagates analytically while no body is perturbed by more than this share of the sun's pull
+        self.KEPLER_THRESHOLD = 1e-3
+        # simulated seconds between perturbation checks during a time warp
+        self.WARP_SEGMENT = 365.25 * 3600 * 24
+        # asteroids added by the asteroid belt button and their range of semi-major axes in AU
+        self.ASTEROID_COUNT = 100000
+        self.ASTEROID_INNER_AU = 2.2
+        self.ASTEROID_OUTER_AU = 3.2
+        # wall seconds between autosaved checkpoints
+        self.CHECKPOINT_INTERVAL = 5.0
+        # file autosaved checkpoints are written to
+        self.CHECKPOINT_PATH = "autosave.orbit"
+        # frames the profiler's rolling timing histograms cover
+        self.PROFILE_WINDOW = 240
+        # most profiler events kept for a trace export
+        self.TRACE_EVENTS = 200000
+        # wall seconds between refreshes of the performance HUD
+        self.HUD_INTERVAL = 0.25
+        # lower rendering quality while rendering takes longer than its share of FRAME_TARGET_MS
+        self.ADAPTIVE_QUALITY = True
+        # wall milliseconds a frame should take, rendering gets what PHYSICS_BUDGET leaves, 0 for one frame interval of FPS
+        self.FRAME_TARGET_MS = 0
+        # simulated seconds between samples of energy and momentum, 0 to switch sampling off
+        self.DIAGNOSTICS_INTERVAL = 10 * 3600 * 24
+        # relative energy error that raises an alert
+        self.ENERGY_ALERT = 1e-4
+        # diagnostics samples kept for the time series
+        self.DIAGNOSTICS_SAMPLES = 10000
+        # merge bodies that touch, off here so batched runs match single ones, the window switches it on
+        self.collisions = False
+        # density in kg/m^3 that gives every body its physical radius for collisions, drawn sizes play no part
+        self.COLLISION_DENSITY = 3000
+        # unbound bodies further than this many AU from the sun count as escaped
+        self.ESCAPE_DISTANCE_AU = 100
+
+    @property
+    def SCALE(self):
+        return (self.base_pixels_per_au * self.zoom / self.AU)
+
+
+def orbital_state(settings, semi_major_axis_au, eccentricity, start_angle_deg=0, at_perihelion=True, central_mass=SUN_MASS):
+
+    """
+    Position and velocity of a body on a keplerian orbit around the sun
+
+    semi_major_axis_au: length of Semi-major axis in AU
+    eccentricity: orbital eccentricity (0=circular)
+    start_angle_deg: starting angular position (0 degrees = positive x axis)
+    at_perihelion: true if starting at closest point to sun
+
+    Returns ( position, velocity ) as Vector2 in meters and m/s
+    """
+
+    a = semi_major_axis_au * settings.AU # Convert to meters
+
+    if at_perihelion:
+        # Perihelion distance = a(1-e)
+        distance = a * (1 - eccentricity)
+    else:
+        # Aphelion distance = a(1+e)
+        distance = a * (1 + eccentricity)
+
+    # speed from vis-viva equation: v squared = GM(2/r - 1/a)
+    speed = math.sqrt(settings.G * central_mass * (2/distance - 1/a))
+
+    angle = math.radians(start_angle_deg)
+    position = Vector2(distance * math.cos(angle), distance * math.sin(angle))
+
+    # Tangiental velocity ( perpendicular to radius )
+    velocity = Vector2(-speed * math.sin(angle), speed * math.cos(angle))
+
+    return position, velocity
+
+
+class Simulation:
+
+    """
+    Headless simulation core
+
+    Owns the state of every body and the simulation settings and advances them
+    without any GUI. The tkinter front end in main.py only draws this state.
+    """
+
+    def __init__(self, settings=None) -> None:
+        self.settings = settings if settings is not None else SimulationSettings()
+        # State of every body, kept in typed arrays
+        self.store = BodyStore()
+        # Simulated time in seconds
+        self.time = 0.0
+        # Number of steps taken
+        self.steps = 0
+        self._integrator = None
+        # Optional TrajectoryRecorder, records a frame after every call to step
+        self.recorder = None
+        # Massless test particles, moved by the bodies but not pulling on them
+        self.particles = ParticleSet()
+        # ( time, tag of the merged body, tags of the bodies it absorbed ) of every collision
+        self.merges = []
+        self.collision_detector = CollisionDetector()
+        # Optional Diagnostics, samples the conserved quantities after a call to step
+        self.diagnostics = None
+        # Potential energy of the last force evaluation and the positions it was computed at
+        self._potential = None
+        self._track_potential = False
+
+    @property
+    def bodies(self):
+        return BodyList(self.store)
+
+    def add_body(self, position: Vector2, velocity: Vector2, mass, radius, tag, sun=False):
+        return self.store.handle(self.store.add(position, velocity, mass, radius, tag, sun))
+
+    def remove_body(self, body):
+        if( body.store is self.store and body.index is not None ):
+            self.store.remove(body.index)
+
+    def remove_bodies(self, selection):
+        # Remove the bodies selected by a boolean mask or an index array in one pass, returns their ids
+        return self.store.remove_many(selection)
+
+    def escaped(self):
+
+        # Mask of the bodies leaving for good: unbound from the sun and further than ESCAPE_DISTANCE_AU
+        store = self.store
+        suns = np.flatnonzero(store.sun)
+        if( not len(suns) ):
+            return np.zeros(len(store), dtype=bool)
+        sun = suns[-1]
+        offset = store.position - store.position[sun]
+        relative_velocity = store.velocity - store.velocity[sun]
+        distance = np.hypot(offset[:, 0], offset[:, 1])
+        kinetic = 0.5 * np.einsum('ij,ij->i', relative_velocity, relative_velocity)
+        with np.errstate(divide='ignore'):
+            specific_energy = kinetic - self.settings.G * (store.mass[sun] + store.mass) / distance
+        return (distance > self.settings.ESCAPE_DISTANCE_AU * self.settings.AU) & (specific_energy > 0) & ~store.sun
+
+    def spawn_sun(self):
+        return self.add_body(Vector2(0, 0), Vector2(0, 0), SUN_MASS, 10, "Sun", sun=True)
+
+    def add_planet(self, name, semi_major_axis_au, eccentricity, mass, radius, start_angle_deg=0, at_perihelion=True):
+        position, velocity = orbital_state(self.settings, semi_major_axis_au, eccentricity, start_angle_deg, at_perihelion)
+        return self.add_body(position, velocity, mass, radius, name)
+
+    def spawn_planets(self):
+        return [self.add_planet(*preset) for preset in PLANET_PRESETS]
+
+    def add_asteroid_belt(self, count, inner_au, outer_au, max_eccentricity=0.1, rng=None):
+
+        # Add count test particles on orbits around the sun with semi-major axes between inner_au and outer_au
+        sun = np.flatnonzero(self.store.sun)
+        if( not len(sun) ):
+            raise ValueError("an asteroid belt needs a sun to orbit")
+        sun = sun[-1]
+        positions, velocities = belt(self.settings, count, inner_au, outer_au, self.store.mass[sun], max_eccentricity, rng)
+        self.particles.add(positions + self.store.position[sun], velocities + self.store.velocity[sun])
+
+    def step(self, n=1):
+
+        """
+        Advance the simulation by n timesteps
+
+        Works in place on the arrays of the body store with the integrator selected
+        in the settings, so large n runs entirely inside numpy. With diagnostics
+        attached the steps are split so a sample lands on every interval.
+        """
+
+        if( n <= 0 ):
+            return
+
+        dt = self.settings.TIMESTEP
+        diagnostics = self.diagnostics
+        # The first sample is the starting state every error is measured against
+        if( diagnostics is not None and diagnostics.enabled and diagnostics.next_time is None ):
+            diagnostics.sample(self)
+
+        while( n > 0 ):
+            chunk = n
+            if( diagnostics is not None and diagnostics.enabled and diagnostics.next_time is not None ):
+                chunk = min(n, max(1, math.ceil((diagnostics.next_time - self.time) / dt - 1e-9)))
+            # The last force evaluation of a chunk that ends on a sample also sums the potential
+            sample = diagnostics is not None and diagnostics.due(self.time + chunk * dt)
+            self._advance(chunk, sample)
+            if( sample ):
+                diagnostics.record(self)
+            n -= chunk
+
+        self.update_distance_to_sun()
+
+        if( self.recorder is not None ):
+            self.recorder.record(self)
+
+    def _advance(self, n, sample=False):
+
+        # Run n integrator steps, tracking the potential energy in the last one if sample
+        dt = self.settings.TIMESTEP
+
+        if( len(self.store) ):
+            integrator = self.integrator
+            positions = self.store.position
+            velocities = self.store.velocity
+            masses = self.store.mass
+
+            particles = self.particles
+            G = self.settings.G
+
+            collisions = self.settings.collisions
+
+            for i in range(n):
+                self._track_potential = sample and i == n - 1
+                before = positions.copy() if( collisions or len(particles) ) else None
+                integrator.step(positions, velocities, masses, dt)
+                if( len(particles) ):
+                    particles.step(before, positions, masses, G, dt)
+
+                # Bodies that touched anywhere along the step merge, a fast body can not pass through another unseen
+                if( collisions ):
+                    merges = self.resolve_collisions(before)
+                    if( merges ):
+                        # Merged bodies left the store, the arrays are shorter now
+                        self.merges.extend((self.time + (i + 1) * dt, survivor, absorbed) for survivor, absorbed in merges)
+                        positions = self.store.position
+                        velocities = self.store.velocity
+                        masses = self.store.mass
+            self._track_potential = False
+
+        self.time += n * dt
+        self.steps += n
+
+    def resolve_collisions(self, previous=None):
+
+        """
+        Merge every group of bodies that touch
+
+        Bodies touch when their physical radii, which follow from their mass and
+        settings.COLLISION_DENSITY ( see collisions.collision_radii ), overlap.
+        With previous, the positions at the start of the step just taken, bodies
+        that came that close anywhere along their straight paths from there
+        touch as well ( see collisions.search ).
+        Merges are perfectly inelastic: the group becomes its most massive member
+        ( a sun if there is one ) at the group's center of mass, with the summed
+        mass and momentum. The drawn radius grows so the summed volume of the
+        group is kept, except for suns, which keep their size.
+
+        Returns a list of ( tag of the merged body, tags of the absorbed bodies )
+        """
+
+        store = self.store
+        i, j = self.collision_detector.find(store, self.settings, previous)
+        if( not len(i) ):
+            return []
+
+        labels = merge_groups(len(store), i, j)
+        involved = np.unique(np.concatenate((i, j)))
+        group = labels[involved]
+        mass = store.mass[involved]
+
+        # First member of every group after sorting is the survivor: suns first, then the heaviest
+        order = np.lexsort((-mass, ~store.sun[involved], group))
+        sorted_group = group[order]
+        first = np.flatnonzero(np.r_[True, sorted_group[1:] != sorted_group[:-1]])
+        survivors = involved[order[first]]
+        slot = np.searchsorted(sorted_group[first], group)
+        groups = len(first)
+
+        total_mass = np.bincount(slot, mass, groups)
+        position = store.position[involved]
+        velocity = store.velocity[involved]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            center = np.stack([np.bincount(slot, mass * position[:, k], groups) for k in (0, 1)], axis=1) / total_mass[:, None]
+            momentum = np.stack([np.bincount(slot, mass * velocity[:, k], groups) for k in (0, 1)], axis=1) / total_mass[:, None]
+        # Massless groups stay where their survivor was
+        massless = ~(total_mass > 0)
+        center[massless] = store.position[survivors[massless]]
+        momentum[massless] = store.velocity[survivors[massless]]
+
+        volume = np.bincount(slot, store.radius[involved].astype(np.float64) ** 3, groups)
+        sun = store.sun[survivors]
+
+        store.position[survivors] = center
+        store.velocity[survivors] = momentum
+        store.mass[survivors] = total_mass
+        store.radius[survivors] = np.where(sun, store.radius[survivors], np.cbrt(volume))
+
+        absorbed = np.setdiff1d(involved, survivors, assume_unique=True)
+        absorbed_slot = slot[np.searchsorted(involved, absorbed)]
+        merges = [(store.tag(survivor), []) for survivor in survivors.tolist()]
+        for index, k in zip(absorbed.tolist(), absorbed_slot.tolist()):
+            merges[k][1].append(store.tag(index))
+
+        store.remove_many(absorbed)
+        return merges
+
+    @property
+    def integrator(self):
+
+        # Integrator selected in the settings, rebuilt when the selection changes
+        if( self._integrator is None or self._integrator.name != self.settings.integrator ):
+            self._integrator = make_integrator(self.settings.integrator, self.accelerations, self.settings)
+        return self._integrator
+
+    def accelerations(self, positions, masses):
+        if( self._track_potential and self.settings.solver == "direct" ):
+            acceleration, potential = accelerations(positions, masses, self.settings.G, potential=True)
+            self._potential = (positions.copy(), potential)
+            return acceleration
+        return compute_accelerations(positions, masses, self.settings)
+
+    def last_potential(self):
+        # Potential energy of the current positions if the last force evaluation computed it, else None
+        if( self._potential is None ):
+            return None
+        positions, potential = self._potential
+        current = self.store.position
+        if( positions.shape != current.shape or not np.array_equal(positions, current) ):
+            return None
+        return potential
+
+    def total_energy(self):
+
+        # Kinetic plus potential energy of every body in joules
+        velocities = self.store.velocity
+        kinetic = 0.5 * np.dot(self.store.mass, np.einsum('ij,ij->i', velocities, velocities))
+        return kinetic + potential_energy(self.store.position, self.store.mass, self.settings.G)
+
+    def momentum(self):
+        # Total linear momentum ( px, py ) in kg m/s
+        return tuple(np.dot(self.store.mass, self.store.velocity).tolist())
+
+    def angular_momentum(self):
+        # Total angular momentum about the origin in kg m^2/s
+        position, velocity = self.store.position, self.store.velocity
+        return float(np.dot(self.store.mass, position[:, 0] * velocity[:, 1] - position[:, 1] * velocity[:, 0]))
+
+    def run_until(self, t):
+
+        # Step until simulated time reaches t seconds ( whole timesteps only )
+        remaining = t - self.time
+        if( remaining <= 0 ):
+            return
+        self.step(math.ceil(remaining / self.settings.TIMESTEP - 1e-9))
+
+    def update_distance_to_sun(self):
+
+        # Distance from every planet to the sun
+        sun = self.store.sun
+        if( not np.any(sun) ):
+            return
+        sun_position = self.store.position[np.flatnonzero(sun)[-1]]
+        planets = ~sun
+        self.store.distance_to_sun[planets] = np.hypot(*(self.store.position[planets] - sun_position).T)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run the orbit simulation without a GUI")
+    parser.add_argument("--years", type=float, default=10, help="simulated years to run")
+    parser.add_argument("--integrator", default="leapfrog", help="euler, leapfrog, verlet, yoshida4 or block")
+    parser.add_argument("--timestep", type=float, default=1, help="timestep in days")
+    parser.add_argument("--record", default=None, help="record the trajectory to this file, it can be replayed in the GUI")
+    parser.add_argument("--record-every", type=int, default=1, help="steps between recorded frames")
+    parser.add_argument("--resume", default=None, help="continue from a checkpoint instead of spawning the planets")
+    parser.add_argument("--checkpoint", default=None, help="save a checkpoint to this file when done")
+    parser.add_argument("--warp", action="store_true", help="jump ahead analytically while orbits are unperturbed")
+    parser.add_argument("--scenario", default=None, help="load the bodies of a .csv, .json or .npz scenario file instead of the planets")
+    parser.add_argument("--diagnostics", type=float, default=0, help="days between energy and momentum samples, 0 for none")
+    args = parser.parse_args()
+
+    simulation = Simulation()
+    simulation.settings.integrator = args.integrator
+    simulation.settings.TIMESTEP = args.timestep * 3600 * 24
+    if( args.resume ):
+        load_checkpoint(args.resume, simulation)
+        simulation.settings.integrator = args.integrator
+        simulation.settings.TIMESTEP = args.timestep * 3600 * 24
+    elif( args.scenario ):
+        columns = read_scenario(args.scenario)
+        # Orbital elements need a sun, the scenario brings its own or gets ours
+        if( 'sun' not in columns or not np.any(columns['sun']) ):
+            simulation.spawn_sun()
+        start = time.perf_counter()
+        added = add_scenario(simulation, columns)
+        print(f"{len(added)} bodies added in {time.perf_counter() - start:.3f} s")
+    else:
+        simulation.spawn_sun()
+        simulation.spawn_planets()
+
+    if( args.diagnostics > 0 ):
+        settings = simulation.settings
+        simulation.diagnostics = Diagnostics(args.diagnostics * 3600 * 24, settings.ENERGY_ALERT, settings.DIAGNOSTICS_SAMPLES)
+
+    end = simulation.time + args.years * 365.25 * 24 * 3600
+    first_step = simulation.steps
+    start = time.perf_counter()
+    if( args.record ):
+        from recording import TrajectoryRecorder
+        simulation.recorder = TrajectoryRecorder(args.record, simulation.settings)
+        simulation.recorder.record(simulation)
+        while( simulation.time < end - 1e-9 * simulation.settings.TIMESTEP ):
+            simulation.step(args.record_every)
+        simulation.recorder.close()
+    elif( args.warp ):
+        result = time_warp(simulation, end)
+        print(f"{result['kepler_time'] / (365.25 * 24 * 3600):.1f} years propagated analytically")
+    else:
+        simulation.run_until(end)
+    elapsed = time.perf_counter() - start
+
+    steps = simulation.steps - first_step
+    print(f"{steps} steps in {elapsed:.3f} s ( {steps / elapsed:.0f} steps/s )")
+    # Large scenarios only list their first bodies
+    for body in simulation.bodies[:20]:
+        print(f"{body.tag}: ( {body.real_position.x / simulation.settings.AU:.3f} , {body.real_position.y / simulation.settings.AU:.3f} ) AU")
+    if( len(simulation.bodies) > 20 ):
+        print(f"... and {len(simulation.bodies) - 20} more")
+
+    if( simulation.diagnostics is not None ):
+        _, error = simulation.diagnostics.series('energy_error')
+        _, angular_momentum = simulation.diagnostics.series('angular_momentum')
+        print(f"{len(simulation.diagnostics)} diagnostics samples, largest relative energy error {error.max():.3e}")
+        print(f"angular momentum changed by {abs(angular_momentum[-1] - angular_momentum[0]) / abs(angular_momentum[0]):.3e}")
+        for t, alert_error in simulation.diagnostics.alerts:
+            print(f"ALERT energy error {alert_error:.3e} at {t / (365.25 * 24 * 3600):.2f} years")
+
+    if( args.checkpoint ):
+        save_checkpoint(args.checkpoint, simulation)
+        print(f"checkpoint saved to {args.checkpoint}")
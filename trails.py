@@ -0,0 +1,276 @@
+import math
+import numpy as np
+
+
+class TrailBuffer:
+
+    """
+    Fixed capacity ring buffer of orbit trail points in world coordinates ( meters )
+
+    Points are decimated as they come in, a new point is only stored once the
+    body is `spacing` meters away from the last stored point or its path turned
+    by more than `angle` degrees since the last stored segment, so slow and fast
+    bodies get evenly spaced trails. When the buffer is full the oldest point is
+    overwritten.
+
+    Trails are kept in meters so they stay valid when the zoom changes, the
+    renderer projects them onto the screen when drawing.
+
+    A closed orbit is detected by summing the angle swept around a center point
+    ( the sun ) between stored points. Each time a full turn is completed the
+    trail is limited to the points stored during that last revolution, which
+    stays correct for eccentric and precessing orbits where the body never
+    returns exactly to its start.
+
+    Trails of many bodies are offered points together through a TrailSet.
+    """
+
+    def __init__(self, capacity=4096, spacing=3e8, angle=5.0) -> None:
+        # Allocated when the first point is stored, most bodies of large systems never get a trail
+        self.points = None
+        self.capacity = capacity
+        self.spacing = spacing
+        self.angle = math.radians(angle)
+        # TrailSet holding this trail and its slot there, told when the trail is reset
+        self.owner = None
+        self.slot = None
+        self.clear()
+
+    def clear(self):
+        # Index the next point is written to
+        self.head = 0
+        self.count = 0
+        # Closed orbit detection
+        self._swept = 0.0
+        self._stored_total = 0
+        self._revolution_start = 0
+        # Number of points in one revolution, None until a full turn has been seen
+        self.revolution = None
+        if( self.owner is not None ):
+            self.owner.reset(self)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def closed(self):
+        return self.revolution is not None
+
+    def _stored(self, back):
+        # Point stored `back` points before the latest one
+        return self.points[(self.head - 1 - back) % self.capacity]
+
+    @property
+    def anchor(self):
+        # Latest stored point, None while the trail is empty
+        return tuple(self._stored(0).tolist()) if self.count else None
+
+    @property
+    def direction(self):
+        # Last stored segment, None until two points are stored
+        return tuple((self._stored(0) - self._stored(1)).tolist()) if self.count >= 2 else None
+
+    def append(self, x, y, center_x=0.0, center_y=0.0):
+
+        # Offer a new trail point, returns True if it was stored
+        if( self.count ):
+            last_x, last_y = self._stored(0)
+            dx, dy = x - last_x, y - last_y
+            turned = 0.0
+            direction = self.direction
+            if( direction is not None and (dx or dy) ):
+                turned = abs(math.atan2(direction[0] * dy - direction[1] * dx, direction[0] * dx + direction[1] * dy))
+            if( math.hypot(dx, dy) < self.spacing and turned < self.angle ):
+                return False
+
+        self.store(x, y, center_x, center_y)
+        return True
+
+    def store(self, x, y, center_x=0.0, center_y=0.0):
+
+        # Store a point whatever its distance to the last one, tracking the angle swept around the center
+        if( self.count ):
+            last_x, last_y = self._stored(0)
+            ax, ay = last_x - center_x, last_y - center_y
+            bx, by = x - center_x, y - center_y
+            self._swept += math.atan2(ax * by - ay * bx, ax * bx + ay * by)
+
+        if( self.points is None ):
+            self.points = np.zeros((self.capacity, 2), dtype=np.float64)
+        self.points[self.head] = (x, y)
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self._stored_total += 1
+
+        # A full turn around the center closes the orbit
+        if( abs(self._swept) >= 2 * math.pi ):
+            self.revolution = self._stored_total - self._revolution_start
+            self._revolution_start = self._stored_total
+            self._swept -= math.copysign(2 * math.pi, self._swept)
+
+    def visible(self):
+
+        # Stored points to draw, oldest first, limited to one revolution once the orbit closed
+        if( not self.count ):
+            return np.zeros((0, 2))
+        length = self.count
+        if( self.revolution is not None ):
+            length = min(length, self.revolution + 1)
+        start = (self.head - length) % self.capacity
+        if( start + length <= self.capacity ):
+            return self.points[start:start + length]
+        return np.concatenate((self.points[start:], self.points[:self.head]))
+
+    def thinned(self, max_points=400, current=None):
+
+        # At most max_points + 1 points to draw, ending at the current ( x, y ) position of the body if given
+        points = self.visible()
+        if( len(points) > max_points ):
+            # Keep the newest point, thin out older ones evenly
+            stride = math.ceil(len(points) / max_points)
+            points = points[::-1][::stride][::-1]
+        if( current is not None and len(points) and tuple(points[-1]) != tuple(current) ):
+            points = np.concatenate((points, [current]))
+        return points
+
+    def restore(self, points, revolution=None):
+
+        # Refill the trail with saved points, oldest first ( see visible )
+        self.clear()
+        points = np.asarray(points, dtype=np.float64)[-self.capacity:]
+        if( not len(points) ):
+            return
+        self.points = np.zeros((self.capacity, 2), dtype=np.float64)
+        self.points[:len(points)] = points
+        self.count = len(points)
+        self.head = len(points) % self.capacity
+        self._stored_total = len(points)
+        self._revolution_start = len(points)
+        self.revolution = revolution
+        if( self.owner is not None ):
+            self.owner.reset(self)
+
+
+class TrailSet:
+
+    """
+    Offers points to many TrailBuffers in one vectorized step
+
+    The latest stored point and last stored segment of every trail are mirrored
+    in arrays, so deciding which trails take this frame's point costs a few
+    numpy operations whatever the number of trails, with the same rule as
+    TrailBuffer.append. Only the trails that store a point are touched one by one.
+
+    Trails sit in slots, removing one moves the last trail into its slot. A
+    trail that is cleared or restored updates its row itself.
+    """
+
+    # Per trail arrays, moved together when trails are removed
+    FIELDS = ('_anchor', '_direction', '_spacing', '_angle', '_anchored', '_turning')
+
+    def __init__(self, capacity=16) -> None:
+        self.trails = []
+        self._anchor = np.zeros((capacity, 2), dtype=np.float64)
+        self._direction = np.zeros((capacity, 2), dtype=np.float64)
+        self._spacing = np.zeros(capacity, dtype=np.float64)
+        self._angle = np.zeros(capacity, dtype=np.float64)
+        # Whether the trail has a stored point, and a stored segment
+        self._anchored = np.zeros(capacity, dtype=bool)
+        self._turning = np.zeros(capacity, dtype=bool)
+
+    def __len__(self):
+        return len(self.trails)
+
+    def append(self, trail):
+
+        slot = len(self.trails)
+        if( slot == len(self._spacing) ):
+            for name in self.FIELDS:
+                old = getattr(self, name)
+                new = np.zeros((len(old) * 2,) + old.shape[1:], dtype=old.dtype)
+                new[:slot] = old[:slot]
+                setattr(self, name, new)
+        self.trails.append(trail)
+        trail.owner = self
+        trail.slot = slot
+        self._spacing[slot] = trail.spacing
+        self._angle[slot] = trail.angle
+        self.reset(trail)
+
+    def reset(self, trail):
+
+        # Copy the latest stored point and segment of trail into its row
+        anchor, direction = trail.anchor, trail.direction
+        self._anchored[trail.slot] = anchor is not None
+        self._turning[trail.slot] = direction is not None
+        if( anchor is not None ):
+            self._anchor[trail.slot] = anchor
+        if( direction is not None ):
+            self._direction[trail.slot] = direction
+
+    def remove(self, trail):
+
+        # Remove one trail, the last trail moves into its slot
+        slot, last = trail.slot, len(self.trails) - 1
+        if( slot != last ):
+            for name in self.FIELDS:
+                array = getattr(self, name)
+                array[slot] = array[last]
+            moved = self.trails[last]
+            self.trails[slot] = moved
+            moved.slot = slot
+        self.trails.pop()
+        trail.owner = None
+        trail.slot = None
+
+    def keep(self, mask):
+
+        # Keep the trails mask is true for in one pass, the others move down and keep their order
+        mask = np.asarray(mask, dtype=bool)
+        kept = int(np.count_nonzero(mask))
+        for name in self.FIELDS:
+            array = getattr(self, name)
+            array[:kept] = array[:len(mask)][mask]
+        for trail, alive in zip(self.trails, mask.tolist()):
+            if( not alive ):
+                trail.owner = None
+                trail.slot = None
+        self.trails = [trail for trail, alive in zip(self.trails, mask.tolist()) if alive]
+        for slot, trail in enumerate(self.trails):
+            trail.slot = slot
+
+    def offer(self, positions, active, center_x=0.0, center_y=0.0):
+
+        """
+        Offer every trail a new point
+
+        positions: ( N, 2 ) array of points in meters, one per slot
+        active: ( N, ) boolean array, only these trails are offered their point
+
+        Returns the number of trails that stored a point
+        """
+
+        n = len(self.trails)
+        anchored = self._anchored[:n]
+        delta = positions - self._anchor[:n]
+        far = np.einsum('ij,ij->i', delta, delta) >= self._spacing[:n] ** 2
+
+        # Angle between the last stored segment and the way to the new point
+        direction = self._direction[:n]
+        turned = np.abs(np.arctan2(
+            direction[:, 0] * delta[:, 1] - direction[:, 1] * delta[:, 0],
+            direction[:, 0] * delta[:, 0] + direction[:, 1] * delta[:, 1]
+        ))
+        moved = (delta[:, 0] != 0) | (delta[:, 1] != 0)
+        turning = self._turning[:n] & moved & (turned >= self._angle[:n])
+
+        due = np.flatnonzero(active & (~anchored | far | turning))
+        for slot, (x, y) in zip(due.tolist(), positions[due].tolist()):
+            self.trails[slot].store(x, y, center_x, center_y)
+
+        # Rows of the trails that stored a point, as reset would set them
+        self._direction[due] = np.where(anchored[due, None], delta[due], self._direction[due])
+        self._turning[due] |= anchored[due]
+        self._anchor[due] = positions[due]
+        self._anchored[due] = True
+        return len(due)
@@ -0,0 +1,47 @@
+import math
+
+
+# Custom Vector2 Class
+class Vector2:
+    def __init__(self, x, y) -> None:
+        self.x, self.y = x, y
+
+    def __eq__(self, other) -> bool:
+        return self.x == other.x and self.y == other.y
+
+    def __ne__(self,other) -> bool:
+        return not self.__eq__(other)
+
+    def __add__(self, other):
+        return Vector2(self.x + other.x, self.y + other.y)
+
+    def __iadd__(self, other):
+        if isinstance(other, Vector2):
+            self.x += other.x
+            self.y += other.y
+            return self
+        if isinstance(other, (int, float)):
+            self.x += other
+            self.y += other
+            return self
+
+    def __sub__(self, other):
+        return Vector2(self.x - other.x, self.y - other.y)
+
+    def __mul__(self, other):
+        if isinstance(other, Vector2):
+            return Vector2(self.x * other.x, self.y * other.y)
+        if isinstance(other, (int, float)):
+            return Vector2(self.x * other, self.y * other)
+
+    def __truediv__(self, other):
+        if isinstance(other, Vector2):
+            return Vector2(self.x / other.x, self.y / other.y)
+        if isinstance(other, (int, float)):
+            return Vector2(self.x / other, self.y / other)
+
+    def __repr__(self) -> str:
+        return f"({self.x}, {self.y})"
+
+    def distance_to(self, other):
+        return math.sqrt((other.x - self.x) ** 2 + (other.y - self.y) ** 2)
@@ -0,0 +1,520 @@
+import multiprocessing
+import queue
+import time
+import traceback
+import numpy as np
+from multiprocessing import shared_memory
+from bodystore import BodyStore
+from checkpoint import restore, snapshot
+from diagnostics import Diagnostics
+from gameloop import FrameScheduler
+from kepler import time_warp
+from scenario import load_scenario
+from simulation import Simulation
+from vector import Vector2
+
+
+# Slots of the header of a SharedState: frame last published, frame the GUI reads, frames published
+_LATEST, _READING, _PUBLISHED = range(3)
+_HEADER_BYTES = 64
+
+# Values describing a frame, kept in its meta array in this order
+META = ('count', 'particles', 'layout', 'next_id', 'time', 'steps', 'steps_per_second', 'commands')
+
+# Seconds the GUI waits for the worker to stop before the process is terminated
+STOP_TIMEOUT = 5.0
+
+
+def _aligned(size):
+    # Round a byte size up to whole cache lines
+    return -(-size // 64) * 64
+
+
+class SharedState:
+
+    """
+    Two frames of simulation state in one shared memory block
+
+    A frame holds every BodyStore array and the test particles, so the GUI
+    can use the arrays of a frame as its own store without copying anything.
+    The worker writes a frame into the buffer that is neither the latest one
+    nor the one the GUI reads, then publishes it by flipping `latest` in the
+    header. The GUI holds on to the buffer it read last until it takes the
+    next one, so the frame it draws never changes under it. While the GUI
+    still reads the older buffer the worker keeps stepping but skips
+    publishing, at most one frame is waiting for the GUI at any time.
+
+    name: None creates a new block, otherwise the block of a SharedState created elsewhere is attached
+    """
+
+    def __init__(self, capacity, particle_capacity, name=None) -> None:
+        self.capacity = capacity
+        self.particle_capacity = particle_capacity
+
+        # Array names, dtypes and shapes of a frame, the body arrays follow the BodyStore
+        template = BodyStore(1)
+        fields = [('meta', np.float64, (len(META),))]
+        for field in BodyStore.FIELDS:
+            array = getattr(template, field)
+            fields.append((field, array.dtype, (capacity,) + array.shape[1:]))
+        fields.append(('particle_position', np.float64, (particle_capacity, 2)))
+        fields.append(('particle_velocity', np.float64, (particle_capacity, 2)))
+        frame_size = sum(_aligned(int(np.prod(shape)) * np.dtype(dtype).itemsize) for _, dtype, shape in fields)
+
+        self.owner = name is None
+        if( self.owner ):
+            self.memory = shared_memory.SharedMemory(create=True, size=_HEADER_BYTES + 2 * frame_size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+
+        self.header = np.ndarray(3, dtype=np.int64, buffer=self.memory.buf)
+        if( self.owner ):
+            self.header[:] = (-1, -1, 0)
+
+        self.frames = []
+        offset = _HEADER_BYTES
+        for _ in range(2):
+            frame = {}
+            for field, dtype, shape in fields:
+                frame[field] = np.ndarray(shape, dtype=dtype, buffer=self.memory.buf, offset=offset)
+                offset += _aligned(frame[field].nbytes)
+            self.frames.append(frame)
+
+    @property
+    def published(self):
+        # Frames published so far
+        return int(self.header[_PUBLISHED])
+
+    def write(self, store, particles, meta):
+
+        # Publish the state of store and particles as the latest frame, False if the GUI holds the free buffer
+        latest = int(self.header[_LATEST])
+        target = 0 if latest < 0 else 1 - latest
+        if( self.header[_READING] == target ):
+            return False
+
+        frame = self.frames[target]
+        count = len(store)
+        for field in BodyStore.FIELDS:
+            frame[field][:count] = getattr(store, field)[:count]
+        frame['particle_position'][:len(particles)] = particles.position
+        frame['particle_velocity'][:len(particles)] = particles.velocity
+        frame['meta'][:] = meta
+
+        self.header[_LATEST] = target
+        self.header[_PUBLISHED] += 1
+        return True
+
+    def acquire(self):
+
+        # Index of the latest frame, the writer leaves it alone until the next acquire. None before the first frame
+        while( True ):
+            latest = int(self.header[_LATEST])
+            if( latest < 0 ):
+                return None
+            self.header[_READING] = latest
+            # The writer may have flipped in between, then the new latest frame is taken instead
+            if( int(self.header[_LATEST]) == latest ):
+                return latest
+
+    def close(self):
+
+        # Drop this process' mapping, views of the frames still in use keep it alive until they go
+        self.frames = None
+        self.header = None
+        try:
+            self.memory.close()
+        except BufferError:
+            pass
+
+    def unlink(self):
+        # Free the block once every process closed it, only done by the process that created it
+        if( self.owner ):
+            self.memory.unlink()
+
+
+class PhysicsWorker:
+
+    """
+    Runs a Simulation in the worker process
+
+    Every loop the FrameScheduler runs the steps owed since the last loop, the
+    state is published into the SharedState and commands of the GUI are taken
+    while waiting for the next loop. A command is a tuple of a name and its
+    arguments, handled by the do_<name> method. Events going back to the GUI
+    are tuples too:
+
+    ( "bodies", layout, ids, tags ): the rows of the bodies changed, published
+        frames are numbered by layout and ids, tags are those of the new bodies
+    ( "sample", row ): a diagnostics sample, see Diagnostics.append
+    ( "grow", bodies, particles ): the state no longer fits the SharedState
+    ( "result", command, value, done ) and ( "error", command, message, done ): a command
+        finished, frames with a commands count of at least done show its effect
+    ( "stopped", ) and ( "failed", traceback ): the worker is done
+    """
+
+    def __init__(self, data, diagnostics, state, commands, events) -> None:
+        self.simulation = Simulation()
+        restore(data, self.simulation)
+        if( diagnostics is not None ):
+            self.simulation.diagnostics = Diagnostics(*diagnostics, on_sample=self.send_sample)
+        self.scheduler = FrameScheduler(self.simulation.settings)
+        self.state = state
+        self.commands = commands
+        self.events = events
+        self.paused = False
+        self.running = True
+        # Commands carried out so far
+        self.done = 0
+        # Number of the current rows of the bodies, and the store and generation it was given for
+        self.layout = 0
+        self._layout_key = None
+        # Tags of bodies with smaller ids were sent already
+        self._sent_id = self.simulation.store.next_id
+        # A larger SharedState was asked for and has not come yet
+        self._growing = False
+        # Meta of the last frame published, nothing is written again while it stays the same
+        self._published = None
+
+    def send(self, *event):
+        self.events.put(event)
+
+    def send_sample(self, diagnostics):
+        self.send('sample', list(diagnostics.latest().values()))
+
+    def run(self):
+
+        # Step, publish and take commands until told to stop
+        while( self.running ):
+            self.scheduler.run_frame(self.simulation.step, paused=self.paused)
+            self.publish()
+            # What the commands changed is shown before the next batch of steps, which may take long
+            if( self.receive(self.scheduler.next_delay() / 1000) ):
+                self.publish()
+        self.send('stopped')
+
+    def receive(self, timeout):
+
+        # Carry out every command that comes in within timeout seconds, returns how many there were
+        done = self.done
+        try:
+            command = self.commands.get(timeout=timeout)
+            while( True ):
+                self.execute(command[0], *command[1:])
+                command = self.commands.get_nowait()
+        except queue.Empty:
+            pass
+        return self.done - done
+
+    def execute(self, name, *args):
+        self.done += 1
+        try:
+            getattr(self, f"do_{name}")(*args)
+        except (OSError, ValueError, KeyError) as e:
+            self.send('error', name, str(e), self.done)
+
+    def publish(self):
+
+        # Write the current state into the shared block, False if it could not be written this time
+        simulation = self.simulation
+        store = simulation.store
+        particles = simulation.particles
+        if( len(store) > self.state.capacity or len(particles) > self.state.particle_capacity ):
+            # The GUI makes a larger block and sends it with attach
+            if( not self._growing ):
+                self._growing = True
+                self.send('grow', len(store), len(particles))
+            return False
+
+        # Tell the GUI about new rows before the first frame that has them
+        if( self._layout_key != (store, store.generation) ):
+            self._layout_key = (store, store.generation)
+            self.layout += 1
+            new = np.flatnonzero(store.ids >= self._sent_id)
+            self.send('bodies', self.layout, store.ids[new], [store.tags[row] for row in new.tolist()])
+            self._sent_id = store.next_id
+
+        meta = (
+            len(store), len(particles), self.layout, store.next_id,
+            simulation.time, simulation.steps, self.scheduler.steps_per_second, self.done
+        )
+        if( meta == self._published ):
+            return True
+        if( not self.state.write(store, particles, meta) ):
+            return False
+        self._published = meta
+        return True
+
+    def do_pause(self, paused):
+        self.paused = paused
+
+    def do_settings(self, values):
+        for name, value in values.items():
+            setattr(self.simulation.settings, name, value)
+
+    def do_add_body(self, position, velocity, mass, radius, tag, sun=False):
+        self.simulation.add_body(Vector2(*position), Vector2(*velocity), mass, radius, tag, sun)
+
+    def do_spawn_sun(self):
+        self.simulation.spawn_sun()
+
+    def do_remove(self, ids):
+        # Bodies may have merged away since the GUI asked
+        rows = self.simulation.store.rows(ids)
+        self.simulation.remove_bodies(rows[rows >= 0])
+
+    def do_reset_sun(self):
+        store = self.simulation.store
+        store.position[store.sun] = 0.0
+        store.velocity[store.sun] = 0.0
+
+    def do_clear_particles(self):
+        self.simulation.particles.clear()
+
+    def do_add_asteroid_belt(self, count, inner_au, outer_au):
+        self.simulation.add_asteroid_belt(count, inner_au, outer_au)
+
+    def do_load_scenario(self, path):
+        added = load_scenario(path, self.simulation)
+        self.send('result', 'load_scenario', len(added), self.done)
+
+    def do_time_warp(self, t):
+        self.send('result', 'time_warp', time_warp(self.simulation, t), self.done)
+
+    def do_attach(self, name, capacity, particle_capacity):
+        # Publish into a larger block from now on
+        self.state.close()
+        self.state = SharedState(capacity, particle_capacity, name)
+        self._growing = False
+        self._published = None
+
+    def do_stop(self):
+        self.running = False
+
+
+def run_worker(data, diagnostics, name, capacity, particle_capacity, commands, events):
+
+    # Entry point of the worker process
+    state = SharedState(capacity, particle_capacity, name)
+    worker = PhysicsWorker(data, diagnostics, state, commands, events)
+    try:
+        worker.run()
+    except Exception:
+        events.put(('failed', traceback.format_exc()))
+        raise
+    finally:
+        worker.state.close()
+
+
+class PhysicsClient:
+
+    """
+    Runs the physics of a Simulation in a worker process, on another core
+
+    The GUI keeps drawing `simulation`, which becomes a mirror of the worker's
+    simulation: every update its BodyStore and ParticleSet are pointed at the
+    arrays of the latest frame in a SharedState, nothing is copied or pickled.
+    Only the tags of new bodies and diagnostics samples come over a queue, and
+    only when they change. A slow step holds up the worker, never the GUI.
+
+    Settings other than zoom and pause are sent to the worker when they change.
+    Everything else that changes the simulation has to go through send, see
+    the do_ methods of PhysicsWorker. Its results are collected in `results`.
+    """
+
+    def __init__(self, simulation) -> None:
+        # Processes started by fork would inherit the Tk connection of the GUI
+        context = multiprocessing.get_context('spawn')
+        self.state = SharedState(simulation.store.capacity, simulation.particles.capacity)
+        # Larger block sent to the worker, used once the worker published into it
+        self.pending = None
+        self.commands = context.Queue()
+        self.events = context.Queue()
+
+        diagnostics = simulation.diagnostics
+        if( diagnostics is not None ):
+            diagnostics = (diagnostics.interval, diagnostics.threshold, diagnostics.capacity)
+        self.process = context.Process(
+            target=run_worker,
+            args=(snapshot(simulation), diagnostics, self.state.name, self.state.capacity,
+                  self.state.particle_capacity, self.commands, self.events),
+            daemon=True
+        )
+        self.process.start()
+
+        # Frame shown, layout of its rows and the newest layout whose tags came in
+        self.frame = None
+        self.layout = 0
+        self.received = 0
+        store = simulation.store
+        self.tags = dict(zip(store.ids.tolist(), store.tags))
+        # Settings and pause state the worker has
+        self.sent = self._settings(simulation.settings)
+        self.paused = False
+        self.steps_per_second = 0.0
+        # ( "result", command, value, done ) and ( "error", command, message, done ) of finished commands
+        self.results = []
+        # Commands the frame shown reflects
+        self.done = 0
+        self.failure = None
+        self.stopped = False
+
+    def send(self, name, *args):
+        # Have the worker carry out a command, see PhysicsWorker
+        self.commands.put((name,) + args)
+
+    def _settings(self, settings):
+        # Settings the physics depends on, zoom only changes the view
+        values = dict(vars(settings))
+        values.pop('zoom', None)
+        return values
+
+    def take_results(self):
+
+        # ( kind, command, value ) of the finished commands whose effect the frame shown has
+        ready = [(kind, command, value) for kind, command, value, done in self.results if done <= self.done]
+        self.results = [result for result in self.results if result[3] > self.done]
+        return ready
+
+    def update(self, simulation, paused=False):
+
+        """
+        Send changed settings and take the latest frame of the worker into simulation
+
+        Returns the number of steps the worker ran since the last frame,
+        raises RuntimeError if the worker process died
+        """
+
+        settings = self._settings(simulation.settings)
+        if( settings != self.sent ):
+            self.send('settings', {name: value for name, value in settings.items() if self.sent.get(name) != value})
+            self.sent = settings
+        if( paused != self.paused ):
+            self.paused = paused
+            self.send('pause', paused)
+
+        while( True ):
+            try:
+                self.handle(self.events.get_nowait(), simulation)
+            except queue.Empty:
+                break
+
+        if( self.process.exitcode is not None ):
+            raise RuntimeError(self.failure or f"physics worker exited with code {self.process.exitcode}")
+        return self.take_frame(simulation)
+
+    def next_event(self):
+
+        # Wait for the next event of the worker
+        while( True ):
+            try:
+                return self.events.get(timeout=0.1)
+            except queue.Empty:
+                if( not self.process.is_alive() ):
+                    raise RuntimeError(self.failure or "physics worker exited") from None
+
+    def handle(self, event, simulation):
+
+        name = event[0]
+        if( name == 'bodies' ):
+            _, layout, ids, tags = event
+            self.tags.update(zip(ids.tolist(), tags))
+            self.received = layout
+        elif( name == 'sample' ):
+            if( simulation.diagnostics is not None ):
+                simulation.diagnostics.append(event[1])
+        elif( name == 'grow' ):
+            self.grow(*event[1:])
+        elif( name == 'stopped' ):
+            self.stopped = True
+        elif( name == 'failed' ):
+            self.failure = event[1]
+        else:
+            self.results.append(event)
+
+    def grow(self, bodies, particles):
+
+        # Give the worker a block large enough for its state, a block it did not publish into yet goes
+        if( self.pending is not None ):
+            self.pending.close()
+            self.pending.unlink()
+        capacity = max(self.state.capacity, 1 << max(4, (bodies - 1).bit_length()))
+        particle_capacity = max(self.state.particle_capacity, 1 << max(10, (particles - 1).bit_length()))
+        self.pending = SharedState(capacity, particle_capacity)
+        self.send('attach', self.pending.name, capacity, particle_capacity)
+
+    def take_frame(self, simulation):
+
+        # Point simulation at the arrays of the latest frame, returns the steps run since the last one
+        old = None
+        if( self.pending is not None and self.pending.published ):
+            old, self.state, self.pending = self.state, self.pending, None
+            self.frame = None
+
+        index = self.state.acquire()
+        if( index is None or index == self.frame ):
+            return 0
+        frame = self.state.frames[index]
+        count, particles, layout, next_id, t, steps, steps_per_second, done = frame['meta'].tolist()
+        layout = int(layout)
+        # The tags of the new rows are sent before the frame, they may still be on their way
+        while( self.received < layout ):
+            self.handle(self.next_event(), simulation)
+        self.frame = index
+
+        store = simulation.store
+        store.attach(frame, int(count))
+        if( layout != self.layout ):
+            self.layout = layout
+            ids = store.ids.tolist()
+            store.reindex([self.tags[body_id] for body_id in ids], int(next_id))
+            # Forget the tags of removed bodies once they are the most
+            if( len(self.tags) > 2 * len(ids) + 1024 ):
+                self.tags = dict(zip(ids, store.tags))
+        simulation.particles.attach(frame['particle_position'], frame['particle_velocity'], int(particles))
+
+        ran = int(steps) - simulation.steps
+        simulation.time = t
+        simulation.steps = int(steps)
+        self.steps_per_second = steps_per_second
+        self.done = int(done)
+        if( old is not None ):
+            old.close()
+            old.unlink()
+
+        if( simulation.recorder is not None ):
+            simulation.recorder.record(simulation)
+        return ran
+
+    def stop(self, simulation):
+
+        # Stop the worker, simulation keeps the last frame it published in arrays of its own
+        if( self.process.is_alive() ):
+            self.send('stop')
+            deadline = time.perf_counter() + STOP_TIMEOUT
+            while( not self.stopped and time.perf_counter() < deadline ):
+                try:
+                    self.handle(self.next_event(), simulation)
+                except RuntimeError:
+                    break
+        self.process.join(STOP_TIMEOUT if self.stopped else 0.1)
+        if( self.process.is_alive() ):
+            self.process.terminate()
+            self.process.join()
+
+        try:
+            self.take_frame(simulation)
+        except RuntimeError:
+            # The tags of the last frame never came, the frame shown before it is kept
+            pass
+        simulation.store.detach()
+        simulation.particles.detach()
+
+        for state in (self.state, self.pending):
+            if( state is not None ):
+                state.close()
+                state.unlink()
+        self.commands.cancel_join_thread()
+        self.commands.close()
+        self.events.close()